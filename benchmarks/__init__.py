@@ -0,0 +1,5 @@
+"""Offline benchmarks of the API, auth, storage and scheduler hot paths.
+
+`yt_dlp.YoutubeDL` is replaced by `fake_ytdlp.FakeYoutubeDL`, so nothing
+touches the network. See `__main__` for usage.
+"""
@@ -0,0 +1,116 @@
+"""Run the benchmarks: `python -m benchmarks [--quick] [--only http,auth] [--output FILE] [--compare FILE]`.
+
+Each benchmark runs in its own interpreter, against its own temporary
+directory, so module-level state such as the storage engine and the key
+registry starts fresh. The results are printed (or written to --output)
+as one JSON document. With --compare, throughput and median latencies
+are checked against an earlier result file, and the exit status is 1 if
+any got worse by more than --tolerance.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from typing import Any, Dict, Iterator, List, Tuple
+
+from benchmarks.common import ROOT
+
+BENCHMARKS = ('http', 'storage', 'auth', 'pipeline')
+
+# Metrics compared by --compare, and whether higher values are better
+COMPARED = {'rps': True, 'tasks_per_second': True, 'p50': False}
+
+def run_child(name: str, quick: bool) -> None:
+    module = __import__(f'benchmarks.bench_{name}', fromlist=['run'])
+    result = module.run(quick=quick)
+    # Daemon threads of the server may still be logging; keep stdout for the result
+    sys.stdout.write(json.dumps(result))
+    sys.stdout.flush()
+
+def run_isolated(name: str, quick: bool) -> Dict[str, Any]:
+    command = [sys.executable, '-m', 'benchmarks', '--child', name] + (['--quick'] if quick else [])
+    started = time.perf_counter()
+    process = subprocess.run(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f'Benchmark {name} failed with exit status {process.returncode}')
+    print(f'{name}: {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    return json.loads(process.stdout)
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def metrics(results: Dict[str, Any], path: Tuple[str, ...] = ()) -> Iterator[Tuple[str, str, float]]:
+    """(dotted path, metric name, value) of every compared metric in a result tree."""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            yield from metrics(value, path + (name,))
+        elif name in COMPARED and isinstance(value, (int, float)):
+            yield '.'.join(path + (name,)), name, value
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Descriptions of the metrics that regressed by more than `tolerance`."""
+    previous = {path: value for path, _, value in metrics(baseline['results'])}
+    regressions = []
+    for path, name, value in metrics(current['results']):
+        before = previous.get(path)
+        if not before:
+            continue
+        change = value / before - 1
+        worse = -change if COMPARED[name] else change
+        if worse > tolerance:
+            regressions.append(f'{path}: {before} -> {value} ({change:+.0%})')
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Offline server benchmarks.')
+    parser.add_argument('--quick', action='store_true', help='smaller data sets and fewer requests')
+    parser.add_argument('--only', help=f'comma-separated subset of {",".join(BENCHMARKS)}')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change counted as a regression (default 0.2)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.quick)
+        return 0
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': args.quick,
+        },
+        'results': {name: run_isolated(name, args.quick) for name in names},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
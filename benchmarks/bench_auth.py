@@ -0,0 +1,45 @@
+"""Latency of `require_permission` with many API keys on file."""
+import random
+from typing import Any, Dict
+
+from benchmarks.common import setup, measure
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    setup(NODE_ROLE='api', QUEUE_BACKEND='sqlite')
+    from src import server
+    from src.auth import AuthManager, key_registry, require_permission
+    from src.models import ApiKey
+
+    key_count = 1000
+    calls = 5000 if quick else 50000
+    keys = {f'key{i}': AuthManager.generate_key() for i in range(key_count)}
+
+    def add(existing):
+        for name, key in keys.items():
+            existing[name] = ApiKey(key=key, name=name, permissions=['get_video', 'get_audio', 'get_info'],
+                                    memory_quota=1, last_access='2024-01-01T00:00:00',
+                                    rate_limit=calls).to_dict()
+    key_registry.update(add)
+
+    allowed = require_permission('get_info')(lambda: 'ok')
+    forbidden = require_permission('create_key')(lambda: 'ok')
+    rng = random.Random(0)
+    names = list(keys)
+
+    def call(view, headers):
+        def timed(i: int) -> None:
+            with server.app.test_request_context(headers=headers(i)):
+                view()
+        return timed
+
+    def key_headers(i: int) -> Dict[str, str]:
+        return {'X-API-Key': keys[rng.choice(names)]}
+
+    return {
+        'keys': key_count,
+        # Every sample includes pushing a request context; `request_context` is that alone
+        'allowed': measure(call(allowed, key_headers), calls, budget=30),
+        'forbidden': measure(call(forbidden, key_headers), calls, budget=30),
+        'unknown_key': measure(call(allowed, lambda i: {'X-API-Key': 'invalid'}), calls, budget=30),
+        'request_context': measure(call(lambda: None, key_headers), calls, budget=30),
+    }
@@ -0,0 +1,52 @@
+"""Request throughput of the task endpoints through the Flask test client.
+
+The server runs as an API node on the 'sqlite' queue, so submitted tasks
+are queued but never downloaded while requests are being measured.
+"""
+import random
+from typing import Any, Dict
+
+from benchmarks.common import setup, throughput
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    setup(NODE_ROLE='api', QUEUE_BACKEND='sqlite')
+    from src import server
+    from src.auth import auth_manager
+    from src.models import Task, TaskStatus, TaskType
+    from src.storage import Storage
+
+    requests = 500 if quick else 5000
+    key = auth_manager.create_key(
+        'bench', ['get_video', 'get_audio', 'get_info'], rate_limit=10 * requests)
+    headers = {'X-API-Key': key}
+    client = server.app.test_client()
+
+    tasks = {
+        f'bench{i:011d}': Task(
+            task_id=f'bench{i:011d}', key_name='bench', status=TaskStatus.COMPLETED,
+            task_type=TaskType.GET_AUDIO, url=f'https://bench.invalid/watch?v={i}',
+            file=f'/files/bench{i:011d}/audio.m4a', completed_time='2024-01-01T00:00:00'
+        ).to_dict()
+        for i in range(1000)
+    }
+    Storage.add_tasks(tasks)
+    task_ids = list(tasks)
+    rng = random.Random(0)
+
+    def status(i: int) -> None:
+        response = client.get(f'/status/{rng.choice(task_ids)}', headers=headers)
+        assert response.status_code == 200, response.status_code
+
+    def submit(endpoint: str):
+        def call(i: int) -> None:
+            response = client.post(endpoint, json={'url': f'https://bench.invalid/watch?v={endpoint}{i}'},
+                                   headers=headers)
+            assert response.status_code == 200, response.status_code
+        return call
+
+    return {
+        'status': throughput(status, requests),
+        'get_video': throughput(submit('/get_video'), requests),
+        'get_audio': throughput(submit('/get_audio'), requests),
+        'get_info': throughput(submit('/get_info'), requests),
+    }
@@ -0,0 +1,54 @@
+"""End-to-end task throughput through the scheduler and worker pools.
+
+Tasks are added to storage and queued the way `create_task` does, then
+run by the real scheduler, estimator, quota and disk checks on the fake
+extractor. Audio is written as m4a, so no task needs the post-processing
+processes.
+"""
+import time
+from typing import Any, Dict
+
+from benchmarks.common import setup, percentiles
+
+MIX = ('get_video', 'get_audio', 'get_info')
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    # The host filesystem's own usage must not get downloads rejected
+    setup(DISK_HIGH_WATERMARK=1.0)
+    from src import yt_handler
+    from src.models import Task, TaskStatus, TaskType
+    from src.storage import Storage
+
+    count = 300 if quick else 3000
+    downloader = yt_handler.downloader
+    downloader.initialize()
+
+    tasks = {
+        f'pipe{i:012d}': Task(
+            task_id=f'pipe{i:012d}', key_name='admin', status=TaskStatus.WAITING,
+            task_type=TaskType(MIX[i % len(MIX)]), url=f'https://bench.invalid/watch?v={i}'
+        ).to_dict()
+        for i in range(count)
+    }
+    started = time.perf_counter()
+    Storage.add_tasks(tasks)
+    for task_id, task in tasks.items():
+        downloader.enqueue(task_id, task)
+    active = [TaskStatus.WAITING.value, TaskStatus.PROCESSING.value]
+    while Storage.count_tasks(status=active):
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    finished = Storage.find_tasks()
+    errors = sorted({task.get('error') for task in finished.values()
+                     if task['status'] == TaskStatus.ERROR.value})
+    totals = [task['timings']['total'] for task in finished.values() if task.get('timings')]
+    return {
+        'tasks': count,
+        'seconds': round(elapsed, 3),
+        'tasks_per_second': round(count / elapsed, 1),
+        'failed': sum(1 for task in finished.values() if task['status'] == TaskStatus.ERROR.value),
+        'errors': errors[:5],
+        # Time each task spent running, from its trace; excludes waiting in the queue
+        'task_latency_ms': percentiles(totals) if totals else None,
+    }
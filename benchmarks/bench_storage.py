@@ -0,0 +1,47 @@
+"""Latency of the task storage engines at growing task counts."""
+import os
+import random
+from typing import Any, Dict
+
+from benchmarks.common import setup, measure
+
+STATUSES = ('waiting', 'processing', 'completed', 'error')
+
+def make_tasks(count: int) -> Dict[str, Dict[str, Any]]:
+    from src.models import Task, TaskStatus, TaskType
+    return {
+        f'task{i:012d}': Task(
+            task_id=f'task{i:012d}', key_name=f'key{i % 50}', status=TaskStatus(STATUSES[i % len(STATUSES)]),
+            task_type=TaskType.GET_VIDEO, url=f'https://bench.invalid/watch?v={i}',
+            video_format='bestvideo[height<=1080]', audio_format='bestaudio', output_format='mp4',
+            file=f'/files/task{i:012d}/video.mp4', completed_time='2024-01-01T00:00:00'
+        ).to_dict()
+        for i in range(count)
+    }
+
+def bench_engine(engine, tasks: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    task_ids = list(tasks)
+    rng = random.Random(0)
+    results = {
+        'save_tasks': measure(lambda i: engine.save_tasks(tasks), 3),
+        'load_tasks': measure(lambda i: engine.load_tasks(), 3),
+        'get_task': measure(lambda i: engine.get_task(rng.choice(task_ids)), 1000),
+        'update_task': measure(lambda i: engine.update_task(rng.choice(task_ids), status='completed'), 200),
+        'find_tasks': measure(lambda i: engine.find_tasks(status=['waiting', 'processing']), 20),
+        'count_tasks': measure(lambda i: engine.count_tasks(status=['waiting']), 20),
+    }
+    return results
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    workdir = setup()
+    from src.storage import SqliteStorageEngine, JsonStorageEngine
+
+    sizes = (1000, 10000) if quick else (1000, 10000, 100000)
+    results: Dict[str, Any] = {}
+    for size in sizes:
+        tasks = make_tasks(size)
+        sqlite_engine = SqliteStorageEngine(os.path.join(workdir, f'storage-{size}.db'))
+        results[f'sqlite.{size}'] = bench_engine(sqlite_engine, tasks)
+        json_engine = JsonStorageEngine(os.path.join(workdir, f'tasks-{size}.json'))
+        results[f'json.{size}'] = bench_engine(json_engine, tasks)
+    return results
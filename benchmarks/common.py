@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import tempfile
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setup(fake_extractor: bool = True, **overrides) -> str:
+    """Point the server at a fresh temporary directory; call before importing `src`.
+
+    `overrides` are config values by name (e.g. NODE_ROLE='api'), set on
+    whichever config section defines them. Unless `fake_extractor` is
+    False, yt-dlp is replaced by `fake_ytdlp`. Returns the directory.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import config
+    from benchmarks import fake_ytdlp
+
+    workdir = tempfile.mkdtemp(prefix='ytdlp-bench-')
+    os.chdir(workdir)
+    os.makedirs('jsons')
+    config.storage.DOWNLOAD_DIR = os.path.join(workdir, 'downloads')
+    config.log.LOG_LEVEL = 'WARNING'
+    sections = [config.storage, config.task, config.memory, config.auth, config.cache, config.log]
+    for name, value in overrides.items():
+        section = next((s for s in sections if hasattr(s, name)), None)
+        if section is None:
+            raise ValueError(f'Unknown config value: {name}')
+        setattr(section, name, value)
+    if fake_extractor:
+        fake_ytdlp.install()
+    return workdir
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summary of durations in seconds, reported in milliseconds."""
+    ordered = sorted(samples)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 4)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 4),
+        'p50': at(0.50),
+        'p95': at(0.95),
+        'p99': at(0.99),
+        'max': round(ordered[-1] * 1000, 4),
+    }
+
+def measure(fn: Callable[[int], Any], count: int, budget: float = 5.0) -> Dict[str, float]:
+    """Latency of `fn(i)` for i in range(count).
+
+    Stops early once `budget` seconds have passed, so slow operations on
+    large data sets still finish; the summary records how many calls ran.
+    """
+    samples = []
+    deadline = time.perf_counter() + budget
+    for i in range(count):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+        if started > deadline and len(samples) >= 3:
+            break
+    return percentiles(samples)
+
+def throughput(fn: Callable[[int], Any], count: int) -> Dict[str, Any]:
+    """Latency summary of `count` sequential calls, plus calls per second."""
+    samples = []
+    started = time.perf_counter()
+    for i in range(count):
+        call_started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return {'rps': round(count / elapsed, 1), 'seconds': round(elapsed, 3), 'latency_ms': percentiles(samples)}
@@ -0,0 +1,77 @@
+"""Offline stand-in for `yt_dlp.YoutubeDL`.
+
+Every URL extracts to the same canned video: one audio and one video
+format with exact sizes, so size estimation needs no HEAD requests.
+Downloads write `FILE_SIZE` bytes of zeros to the output template. The
+info dicts differ only in their id, taken from the URL, so distinct URLs
+are distinct downloads for the content cache.
+"""
+import copy
+import hashlib
+from typing import Any, Dict, Optional
+
+import yt_dlp
+
+FILE_SIZE = 256 * 1024
+
+AUDIO_FORMAT = {
+    'format_id': '140', 'ext': 'm4a', 'acodec': 'mp4a.40.2', 'vcodec': 'none',
+    'abr': 129.5, 'audio_channels': 2, 'protocol': 'https',
+}
+VIDEO_FORMAT = {
+    'format_id': '137', 'ext': 'mp4', 'acodec': 'none', 'vcodec': 'avc1.640028',
+    'height': 1080, 'width': 1920, 'fps': 30, 'format_note': '1080p', 'protocol': 'https',
+}
+
+def canned_info(url: str) -> Dict[str, Any]:
+    video_id = hashlib.sha1(url.encode()).hexdigest()[:11]
+    formats = [{**fmt, 'url': f'https://media.invalid/{video_id}/{fmt["format_id"]}', 'filesize': FILE_SIZE}
+               for fmt in (AUDIO_FORMAT, VIDEO_FORMAT)]
+    return {
+        'id': video_id,
+        'title': f'Benchmark - {video_id}',
+        'duration': 213,
+        'webpage_url': url,
+        'extractor': 'fake',
+        'extractor_key': 'Fake',
+        'formats': formats,
+    }
+
+class FakeYoutubeDL:
+    def __init__(self, params: Optional[Dict[str, Any]] = None, auto_init: bool = True):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def extract_info(self, url: str, download: bool = True, process: bool = True, **kwargs) -> Dict[str, Any]:
+        info = canned_info(url)
+        return self.process_ie_result(info, download=download) if process else info
+
+    def process_ie_result(self, info: Dict[str, Any], download: bool = True, **kwargs) -> Dict[str, Any]:
+        info = copy.deepcopy(info)
+        audio, video = info['formats']
+        if 'video' in self.params.get('format', ''):
+            info.update(format_id=f"{video['format_id']}+{audio['format_id']}", ext='mp4',
+                        requested_formats=[video, audio])
+        else:
+            info.update(audio)
+        if download:
+            self._download(info)
+        return info
+
+    def _download(self, info: Dict[str, Any]) -> None:
+        path = self.params['outtmpl'] % {'ext': info['ext']}
+        with open(path, 'wb') as f:
+            f.write(bytes(FILE_SIZE))
+        info['filepath'] = path
+        for hook in self.params.get('progress_hooks', []):
+            hook({'status': 'finished', 'filename': path,
+                  'downloaded_bytes': FILE_SIZE, 'total_bytes': FILE_SIZE})
+
+def install() -> None:
+    """Replace `yt_dlp.YoutubeDL` for every module that looks it up at call time."""
+    yt_dlp.YoutubeDL = FakeYoutubeDL
@@ -1,17 +1,50 @@
+import os
 from dataclasses import dataclass
-from typing import Final
+from typing import Final, Optional
 
 @dataclass
 class StorageConfig:
     DOWNLOAD_DIR: Final[str] = '/app/downloads'
     TASKS_FILE: Final[str] = 'jsons/tasks.json'
     KEYS_FILE: Final[str] = 'jsons/api_keys.json'
+    TASKS_BACKEND: Final[str] = 'sqlite'
+    DATABASE_FILE: Final[str] = 'jsons/storage.db'
+    FILE_ACCEL: Final[Optional[str]] = None
+    FILE_ACCEL_PREFIX: Final[str] = '/protected/'
 
 @dataclass
 class TaskConfig:
     CLEANUP_TIME_MINUTES: Final[int] = 10
     REQUEST_LIMIT: Final[int] = 60
+    RATE_LIMIT_WINDOW_SECONDS: Final[int] = 600
+    RATE_LIMIT_BACKEND: Final[str] = 'memory'
     MAX_WORKERS: Final[int] = 4
+    INFO_WORKERS: Final[int] = 2
+    LIVE_WORKERS: Final[int] = 2
+    POSTPROCESS_WORKERS: Final[int] = os.cpu_count() or 1
+    NODE_ROLE: Final[str] = 'all'
+    QUEUE_BACKEND: Final[str] = 'local'
+    QUEUE_LEASE_SECONDS: Final[int] = 60
+    QUEUE_POLL_SECONDS: Final[float] = 1.0
+    QUEUE_MAX_ATTEMPTS: Final[int] = 3
+    MAX_PRIORITY: Final[int] = 10
+    CLEANUP_INTERVAL_SECONDS: Final[int] = 10
+    MAX_BATCH_SIZE: Final[int] = 1000
+    MAX_PLAYLIST_ENTRIES: Final[int] = 500
+    PROGRESS_EVENT_INTERVAL: Final[float] = 0.5
+    SSE_KEEPALIVE_SECONDS: Final[int] = 15
+    MAX_STATUS_WAIT_SECONDS: Final[int] = 60
+    STREAM_START_TIMEOUT_SECONDS: Final[int] = 30
+    STREAM_POLL_SECONDS: Final[float] = 0.5
+    SEARCH_WORKERS: Final[int] = 4
+    SEARCH_MAX_PENDING: Final[int] = 32
+    SEARCH_TIMEOUT_SECONDS: Final[int] = 20
+    SEARCH_MAX_LIMIT: Final[int] = 50
+    WEBHOOK_WORKERS: Final[int] = 2
+    WEBHOOK_TIMEOUT_SECONDS: Final[int] = 10
+    WEBHOOK_MAX_ATTEMPTS: Final[int] = 5
+    WEBHOOK_BACKOFF_SECONDS: Final[int] = 2
+    WEBHOOK_MAX_BACKOFF_SECONDS: Final[int] = 300
 
 @dataclass
 class MemoryConfig:
@@ -19,8 +52,43 @@ class MemoryConfig:
     DEFAULT_QUOTA_BYTES: Final[int] = 5 * 1024 * 1024 * 1024
     QUOTA_RATE_MINUTES: Final[int] = 10
     SIZE_BUFFER: Final[float] = 1.10
-    AVAILABLE_BYTES: Final[int] = 20 * 1024 * 1024 * 1024
+    DISK_HIGH_WATERMARK: Final[float] = 0.90
+    DISK_LOW_WATERMARK: Final[float] = 0.80
+    DISK_EVICT_MIN_AGE_SECONDS: Final[int] = 60
+
+@dataclass
+class AuthConfig:
+    KEY_FLUSH_SECONDS: Final[int] = 30
+    KEY_RELOAD_CHECK_SECONDS: Final[float] = 1.0
+
+@dataclass
+class LogConfig:
+    LOG_LEVEL: Final[str] = 'INFO'
+    LOG_FORMAT: Final[str] = 'text'
+    LOG_QUEUE_SIZE: Final[int] = 10000
+    LOG_SAMPLE_BURST: Final[int] = 20
+    LOG_SAMPLE_WINDOW_SECONDS: Final[float] = 60.0
+    PROFILE_THRESHOLD_SECONDS: Final[Optional[float]] = None
+    PROFILE_INTERVAL_SECONDS: Final[float] = 0.01
+    PROFILE_DIR: Final[str] = 'jsons/profiles'
+    PROFILE_MAX_FILES: Final[int] = 100
+
+@dataclass
+class CacheConfig:
+    INFO_TTL_SECONDS: Final[int] = 300
+    INFO_MAX_ENTRIES: Final[int] = 256
+    INFO_MAX_BYTES: Final[int] = 256 * 1024 * 1024
+    INFO_FILE_MAX_ENTRIES: Final[int] = 64
+    INFO_FILE_MAX_BYTES: Final[int] = 64 * 1024 * 1024
+    SEARCH_TTL_SECONDS: Final[int] = 600
+    SEARCH_MAX_ENTRIES: Final[int] = 1024
+    ESTIMATE_TTL_SECONDS: Final[int] = 300
+    ESTIMATE_MAX_ENTRIES: Final[int] = 1024
+    ESTIMATE_HEAD_TIMEOUT_SECONDS: Final[int] = 5
 
 storage = StorageConfig()
 task = TaskConfig()
 memory = MemoryConfig()
+auth = AuthConfig()
+cache = CacheConfig()
+log = LogConfig()
@@ -0,0 +1 @@
+"""Load tests against a local synthetic media origin. See `__main__` for usage."""
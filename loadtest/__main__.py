@@ -0,0 +1,381 @@
+"""Drive the server with many concurrent clients: `python -m loadtest [options]`.
+
+By default this starts a synthetic media origin (`loadtest.origin`) and
+the real server (`loadtest.serve`) on local ports, so a run needs no
+network access. With --server, an already running server is driven
+instead; it must be able to reach the origin at --origin-host.
+
+Each client is a thread with its own keep-alive connection that issues
+requests back to back (or with --think seconds between them), picking
+the operation from --mix:
+
+- get_info / get_audio / get_video: submit a task for a media URL on the
+  origin. --distinct bounds the number of different media ids, so the
+  info and content caches see repeats.
+- status: `/status/<task_id>` of a task submitted earlier.
+- files: download the file of a task seen completed.
+
+Operations with nothing to act on yet (no tasks, no files) are skipped
+when picking. At the end, unfinished tasks are polled for up to --drain
+seconds, and a JSON report with latency percentiles, throughput, HTTP
+status counts and task outcomes is printed or written to --output.
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.common import ROOT, percentiles
+from loadtest.origin import MediaOrigin, DEFAULT_SIZE, parse_rate
+
+OPERATIONS = ('get_info', 'get_audio', 'get_video', 'status', 'files')
+SUBMIT_EXT = {'get_info': 'mp4', 'get_audio': 'mp3', 'get_video': 'mp4'}
+FINAL_STATUSES = ('completed', 'error')
+# Seconds the server gets to exit after SIGTERM
+SHUTDOWN_TIMEOUT = 30
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """'get_audio=3,status=10' -> {'get_audio': 3.0, 'status': 10.0}."""
+    mix = {}
+    for part in filter(None, spec.split(',')):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown operation {name!r}; expected one of {", ".join(OPERATIONS)}')
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError('The mix has no operations')
+    return mix
+
+class Results:
+    """Latencies, status codes and bytes per operation, shared by all clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.codes: Dict[str, Counter] = {op: Counter() for op in OPERATIONS}
+        self.bytes: Counter = Counter()
+
+    def record(self, op: str, seconds: float, code: str, size: int = 0) -> None:
+        with self._lock:
+            self.latencies[op].append(seconds)
+            self.codes[op][code] += 1
+            self.bytes[op] += size
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        with self._lock:
+            operations = {
+                op: {
+                    'requests': len(samples),
+                    'rps': round(len(samples) / elapsed, 1),
+                    'codes': dict(self.codes[op]),
+                    'latency_ms': percentiles(samples),
+                    **({'bytes': self.bytes[op], 'mb_per_second': round(self.bytes[op] / elapsed / 1024 ** 2, 3)}
+                       if self.bytes[op] else {}),
+                }
+                for op, samples in self.latencies.items() if samples
+            }
+        total = sum(op['requests'] for op in operations.values())
+        return {'requests': total, 'rps': round(total / elapsed, 1), 'operations': operations}
+
+class TaskBook:
+    """Tasks submitted during the run, and what clients have seen of them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.submitted: Dict[str, Tuple[float, str]] = {}
+        self.finished: Dict[str, Tuple[float, str, Optional[str]]] = {}
+        self.files: List[str] = []
+        self._ids: List[str] = []
+
+    def add(self, task_id: str, api_key: str) -> None:
+        with self._lock:
+            self.submitted[task_id] = (time.monotonic(), api_key)
+            self._ids.append(task_id)
+
+    def seen(self, task_id: str, status: Dict[str, Any]) -> None:
+        if status.get('status') not in FINAL_STATUSES:
+            return
+        with self._lock:
+            if task_id in self.finished:
+                return
+            self.finished[task_id] = (time.monotonic(), status['status'], status.get('error'))
+            if status['status'] == 'completed' and status.get('file'):
+                self.files.append(status['file'])
+
+    def has(self, op: str) -> bool:
+        """Whether there is anything for `op` to act on yet."""
+        return bool(self._ids) if op == 'status' else bool(self.files) if op == 'files' else True
+
+    def pick_task(self, rng: random.Random) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            if not self._ids:
+                return None
+            task_id = rng.choice(self._ids)
+            return task_id, self.submitted[task_id][1]
+
+    def pick_file(self, rng: random.Random) -> Optional[str]:
+        with self._lock:
+            return rng.choice(self.files) if self.files else None
+
+    def unfinished(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            return [(task_id, key) for task_id, (_, key) in self.submitted.items() if task_id not in self.finished]
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = Counter(status for _, status, _ in self.finished.values())
+            errors = Counter(error for _, status, error in self.finished.values() if status == 'error')
+            turnaround = [finished - self.submitted[task_id][0]
+                          for task_id, (finished, status, _) in self.finished.items() if status == 'completed']
+            return {
+                'submitted': len(self.submitted),
+                'completed': outcomes['completed'],
+                'error': outcomes['error'],
+                'unfinished': len(self.submitted) - len(self.finished),
+                'errors': dict(errors.most_common(5)),
+                # From submission until a client first saw the task completed
+                'turnaround_ms': percentiles(turnaround) if turnaround else None,
+            }
+
+class Connection:
+    """A keep-alive connection that reconnects after errors."""
+
+    def __init__(self, base_url: str, timeout: float):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def request(self, method: str, path: str, api_key: Optional[str] = None,
+                body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        headers = {'X-API-Key': api_key} if api_key else {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self._conn.request(method, path, body=data, headers=headers)
+            response = self._conn.getresponse()
+            return response.status, response.read()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class Client(threading.Thread):
+    def __init__(self, index: int, args: argparse.Namespace, mix: Dict[str, float], api_keys: List[str],
+                 origin_url: str, results: Results, book: TaskBook, stop: threading.Event):
+        super().__init__(name=f'client-{index}', daemon=True)
+        self.args = args
+        self.mix = mix
+        self.api_key = api_keys[index % len(api_keys)]
+        self.origin_url = origin_url
+        self.results = results
+        self.book = book
+        self.stop = stop
+        self.rng = random.Random(args.seed + index)
+        self.conn = Connection(args.server, args.timeout)
+        self.handlers = {'status': self._status, 'files': self._files}
+
+    def run(self) -> None:
+        while not self.stop.is_set():
+            op = self._pick()
+            started = time.perf_counter()
+            try:
+                code, size = self.handlers.get(op, self._submit)(op)
+            except Exception as e:
+                code, size = type(e).__name__, 0
+            self.results.record(op, time.perf_counter() - started, str(code), size)
+            if self.args.think:
+                self.stop.wait(self.args.think)
+        self.conn.close()
+
+    def _pick(self) -> str:
+        ops = [op for op, weight in self.mix.items() if weight and self.book.has(op)]
+        return self.rng.choices(ops, weights=[self.mix[op] for op in ops])[0]
+
+    def _submit(self, op: str) -> Tuple[int, int]:
+        media_id = f'media{self.rng.randrange(self.args.distinct)}'
+        url = f'{self.origin_url}/media/{media_id}.{SUBMIT_EXT[op]}?size={self.args.media_size}'
+        code, body = self.conn.request('POST', f'/{op}', self.api_key, {'url': url})
+        if code == 200:
+            self.book.add(json.loads(body)['task_id'], self.api_key)
+        return code, 0
+
+    def _status(self, op: str) -> Tuple[int, int]:
+        task_id, api_key = self.book.pick_task(self.rng)
+        code, body = self.conn.request('GET', f'/status/{task_id}', api_key)
+        if code == 200:
+            self.book.seen(task_id, json.loads(body))
+        return code, 0
+
+    def _files(self, op: str) -> Tuple[int, int]:
+        code, body = self.conn.request('GET', self.book.pick_file(self.rng))
+        return code, len(body)
+
+def free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+def start_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str, str]:
+    """Run `loadtest.serve` in a child process; returns it, its URL and the admin key."""
+    port = free_port('127.0.0.1')
+    command = [sys.executable, '-m', 'loadtest.serve', '--port', str(port)]
+    for override in args.set:
+        command += ['--set', override]
+    # Own process group, so stop_server can reach the post-processing workers too
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True, start_new_session=True)
+    line = process.stdout.readline()
+    if not line.startswith('READY '):
+        stop_server(process)
+        raise RuntimeError('The server did not start')
+    with open(f'{line.split(" ", 1)[1].strip()}/jsons/api_keys.json') as f:
+        admin_key = json.load(f)['admin']['key']
+    return process, f'http://127.0.0.1:{port}', admin_key
+
+def stop_server(process: subprocess.Popen) -> None:
+    """SIGTERM the server and wait for it to shut its worker pools down.
+
+    Whatever is left of its process group after SHUTDOWN_TIMEOUT seconds,
+    or after a clean exit, is killed.
+    """
+    process.terminate()
+    try:
+        process.wait(SHUTDOWN_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+def create_keys(args: argparse.Namespace, admin_key: str) -> List[str]:
+    """API keys for the clients, created with the admin key, without a practical rate limit."""
+    if not args.keys:
+        return [admin_key]
+    conn = Connection(args.server, args.timeout)
+    keys = []
+    for index in range(args.keys):
+        code, body = conn.request('POST', '/create_key', admin_key, {
+            'name': f'loadtest-{index}',
+            'permissions': ['get_info', 'get_audio', 'get_video'],
+            'rate_limit': 10 ** 9,
+        })
+        if code != 201:
+            raise RuntimeError(f'Could not create an API key ({code}): {body.decode()}')
+        keys.append(json.loads(body)['key'])
+    conn.close()
+    return keys
+
+def drain(args: argparse.Namespace, book: TaskBook) -> None:
+    """Poll the tasks not seen finished until they finish or --drain seconds pass."""
+    conn = Connection(args.server, args.timeout)
+    deadline = time.monotonic() + args.drain
+    while time.monotonic() < deadline:
+        pending = book.unfinished()
+        if not pending:
+            break
+        for task_id, api_key in pending:
+            try:
+                code, body = conn.request('GET', f'/status/{task_id}', api_key)
+            except Exception:
+                continue
+            if code == 200:
+                book.seen(task_id, json.loads(body))
+        time.sleep(0.25)
+    conn.close()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description='Load test the server.')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent clients (default 50)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load (default 30)')
+    parser.add_argument('--mix', default='get_info=1,get_audio=2,get_video=1,status=10,files=4',
+                        help=f'weights of {", ".join(OPERATIONS)} (default %(default)s)')
+    parser.add_argument('--think', type=float, default=0, help='seconds each client waits between requests')
+    parser.add_argument('--distinct', type=int, default=100, help='number of different media ids (default 100)')
+    parser.add_argument('--media-size', type=int, default=DEFAULT_SIZE, help='bytes per media file (default 1 MiB)')
+    parser.add_argument('--bandwidth', default='0', help='origin bandwidth per response, e.g. 2M; 0 for unlimited')
+    parser.add_argument('--latency', type=float, default=0, help='origin seconds before each response')
+    parser.add_argument('--origin-host', default='127.0.0.1', help='address the origin listens on and is reached at')
+    parser.add_argument('--server', help='URL of a running server; by default one is started locally')
+    parser.add_argument('--api-key', help='key with create_key permission for --server')
+    parser.add_argument('--keys', type=int, default=1,
+                        help='API keys to spread the clients over; 0 uses the admin or --api-key directly')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='config.py override for the local server, e.g. --set MAX_WORKERS=8')
+    parser.add_argument('--drain', type=float, default=30, help='seconds to wait for unfinished tasks (default 30)')
+    parser.add_argument('--timeout', type=float, default=60, help='request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.server and not args.api_key:
+        parser.error('--server needs --api-key')
+
+    origin = MediaOrigin(args.origin_host, 0, parse_rate(args.bandwidth), args.latency, args.media_size).start()
+    process = None
+    if args.server:
+        admin_key = args.api_key
+    else:
+        process, args.server, admin_key = start_server(args)
+    try:
+        api_keys = create_keys(args, admin_key)
+        results, book, stop = Results(), TaskBook(), threading.Event()
+        clients = [Client(i, args, mix, api_keys, origin.base_url, results, book, stop)
+                   for i in range(args.clients)]
+        print(f'Running {args.clients} clients against {args.server} for {args.duration:g}s', file=sys.stderr)
+        started = time.perf_counter()
+        for client in clients:
+            client.start()
+        stop.wait(args.duration)
+        stop.set()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - started
+        drain(args, book)
+
+        report = {
+            'config': {name: value for name, value in vars(args).items() if name not in ('api_key', 'output')},
+            'seconds': round(elapsed, 3),
+            **results.report(elapsed),
+            'tasks': book.report(),
+            'origin_bytes': origin.bytes_sent,
+        }
+    finally:
+        origin.shutdown()
+        if process is not None:
+            stop_server(process)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
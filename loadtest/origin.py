@@ -0,0 +1,189 @@
+"""Local stand-in for a media host: `python -m loadtest.origin [--port 8081] [--bandwidth 1M] [--latency 0.05]`.
+
+Serves synthetic files at `/media/<id>.<ext>?size=<bytes>`. The response
+carries an audio or video Content-Type, so yt-dlp's generic extractor
+treats the URL as a direct media link with `<id>` as the video id; the
+same id is the same file, different ids are different videos. `.mp3`
+files are made of valid MPEG frames, so ID3 tagging works on them.
+Range requests are supported, and every response can be slowed to a
+given bandwidth and delayed by a fixed latency.
+"""
+import re
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_SIZE = 1024 * 1024
+MAX_SIZE = 4 * 1024 ** 3
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'mp3': 'audio/mpeg',
+    'm4a': 'audio/mp4',
+    'mp4': 'video/mp4',
+    'webm': 'video/webm',
+}
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, no padding: 417-byte frames
+MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+
+MEDIA_PATH = re.compile(r'^/media/(?P<id>[\w-]+)\.(?P<ext>\w+)$')
+
+def parse_rate(value: str) -> float:
+    """'512K', '2M', '1.5G' or a plain number, in bytes per second."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+class MediaFile:
+    """Deterministic content of one synthetic file, produced on demand."""
+
+    def __init__(self, media_id: str, ext: str, size: int):
+        self.size = size
+        if ext == 'mp3':
+            self.block = MP3_FRAME * (CHUNK_SIZE // len(MP3_FRAME) + 2)
+            self.period = len(MP3_FRAME)
+        else:
+            seed = hashlib.sha256(media_id.encode()).digest()
+            self.block = seed * (CHUNK_SIZE // len(seed) + 2)
+            self.period = len(seed)
+
+    def read(self, start: int, length: int) -> bytes:
+        """`length` bytes from `start`; `length` is at most CHUNK_SIZE."""
+        offset = start % self.period
+        return self.block[offset:offset + length]
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'MediaOrigin'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def _media(self) -> Optional[Tuple[MediaFile, str]]:
+        url = urlsplit(self.path)
+        match = MEDIA_PATH.match(url.path)
+        if not match or match['ext'] not in CONTENT_TYPES:
+            return None
+        try:
+            size = int(parse_qs(url.query).get('size', [self.server.default_size])[0])
+        except ValueError:
+            return None
+        if not 0 < size <= MAX_SIZE:
+            return None
+        return MediaFile(match['id'], match['ext'], size), CONTENT_TYPES[match['ext']]
+
+    def _range(self, size: int) -> Optional[Tuple[int, int]]:
+        """(start, end) of a single satisfiable `bytes=` range, inclusive; None for the whole file."""
+        header = self.headers.get('Range', '')
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+        if not match or not any(match.groups()):
+            return None
+        first, last = match.groups()
+        if not first:
+            return max(0, size - int(last)), size - 1
+        if last and int(last) < int(first):
+            return None
+        return int(first), min(int(last), size - 1) if last else size - 1
+
+    def _serve(self, body: bool) -> None:
+        media = self._media()
+        if media is None:
+            self.send_error(404)
+            return
+        media_file, content_type = media
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        span = self._range(media_file.size)
+        if span is not None and span[0] >= media_file.size:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{media_file.size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start, end = span or (0, media_file.size - 1)
+        self.send_response(206 if span else 200)
+        if span:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{media_file.size}')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if body:
+            self._write(media_file, start, end + 1)
+
+    def _write(self, media_file: MediaFile, start: int, stop: int) -> None:
+        bandwidth = self.server.bandwidth
+        started = time.monotonic()
+        sent = 0
+        try:
+            while start < stop:
+                chunk = media_file.read(start, min(CHUNK_SIZE, stop - start))
+                self.wfile.write(chunk)
+                start += len(chunk)
+                sent += len(chunk)
+                self.server.count(len(chunk))
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+class MediaOrigin(ThreadingHTTPServer):
+    """The origin server; `bandwidth` is per response in bytes/s (0 for unlimited)."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, bandwidth: float = 0,
+                 latency: float = 0, default_size: int = DEFAULT_SIZE):
+        super().__init__((host, port), OriginHandler)
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.default_size = default_size
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def count(self, sent: int) -> None:
+        with self._lock:
+            self.bytes_sent += sent
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def media_url(self, media_id: str, ext: str, size: Optional[int] = None) -> str:
+        return f'{self.base_url}/media/{media_id}.{ext}' + (f'?size={size}' if size else '')
+
+    def start(self) -> 'MediaOrigin':
+        threading.Thread(target=self.serve_forever, name='origin', daemon=True).start()
+        return self
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m loadtest.origin', description='Synthetic media origin.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--bandwidth', default='0', help='per response, e.g. 512K or 2M; 0 for unlimited')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before each response')
+    parser.add_argument('--size', type=int, default=DEFAULT_SIZE, help='file size when the URL has no size')
+    args = parser.parse_args()
+    origin = MediaOrigin(args.host, args.port, parse_rate(args.bandwidth), args.latency, args.size)
+    print(f'Serving {origin.base_url}/media/<id>.<{"|".join(CONTENT_TYPES)}>[?size=<bytes>]')
+    origin.serve_forever()
+
+if __name__ == '__main__':
+    main()
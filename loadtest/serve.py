@@ -0,0 +1,52 @@
+"""Run the real server for a load test: `python -m loadtest.serve [--port 5000] [--set NAME=VALUE ...]`.
+
+The server runs on werkzeug's threaded server, as under `flask run`,
+against a fresh temporary directory. Once it accepts requests it prints
+'READY <directory>' on stdout; the admin key is in the directory's
+`jsons/api_keys.json`.
+"""
+import ast
+import logging
+import argparse
+from typing import Any, Dict, List
+
+from benchmarks.common import setup
+
+def parse_overrides(pairs: List[str]) -> Dict[str, Any]:
+    """['MAX_WORKERS=8', "NODE_ROLE='all'"] -> {'MAX_WORKERS': 8, 'NODE_ROLE': 'all'}; bare words stay strings."""
+    overrides = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        try:
+            overrides[name.strip()] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name.strip()] = value
+    return overrides
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m loadtest.serve', description='Run the server for a load test.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a config.py value, e.g. --set MAX_WORKERS=8')
+    args = parser.parse_args()
+
+    workdir = setup(fake_extractor=False, **parse_overrides(args.set))
+    import config
+    from werkzeug.serving import make_server
+    from src import server
+
+    # werkzeug logs every request at INFO unless told otherwise
+    logging.getLogger('werkzeug').setLevel(config.log.LOG_LEVEL.upper())
+
+    http_server = make_server(args.host, args.port, server.app, threaded=True)
+    print(f'READY {workdir}', flush=True)
+    # SIGTERM ends serve_forever with SystemExit (see exit_on_sigterm), and
+    # the post-processing pool is shut down on the way out
+    try:
+        http_server.serve_forever()
+    finally:
+        http_server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,132 @@
+import os
+import time
+import heapq
+import atexit
+import hashlib
 import secrets
+import threading
 from functools import wraps
 from datetime import datetime, timedelta
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict, Any, Callable, Iterable, Union
 
-from flask import request, jsonify
+from flask import Response, g, request, jsonify, make_response
 from src.storage import Storage
 from src.models import ApiKey
-from config import task, memory
+from src.metrics import registry, auth_seconds
+from src.rate_limit import (RateLimitBackend, RateLimitResult, MemoryRateLimitBackend,
+                            SqliteRateLimitBackend)
+from src.log import get_logger
+from config import task, memory, auth, storage
+
+logger = get_logger(__name__)
+
+class KeyRegistry:
+    """In-memory index of KEYS_FILE.
+
+    Keys are looked up by a SHA-256 of the secret. The index is rebuilt when
+    the registry itself writes the file or when the file's mtime changes on
+    disk; `last_access` updates are buffered and flushed periodically.
+    Listeners registered with `on_reload` are told about changes made by
+    other processes.
+    """
+
+    def __init__(self, keys_file: str):
+        self.keys_file = keys_file
+        self._lock = threading.RLock()
+        self._keys: Dict[str, Any] = {}
+        self._by_hash: Dict[str, str] = {}
+        self._signature = None
+        self._next_check = 0.0
+        self._pending_access: Dict[str, str] = {}
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    @staticmethod
+    def _hash(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.keys_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self, keys: Optional[Dict[str, Any]] = None, reloaded: bool = True) -> None:
+        self._signature = self._file_signature()
+        self._keys = Storage.load_keys() if keys is None else keys
+        self._by_hash = {self._hash(info['key']): name for name, info in self._keys.items()}
+        if reloaded:
+            for listener in self._listeners:
+                listener(self._keys)
+
+    def on_reload(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        self._listeners.append(listener)
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            self._next_check = now + auth.KEY_RELOAD_CHECK_SECONDS
+            if self._file_signature() != self._signature:
+                self._load()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._signature = None
+            self._next_check = 0.0
+
+    def get_name(self, api_key: Optional[str]) -> Optional[str]:
+        if not api_key:
+            return None
+        self._refresh()
+        return self._by_hash.get(self._hash(api_key))
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        self._refresh()
+        info = self._keys.get(name)
+        if info is not None and name in self._pending_access:
+            info = {**info, 'last_access': self._pending_access[name]}
+        return info
+
+    def all(self) -> Dict[str, Any]:
+        self._refresh()
+        return {name: self.get(name) for name in list(self._keys)}
+
+    def touch(self, name: str) -> None:
+        self._pending_access[name] = datetime.now().isoformat()
+
+    def update(self, mutate: Callable[[Dict[str, Any]], Any]) -> Any:
+        """Read-modify-write KEYS_FILE under the registry and file locks."""
+        with self._lock, Storage.keys_lock():
+            reloaded = self._file_signature() != self._signature
+            keys = Storage.load_keys()
+            pending, self._pending_access = self._pending_access, {}
+            for name, last_access in pending.items():
+                if name in keys:
+                    keys[name]['last_access'] = last_access
+            result = mutate(keys)
+            Storage.save_keys(keys)
+            self._load(keys, reloaded)
+            return result
+
+    def flush(self) -> None:
+        if self._pending_access:
+            self.update(lambda keys: None)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(auth.KEY_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing API key access times: %s", e)
+
+    def start(self) -> None:
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+key_registry = KeyRegistry(storage.KEYS_FILE)
 
 class AuthManager:
     @staticmethod
@@ -15,35 +135,48 @@ class AuthManager:
     
     @staticmethod
     def get_key_name(api_key: str) -> Optional[str]:
-        keys = Storage.load_keys()
-        for key_name, key_info in keys.items():
-            if key_info['key'] == api_key:
-                return key_name
-        return None
+        return key_registry.get_name(api_key)
     
     def create_key(self, name: str, permissions: List[str], 
-                   memory_quota: int = memory.DEFAULT_QUOTA_BYTES) -> str:
-        keys = Storage.load_keys()
+                   memory_quota: int = memory.DEFAULT_QUOTA_BYTES,
+                   rate_limit: Optional[int] = None) -> str:
         api_key = ApiKey(
             key=self.generate_key(),
             name=name,
             permissions=permissions,
             memory_quota=memory_quota,
-            last_access=datetime.now().isoformat()
+            last_access=datetime.now().isoformat(),
+            rate_limit=rate_limit
         )
-        keys[name] = api_key.to_dict()
-        Storage.save_keys(keys)
+        def add(keys):
+            keys[name] = api_key.to_dict()
+        key_registry.update(add)
         return api_key.key
     
     def delete_key(self, name: str) -> bool:
-        keys = Storage.load_keys()
-        if name in keys:
-            del keys[name]
-            Storage.save_keys(keys)
-            return True
-        return False
+        def remove(keys):
+            return keys.pop(name, None) is not None
+        return key_registry.update(remove)
 
 class MemoryManager:
+    """Per-key and server-wide storage quotas.
+
+    A media task reserves its estimated size when it starts, commits the
+    real file size when it completes and releases it when it fails or its
+    files are cleaned up. Entries also lapse after QUOTA_RATE_MINUTES. The
+    reservations live in each key's `memory_usage` in KEYS_FILE; the server
+    total is kept in memory and rebuilt only when another process changes
+    the file.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._usage: Optional[Dict[str, Tuple[int, float]]] = None
+        self._expiry: List[Tuple[float, str]] = []
+        self._total = 0
+        self._reloaded_keys: Optional[Dict[str, Any]] = None
+        key_registry.on_reload(self._on_reload)
+
     @staticmethod
     def _clean_old_usage(memory_usage: List[dict]) -> List[dict]:
         current_time = datetime.now()
@@ -52,42 +185,71 @@ class MemoryManager:
             usage for usage in memory_usage
             if datetime.fromisoformat(usage['timestamp']) > cutoff_time
         ]
-    
+
+    @staticmethod
+    def _expires(usage: dict) -> float:
+        return datetime.fromisoformat(usage['timestamp']).timestamp() + memory.QUOTA_RATE_MINUTES * 60
+
+    def _on_reload(self, keys: Dict[str, Any]) -> None:
+        # Called with the registry lock held; rebuilt on next use instead
+        self._reloaded_keys = keys
+
+    def _sync(self) -> None:
+        """Bring the in-memory totals up to date; call with `_lock` held."""
+        key_registry._refresh()
+        keys, self._reloaded_keys = self._reloaded_keys, None
+        if keys is not None or self._usage is None:
+            self._usage, self._expiry, self._total = {}, [], 0
+            for key_info in (keys if keys is not None else key_registry.all()).values():
+                for usage in self._clean_old_usage(key_info.get('memory_usage', [])):
+                    self._track(usage.get('task_id') or usage['timestamp'], usage['size'], self._expires(usage))
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, task_id = heapq.heappop(self._expiry)
+            if task_id in self._usage and self._usage[task_id][1] == expires:
+                self._untrack(task_id)
+
+    def _track(self, task_id: str, size: int, expires: float) -> None:
+        self._untrack(task_id)
+        self._usage[task_id] = (size, expires)
+        self._total += size
+        heapq.heappush(self._expiry, (expires, task_id))
+
+    def _untrack(self, task_id: str) -> None:
+        entry = self._usage.pop(task_id, None)
+        if entry is not None:
+            self._total -= entry[0]
+
+    def usage_by_key(self) -> Dict[str, Tuple[int, int]]:
+        """Bytes in use and quota of every key."""
+        return {
+            name: (sum(u['size'] for u in self._clean_old_usage(key_info.get('memory_usage', []))),
+                   key_info.get('memory_quota', memory.DEFAULT_QUOTA_BYTES))
+            for name, key_info in key_registry.all().items()
+        }
+
     def get_total_usage(self) -> int:
-        keys = Storage.load_keys()
-        total = 0
-        
-        for key_info in keys.values():
-            if 'memory_usage' not in key_info:
-                continue
-            
-            key_info['memory_usage'] = self._clean_old_usage(key_info['memory_usage'])
-            total += sum(usage['size'] for usage in key_info['memory_usage'])
-        
-        return total
-    
-    def check_server_memory(self, new_size: int = 0) -> Tuple[bool, str]:
-        total_usage = self.get_total_usage()
-        
-        if total_usage + new_size > memory.AVAILABLE_BYTES:
-            gb = lambda x: x / (1024 ** 3)
-            return False, (
-                f"Server memory limit exceeded. "
-                f"Current: {gb(total_usage):.2f}GB, "
-                f"Requested: {gb(new_size):.2f}GB, "
-                f"Available: {gb(memory.AVAILABLE_BYTES - total_usage):.2f}GB"
-            )
-        return True, ""
+        with self._lock:
+            self._sync()
+            return self._total
     
     def check_and_update_quota(self, api_key: str, new_size: int, task_id: str) -> None:
-        ok, error = self.check_server_memory(new_size)
-        if not ok:
-            raise Exception(error)
-        
-        keys = Storage.load_keys()
+        """Reserve `new_size` bytes for `task_id` against the key's quota.
+
+        Space on the server as a whole is managed by DiskManager.
+        """
         key_name = AuthManager.get_key_name(api_key)
+        if not key_name:
+            raise Exception("Invalid API key")
         
-        if not key_name or key_name not in keys:
+        with self._lock:
+            usage = key_registry.update(lambda keys: self._reserve(keys, key_name, new_size, task_id))
+            if usage:
+                self._sync()
+                self._track(task_id, new_size, self._expires(usage))
+    
+    def _reserve(self, keys: Dict[str, Any], key_name: str, new_size: int, task_id: str) -> Optional[dict]:
+        if key_name not in keys:
             raise Exception("Invalid API key")
         
         key_info = keys[key_name]
@@ -95,7 +257,7 @@ class MemoryManager:
         key_info.setdefault('memory_usage', [])
         
         key_info['memory_usage'] = self._clean_old_usage(key_info['memory_usage'])
-        current_usage = sum(u['size'] for u in key_info['memory_usage'])
+        current_usage = sum(u['size'] for u in key_info['memory_usage'] if u.get('task_id') != task_id)
         
         if current_usage + new_size > key_info['memory_quota']:
             gb = lambda x: x / (1024 ** 3)
@@ -105,52 +267,126 @@ class MemoryManager:
             )
         
         if new_size > 0:
-            key_info['memory_usage'].append({
+            usage = {
                 'size': new_size,
                 'timestamp': datetime.now().isoformat(),
-                'task_id': task_id
-            })
+                'task_id': task_id,
+                'reserved': True
+            }
+            key_info['memory_usage'] = [u for u in key_info['memory_usage'] if u.get('task_id') != task_id]
+            key_info['memory_usage'].append(usage)
             key_info['last_access'] = datetime.now().isoformat()
+            return usage
+        return None
+
+    def _holds(self, key_name: str, task_id: str) -> bool:
+        key_info = key_registry.get(key_name) or {}
+        return any(u.get('task_id') == task_id for u in key_info.get('memory_usage', []))
+
+    def commit(self, key_name: str, task_id: str, actual_size: int) -> None:
+        """Replace a task's reserved size with the size of its finished file."""
+        if not self._holds(key_name, task_id):
+            return
+        
+        def settle(keys):
+            for usage in keys.get(key_name, {}).get('memory_usage', []):
+                if usage.get('task_id') == task_id:
+                    usage['size'] = actual_size
+                    usage.pop('reserved', None)
+                    return usage
+        
+        with self._lock:
+            usage = key_registry.update(settle)
+            self._sync()
+            if usage and task_id in self._usage:
+                self._track(task_id, actual_size, self._usage[task_id][1])
+
+    def release(self, key_name: str, task_id: str) -> None:
+        """Give back a task's quota after it failed or its files were removed."""
+        if not self._holds(key_name, task_id):
+            return
+        
+        def drop(keys):
+            key_info = keys.get(key_name)
+            if key_info and 'memory_usage' in key_info:
+                key_info['memory_usage'] = [u for u in key_info['memory_usage'] if u.get('task_id') != task_id]
         
-        Storage.save_keys(keys)
+        with self._lock:
+            key_registry.update(drop)
+            self._sync()
+            self._untrack(task_id)
 
 class RateLimiter:
-    @staticmethod
-    def check_rate_limit(api_key: str) -> bool:
-        tasks = Storage.load_tasks()
-        key_name = AuthManager.get_key_name(api_key)
-        count = sum(1 for t in tasks.values() if t.get('key_name') == key_name)
-        return count < task.REQUEST_LIMIT
+    backend: RateLimitBackend = (
+        SqliteRateLimitBackend(storage.DATABASE_FILE) if task.RATE_LIMIT_BACKEND == 'sqlite'
+        else MemoryRateLimitBackend()
+    )
+    
+    @classmethod
+    def hit(cls, key_name: str, cost: int = 1) -> RateLimitResult:
+        key_info = key_registry.get(key_name) or {}
+        limit = key_info.get('rate_limit') or task.REQUEST_LIMIT
+        return cls.backend.hit(key_name, limit, task.RATE_LIMIT_WINDOW_SECONDS, cost)
+    
+    @classmethod
+    def check_rate_limit(cls, api_key: str) -> bool:
+        return cls.hit(AuthManager.get_key_name(api_key)).allowed
+
+def charge_rate_limit(cost: int = 1) -> Optional[Response]:
+    """Count the current request as `cost` requests against its key's rate limit.
+
+    Called by routes that create tasks, once the request has been validated,
+    so rejected requests and other endpoints are free. Returns the 429
+    response to send if the limit is exceeded, else None. The limit headers
+    are added to the response by `require_permission`.
+    """
+    started = time.perf_counter()
+    limit = RateLimiter.hit(g.key_name, cost)
+    g.rate_limit = limit
+    if limit.allowed:
+        return None
+    auth_seconds.observe(time.perf_counter() - started, outcome='rate_limited')
+    return make_response(jsonify({
+        'error': f'Rate limit exceeded. Max {limit.limit} per {task.RATE_LIMIT_WINDOW_SECONDS} s'
+    }), 429)
+
+def require_permission(permission: Union[str, Callable[[], Iterable[str]]]):
+    """Authenticate the request and check permissions.
 
-def require_permission(permission: str):
+    `permission` may be a callable returning the permissions needed by the
+    current request. Routes that create tasks apply the rate limit
+    themselves with `charge_rate_limit`.
+    """
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
+            started = time.perf_counter()
             api_key = request.headers.get('X-API-Key')
             
             if not api_key:
+                auth_seconds.observe(time.perf_counter() - started, outcome='unauthorized')
                 return jsonify({'error': 'No API key provided'}), 401
             
-            keys = Storage.load_keys()
             key_name = AuthManager.get_key_name(api_key)
+            key_info = key_registry.get(key_name) if key_name else None
             
-            if not key_name:
+            if not key_info:
+                auth_seconds.observe(time.perf_counter() - started, outcome='unauthorized')
                 return jsonify({'error': 'Invalid API key'}), 401
             
-            key_info = keys[key_name]
-            
-            if not RateLimiter.check_rate_limit(api_key):
-                return jsonify({
-                    'error': f'Rate limit exceeded. Max {task.REQUEST_LIMIT} per {task.CLEANUP_TIME_MINUTES} min'
-                }), 429
-            
-            if permission not in key_info['permissions']:
+            required = [permission] if isinstance(permission, str) else permission()
+            if not set(required).issubset(key_info['permissions']):
+                auth_seconds.observe(time.perf_counter() - started, outcome='forbidden')
                 return jsonify({'error': 'Insufficient permissions'}), 403
             
-            key_info['last_access'] = datetime.now().isoformat()
-            Storage.save_keys(keys)
-            
-            return f(*args, **kwargs)
+            key_registry.touch(key_name)
+            auth_seconds.observe(time.perf_counter() - started, outcome='allowed')
+            g.key_name = key_name
+            response = make_response(f(*args, **kwargs))
+            limit = g.pop('rate_limit', None)
+            if limit is not None:
+                response.headers.update(limit.headers())
+            return response
         return wrapper
     return decorator
 
@@ -158,9 +394,19 @@ def require_permission(permission: str):
 auth_manager = AuthManager()
 memory_manager = MemoryManager()
 
-if not Storage.load_keys():
+registry.gauge('ytdlp_quota_used_bytes', 'Storage quota in use per API key.', ['key'],
+               collect=lambda: {(name,): used for name, (used, _) in memory_manager.usage_by_key().items()})
+registry.gauge('ytdlp_quota_limit_bytes', 'Storage quota per API key.', ['key'],
+               collect=lambda: {(name,): quota for name, (_, quota) in memory_manager.usage_by_key().items()})
+registry.gauge('ytdlp_server_quota_used_bytes', 'Storage quota in use across all keys.',
+               collect=lambda: {(): memory_manager.get_total_usage()})
+
+if not key_registry.all():
     auth_manager.create_key(
         "admin",
         ["create_key", "delete_key", "get_key", "get_keys", 
-         "get_video", "get_audio", "get_live_video", "get_live_audio", "get_info"]
+         "get_video", "get_audio", "get_live_video", "get_live_audio", "get_info", "get_playlist",
+         "get_profile", "get_metrics"]
     )
+
+key_registry.start()
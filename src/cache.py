@@ -0,0 +1,146 @@
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import yt_dlp
+
+from config import cache as cache_config
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Optionally bounded by total size, as reported by `sizeof` for each value.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (expires, size, value)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        self.total_bytes -= self._entries.pop(key)[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL for use as a cache key."""
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+class InfoCache:
+    """Cache of unprocessed `extract_info` results.
+
+    Entries are the raw extractor output (`process=False`), so each caller can
+    run format selection and downloading with its own options through
+    `YoutubeDL.process_ie_result`. Only single-video results are cached;
+    playlists carry lazy entry lists that cannot be replayed. Concurrent
+    extractions of the same URL share a single extractor run.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(
+            ttl=cache_config.INFO_TTL_SECONDS,
+            max_entries=cache_config.INFO_MAX_ENTRIES,
+            max_bytes=cache_config.INFO_MAX_BYTES,
+            sizeof=lambda info: len(json.dumps(info, default=str))
+        )
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+
+    @staticmethod
+    def _key(url: str, params: Dict[str, Any]) -> Hashable:
+        return normalize_url(url), json.dumps(params, sort_keys=True, default=str)
+
+    def extract(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a private copy of the raw info dict for `url`."""
+        key = self._key(url, params)
+        info = self._cache.get(key)
+        if info is not None:
+            return copy.deepcopy(info)
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            info = future.result()
+            return copy.deepcopy(info) if info is not None else self._extract(url, params)
+
+        cached = None
+        try:
+            info = self._extract(url, params)
+            if info.get('_type', 'video') == 'video':
+                try:
+                    cached = copy.deepcopy(info)
+                    self._cache.set(key, cached)
+                except Exception:
+                    cached = None
+            return info
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            if not future.done():
+                future.set_result(cached)
+
+    @staticmethod
+    def _extract(url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        opts = {'quiet': True, 'no_warnings': True, 'skip_download': True, **params}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            return ydl.extract_info(url, download=False, process=False)
+
+    def invalidate(self, url: str, params: Dict[str, Any]) -> None:
+        self._cache.pop(self._key(url, params))
+
+info_cache = InfoCache()
@@ -0,0 +1,169 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from config import storage
+from config import task as task_config
+
+CACHE_DIR_NAME = '.cache'
+
+class _Entry:
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.ready = threading.Event()
+        self.refs: Set[str] = set()
+        self.waiters: List[Callable[[], None]] = []
+        self.last_used = datetime.now()
+
+class ContentCache:
+    """Completed media files shared between tasks with identical output.
+
+    Entries are keyed by `content_key` and live under DOWNLOAD_DIR/.cache.
+    Tasks get a hardlink to the cached file, and every task that uses an
+    entry holds a reference on it. An entry is dropped once it has had no
+    references for CLEANUP_TIME_MINUTES.
+
+    Only one task downloads a given key at a time. Others that ask for the
+    same key are told when it has finished, then reuse its file. The index
+    lives in memory, so this only deduplicates downloads within a process.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._task_keys: Dict[str, str] = {}
+
+    @staticmethod
+    def content_key(info: dict, task: dict) -> str:
+        """Key of a task's output given its format-resolved info dict."""
+        parts = [
+            info.get('extractor_key') or info.get('extractor') or '',
+            str(info.get('id') or info.get('webpage_url') or ''),
+            str(info.get('format_id') or ''),
+            task['task_type'],
+            str(task.get('output_format') or ''),
+            str(task.get('start_time') or ''),
+            str(task.get('end_time') or ''),
+            str(bool(task.get('force_keyframes'))),
+        ]
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+    def acquire(self, key: str, task_id: str) -> Tuple[Optional[str], bool]:
+        """Look up `key` on behalf of `task_id`; never blocks.
+
+        Returns `(path, False)` on a hit. Returns `(None, True)` if the caller
+        should download the file itself; it must then call `publish` or
+        `abandon`. Returns `(None, False)` while another task is downloading
+        the same key; `when_ready` tells when to ask again.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = _Entry()
+                return None, True
+            if entry.ready.is_set():
+                if entry.path and os.path.exists(entry.path):
+                    self._add_ref(key, entry, task_id)
+                    return entry.path, False
+                # File vanished underneath us; download it again
+                entry.path = None
+                entry.ready.clear()
+                return None, True
+            return None, False
+
+    def when_ready(self, key: str, callback: Callable[[], None]) -> bool:
+        """Call `callback` once the download of `key` has been published or abandoned.
+
+        Returns False, without calling it, if that has already happened.
+        The callback runs on the thread that finished the download.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.ready.is_set():
+                return False
+            entry.waiters.append(callback)
+            return True
+
+    def publish(self, key: str, task_id: str, file_path: str) -> None:
+        """Store the leader's finished file under `key` and wake waiters."""
+        entry_dir = os.path.join(self.root, key)
+        os.makedirs(entry_dir, exist_ok=True)
+        cached_path = os.path.join(entry_dir, os.path.basename(file_path))
+        link_or_copy(file_path, cached_path)
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            entry.path = cached_path
+            self._add_ref(key, entry, task_id)
+            entry.ready.set()
+            waiters, entry.waiters = entry.waiters, []
+        for callback in waiters:
+            callback()
+
+    def abandon(self, key: str) -> None:
+        """The leader failed; let the next waiter try instead."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.ready.set()
+            for callback in entry.waiters:
+                callback()
+
+    def _add_ref(self, key: str, entry: _Entry, task_id: str) -> None:
+        entry.refs.add(task_id)
+        entry.last_used = datetime.now()
+        self._task_keys[task_id] = key
+
+    def release(self, task_id: str) -> None:
+        with self._lock:
+            key = self._task_keys.pop(task_id, None)
+            entry = self._entries.get(key) if key else None
+            if entry is not None:
+                entry.refs.discard(task_id)
+                entry.last_used = datetime.now()
+
+    def prune(self, idle_minutes: Optional[float] = None) -> None:
+        """Remove unreferenced entries idle for longer than `idle_minutes` (CLEANUP_TIME_MINUTES).
+
+        Directories this process has no entry for (left by a previous run,
+        or published by another node) go once they are older than
+        CLEANUP_TIME_MINUTES. Tasks hold hardlinks, so removing a cached copy
+        never takes a file away from a task.
+        """
+        if idle_minutes is None:
+            idle_minutes = task_config.CLEANUP_TIME_MINUTES
+        cutoff = datetime.now() - timedelta(minutes=idle_minutes)
+        with self._lock:
+            expired = [key for key, entry in self._entries.items()
+                       if entry.ready.is_set() and not entry.refs and entry.last_used < cutoff]
+            for key in expired:
+                del self._entries[key]
+            known = set(self._entries)
+        for key in expired:
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+        stale_before = time.time() - task_config.CLEANUP_TIME_MINUTES * 60
+        try:
+            leftovers = [entry for entry in os.scandir(self.root) if entry.name not in known]
+        except FileNotFoundError:
+            return
+        for entry in leftovers:
+            try:
+                if entry.is_dir() and entry.stat().st_mtime < stale_before:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+def link_or_copy(src: str, dst: str) -> None:
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+content_cache = ContentCache(os.path.join(storage.DOWNLOAD_DIR, CACHE_DIR_NAME))
@@ -0,0 +1,189 @@
+import os
+import mimetypes
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date, parse_range_header, parse_etags, quote_etag
+
+from config import storage
+
+CHUNK_SIZE = 256 * 1024
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 16
+
+def file_etag(st: os.stat_result) -> str:
+    """Validator of one version of a file, from its inode, size and mtime.
+
+    Hardlinked copies share a tag and a rewritten file gets a new one. It is
+    derived from metadata only, so the file is never read on the request
+    path; device numbers are left out because they differ between the
+    nodes that mount a shared DOWNLOAD_DIR.
+    """
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+class FileSlice:
+    """Read-only view of `length` bytes of a file starting at `start`.
+
+    The underlying file is positioned at `start` and `fileno` is exposed,
+    so a WSGI server's `wsgi.file_wrapper` can `sendfile` the slice using
+    Content-Length; servers that read through it get at most `length` bytes.
+    """
+
+    def __init__(self, path: str, start: int, length: int):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b''
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def close(self) -> None:
+        self._file.close()
+
+def _iter_slice(part: FileSlice) -> Iterator[bytes]:
+    try:
+        for chunk in iter(lambda: part.read(CHUNK_SIZE), b''):
+            yield chunk
+    finally:
+        part.close()
+
+def _wrap(path: str, start: int, length: int):
+    """Body for one slice, through `wsgi.file_wrapper` when the server offers it."""
+    part = FileSlice(path, start, length)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        return file_wrapper(part, CHUNK_SIZE)
+    return _iter_slice(part)
+
+def _byte_ranges(size: int) -> Optional[List[Tuple[int, int]]]:
+    """Satisfiable (start, stop) ranges of the request, [] if none, None if not a range request."""
+    header = request.headers.get('Range')
+    if not header:
+        return None
+    parsed = parse_range_header(header)
+    if parsed is None or parsed.units != 'bytes' or len(parsed.ranges) > MAX_RANGES:
+        return None
+    ranges = []
+    for start, stop in parsed.ranges:
+        if start < 0:
+            start, stop = max(0, size + start), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+def _if_range_matches(etag: str, mtime: int) -> bool:
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Ranges may only be combined with strong validators
+        return if_range == quote_etag(etag)
+    date = parse_date(if_range)
+    return date is not None and int(date.timestamp()) == mtime
+
+def _not_modified(etag: str, mtime: int) -> bool:
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    since = parse_date(request.headers.get('If-Modified-Since'))
+    return since is not None and mtime <= int(since.timestamp())
+
+def send_file(path: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Serve `path` with validators, conditional requests and byte ranges.
+
+    With FILE_ACCEL set, only the headers are produced and the body is left
+    to the front proxy through X-Accel-Redirect or X-Sendfile.
+    """
+    st = os.stat(path)
+    size, mtime = st.st_size, int(st.st_mtime)
+    etag = file_etag(st)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    base_headers = {
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(datetime.fromtimestamp(mtime, timezone.utc)),
+        'Accept-Ranges': 'bytes',
+        **(headers or {}),
+    }
+
+    if _not_modified(etag, mtime):
+        return Response(status=304, headers=base_headers)
+
+    if storage.FILE_ACCEL == 'x-accel-redirect':
+        relative = os.path.relpath(path, storage.DOWNLOAD_DIR)
+        base_headers['X-Accel-Redirect'] = storage.FILE_ACCEL_PREFIX.rstrip('/') + '/' + relative
+        return Response(status=200, headers=base_headers, mimetype=mimetype)
+    if storage.FILE_ACCEL == 'x-sendfile':
+        base_headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(status=200, headers=base_headers, mimetype=mimetype)
+
+    ranges = _byte_ranges(size) if _if_range_matches(etag, mtime) else None
+    if ranges is None:
+        response = Response(_wrap(path, 0, size), status=200, headers=base_headers,
+                            mimetype=mimetype, direct_passthrough=True)
+        response.content_length = size
+        return response
+
+    if not ranges:
+        return Response(status=416, headers={**base_headers, 'Content-Range': f'bytes */{size}'})
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response = Response(_wrap(path, start, stop - start), status=206, headers=base_headers,
+                            mimetype=mimetype, direct_passthrough=True)
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response.content_length = stop - start
+        return response
+
+    boundary = os.urandom(16).hex()
+    parts = [(f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+              f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+             for start, stop in ranges]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+
+    def body() -> Iterator[bytes]:
+        for index, (start, stop) in enumerate(ranges):
+            yield (b'\r\n' if index else b'') + parts[index]
+            yield from _iter_slice(FileSlice(path, start, stop - start))
+        yield closing
+
+    length = sum(len(p) for p in parts) + 2 * (len(ranges) - 1) + len(closing) + \
+        sum(stop - start for start, stop in ranges)
+    response = Response(body(), status=206, headers=base_headers,
+                        mimetype=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
+    response.content_length = length
+    return response
+
+def tail_file(path: str, is_finished: Callable[[], bool], wait: Callable[[], None]) -> Iterator[bytes]:
+    """Follow a file that is still being written, like `tail -f`.
+
+    Ends at end of file once `is_finished()` is true. The file stays open,
+    so a rename of the partial file to its final name does not interrupt
+    the stream. Errors, including those raised by `is_finished`, propagate
+    so the server drops the connection instead of ending the body cleanly.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            if os.fstat(f.fileno()).st_size < f.tell():
+                raise Exception(f"{path} was truncated while streaming")
+            if is_finished():
+                # Data written between the last read and the check
+                yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+                return
+            wait()
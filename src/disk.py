@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+from typing import Callable, Dict, Tuple
+
+from src.log import get_logger
+from config import memory
+
+logger = get_logger(__name__)
+
+class DiskManager:
+    """Admission control for downloads based on the real free space of `root`.
+
+    A download is admitted when the used space reported by `statvfs`, plus
+    the sizes reserved by downloads still in progress, stays under
+    DISK_HIGH_WATERMARK. Otherwise finished tasks are evicted, least recently
+    accessed first, until usage is back under DISK_LOW_WATERMARK.
+
+    `candidates()` returns the tasks that may be evicted, mapped to when
+    they finished; running tasks and anything else the caller wants kept
+    are simply left out. `evict(task_id)` removes a task and its files.
+    """
+
+    def __init__(self, root: str, candidates: Callable[[], Dict[str, float]],
+                 evict: Callable[[str], None]):
+        self.root = root
+        self._candidates = candidates
+        self._evict = evict
+        self._lock = threading.Lock()
+        self._reserved: Dict[str, int] = {}
+        self._last_access: Dict[str, float] = {}
+
+    def usage(self) -> Tuple[int, int]:
+        """Used and total bytes of the filesystem holding `root`."""
+        st = os.statvfs(self.root)
+        total = st.f_blocks * st.f_frsize
+        return total - st.f_bavail * st.f_frsize, total
+
+    def reserved(self) -> int:
+        return sum(self._reserved.values())
+
+    def admit(self, task_id: str, size: int) -> None:
+        """Reserve `size` bytes for a download, evicting old files if needed."""
+        with self._lock:
+            pending = self.reserved() + size
+            used, total = self.usage()
+            if used + pending > total * memory.DISK_HIGH_WATERMARK:
+                self._evict_until(total * memory.DISK_LOW_WATERMARK - pending)
+                used, total = self.usage()
+            if used + pending > total * memory.DISK_HIGH_WATERMARK:
+                gb = lambda x: x / (1024 ** 3)
+                raise Exception(
+                    f"Not enough disk space. Used: {gb(used):.2f}GB, "
+                    f"Reserved: {gb(pending - size):.2f}GB, Requested: {gb(size):.2f}GB, "
+                    f"Limit: {gb(total * memory.DISK_HIGH_WATERMARK):.2f}GB"
+                )
+            self._reserved[task_id] = size
+
+    def release(self, task_id: str) -> None:
+        """The download finished or failed; its bytes are on disk or gone."""
+        self._reserved.pop(task_id, None)
+
+    def forget(self, task_id: str) -> None:
+        self._reserved.pop(task_id, None)
+        self._last_access.pop(task_id, None)
+
+    def touch(self, task_id: str) -> None:
+        self._last_access[task_id] = time.time()
+
+    def relieve(self) -> None:
+        """Evict down to the low-water mark if usage is above the high-water mark."""
+        with self._lock:
+            pending = self.reserved()
+            used, total = self.usage()
+            if used + pending > total * memory.DISK_HIGH_WATERMARK:
+                self._evict_until(total * memory.DISK_LOW_WATERMARK - pending)
+
+    def _evict_until(self, target_used: float) -> None:
+        candidates = self._candidates()
+        order = sorted(candidates, key=lambda task_id: max(candidates[task_id],
+                                                           self._last_access.get(task_id, 0)))
+        for task_id in order:
+            if self.usage()[0] <= target_used:
+                break
+            logger.info("Evicting task %s to free disk space", task_id)
+            self._evict(task_id)
+            self._last_access.pop(task_id, None)
@@ -0,0 +1,106 @@
+import copy
+import json
+import urllib.request
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+import yt_dlp
+
+from src.cache import TTLCache, info_cache, normalize_url
+from config import memory
+from config import cache as cache_config
+
+# Formats downloaded as one plain HTTP file, whose Content-Length is the file size
+DIRECT_PROTOCOLS = ('http', 'https')
+
+class SizeEstimator:
+    """Expected download size of a task, for reserving quota up front.
+
+    The formats are chosen by yt-dlp's own format selector with the same
+    format string the download will use, from the shared info cache. Each
+    chosen format is sized from, in order of preference, its exact
+    `filesize`, the Content-Length of its URL, `filesize_approx`, and
+    bitrate times duration. The total is scaled to the requested clip
+    length, and SIZE_BUFFER is added only when part of it is a guess.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(ttl=cache_config.ESTIMATE_TTL_SECONDS,
+                               max_entries=cache_config.ESTIMATE_MAX_ENTRIES)
+
+    def estimate(self, url: str, format_spec: str, params: Dict[str, Any],
+                 seconds: Optional[float] = None) -> int:
+        """Bytes needed for `seconds` of `url` in `format_spec` (all of it if None); -1 if unknown."""
+        key = (normalize_url(url), json.dumps(params, sort_keys=True, default=str), format_spec, seconds)
+        size = self._cache.get(key)
+        if size is None:
+            size = self._estimate(url, format_spec, params, seconds)
+            if size > 0:
+                self._cache.set(key, size)
+        return size
+
+    def _estimate(self, url: str, format_spec: str, params: Dict[str, Any],
+                  seconds: Optional[float]) -> int:
+        info = info_cache.extract(url, params)
+        opts = {'quiet': True, 'no_warnings': True, 'format': format_spec, **params}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            resolved = ydl.process_ie_result(copy.deepcopy(info), download=False)
+
+        formats = resolved.get('requested_formats') or [resolved]
+        duration = resolved.get('duration')
+        if seconds is not None and not duration:
+            # Live or unknown length: guess from the bitrate, or fall back to
+            # the whole file, which bounds any part of it
+            total = sum(self._bitrate_size(fmt, seconds) for fmt in formats)
+            if total > 0:
+                return int(total * memory.SIZE_BUFFER)
+            seconds = None
+
+        sizes = [self._format_size(fmt, duration) for fmt in formats]
+        if not all(size for size, _ in sizes):
+            return -1
+        total = sum(size for size, _ in sizes)
+        exact = all(fmt_exact for _, fmt_exact in sizes)
+        if seconds is not None:
+            total = total * min(seconds, duration) / duration
+            # Cuts land on keyframes, so a clip is never sized exactly
+            exact = False
+
+        if total <= 0:
+            return -1
+        return int(total) if exact else int(total * memory.SIZE_BUFFER)
+
+    def _format_size(self, fmt: Dict[str, Any], duration: Optional[float]) -> Tuple[int, bool]:
+        """Size of one format and whether it is exact."""
+        if fmt.get('filesize'):
+            return fmt['filesize'], True
+        length = self._content_length(fmt)
+        if length:
+            return length, True
+        if fmt.get('filesize_approx'):
+            return fmt['filesize_approx'], False
+        return self._bitrate_size(fmt, duration or fmt.get('duration') or 0), False
+
+    @staticmethod
+    def _bitrate_size(fmt: Dict[str, Any], seconds: float) -> int:
+        bitrate = fmt.get('tbr') or (fmt.get('vbr') or 0) + (fmt.get('abr') or 0)
+        return int(bitrate * seconds * 128) if bitrate and seconds else 0
+
+    @staticmethod
+    def _content_length(fmt: Dict[str, Any]) -> Optional[int]:
+        url = fmt.get('url')
+        if not url or fmt.get('protocol', 'https') not in DIRECT_PROTOCOLS or fmt.get('fragments'):
+            return None
+        # Some CDNs put the length in the URL itself
+        clen = parse_qs(urlsplit(url).query).get('clen')
+        if clen and clen[0].isdigit():
+            return int(clen[0])
+        try:
+            req = urllib.request.Request(url, method='HEAD', headers=fmt.get('http_headers') or {})
+            with urllib.request.urlopen(req, timeout=cache_config.ESTIMATE_HEAD_TIMEOUT_SECONDS) as response:
+                length = response.headers.get('Content-Length')
+                return int(length) if length and length.isdigit() else None
+        except Exception:
+            return None
+
+size_estimator = SizeEstimator()
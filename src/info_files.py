@@ -0,0 +1,202 @@
+import os
+import json
+from typing import Any, Dict, Hashable, List, Optional
+
+from src.cache import TTLCache
+from src.log import get_logger
+from config import cache as cache_config
+
+logger = get_logger(__name__)
+
+# Returned by `project` for paths that do not exist in the document
+MISSING = object()
+
+def extract_qualities(data: dict) -> dict:
+    qualities = {"audio": {}, "video": {}}
+
+    for fmt in data.get('formats', []):
+        if fmt.get('format_note') in ['unknown', 'storyboard']:
+            continue
+
+        # Audio format
+        if fmt.get('acodec') != 'none' and fmt.get('vcodec') == 'none' and fmt.get('abr'):
+            qualities["audio"][fmt['format_id']] = {
+                "abr": int(fmt['abr']),
+                "acodec": fmt['acodec'],
+                "audio_channels": int(fmt.get('audio_channels') or 0),
+                "language": fmt.get('language'),
+                "filesize": int(fmt.get('filesize') or fmt.get('filesize_approx') or 0)
+            }
+
+        # Video format
+        elif fmt.get('vcodec') != 'none' and fmt.get('height') and fmt.get('fps'):
+            qualities["video"][fmt['format_id']] = {
+                "height": int(fmt['height']),
+                "width": int(fmt['width']),
+                "fps": int(fmt['fps']),
+                "vcodec": fmt['vcodec'],
+                "format_note": fmt.get('format_note', 'unknown'),
+                "dynamic_range": fmt.get('dynamic_range', 'unknown'),
+                "filesize": int(fmt.get('filesize') or fmt.get('filesize_approx') or 0)
+            }
+
+    qualities["video"] = dict(sorted(qualities["video"].items(),
+                                   key=lambda x: (x[1]['height'], x[1]['fps'])))
+    qualities["audio"] = dict(sorted(qualities["audio"].items(),
+                                   key=lambda x: x[1]['abr']))
+
+    return qualities
+
+def parse_fields(spec: str) -> Dict[str, Any]:
+    """Turn 'title,formats.format_id,formats.ext' into {'title': {}, 'formats': {'format_id': {}, 'ext': {}}}."""
+    tree: Dict[str, Any] = {}
+    for path in spec.split(','):
+        node = tree
+        for part in filter(None, path.strip().split('.')):
+            node = node.setdefault(part, {})
+    return tree
+
+def project(value: Any, tree: Dict[str, Any]) -> Any:
+    """The parts of `value` selected by a `parse_fields` tree.
+
+    Lists are projected element by element, so 'formats.format_id' yields
+    the format_id of every format.
+    """
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [item for item in (project(v, tree) for v in value) if item is not MISSING]
+    if not isinstance(value, dict):
+        return MISSING
+    result = {}
+    for key, subtree in tree.items():
+        if key in value:
+            selected = project(value[key], subtree)
+            if selected is not MISSING:
+                result[key] = selected
+    return result if result else MISSING
+
+class InfoDocument:
+    """Read access to the top-level values of an info.json file.
+
+    With an index (byte range of every top-level value, as written by
+    `InfoFileCache.store`) only the values that are asked for are read and
+    parsed. Without one the whole file has been parsed into `data`.
+    Values are shared between requests; do not modify them.
+    """
+
+    def __init__(self, path: str, qualities: Optional[Dict[str, Any]],
+                 index: Optional[Dict[str, List[int]]] = None, data: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.qualities = qualities
+        self._index = index
+        self._values: Dict[str, Any] = data if data is not None else {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in (self._index if self._index is not None else self._values)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._values:
+            if self._index is None or key not in self._index:
+                raise KeyError(key)
+            offset, length = self._index[key]
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                self._values[key] = json.loads(f.read(length))
+        return self._values[key]
+
+    def project(self, tree: Dict[str, Any]) -> Any:
+        """`project` applied to the document, reading only the top-level values in `tree`."""
+        if not tree:
+            return {key: self[key] for key in (self._index if self._index is not None else self._values)}
+        result = {}
+        for key, subtree in tree.items():
+            if key in self:
+                selected = project(self[key], subtree)
+                if selected is not MISSING:
+                    result[key] = selected
+        return result if result else MISSING
+
+class InfoFileCache:
+    """info.json files and their qualities, kept until the file changes.
+
+    `store` writes a document one top-level value at a time and saves an
+    index next to it (`<file>.index`) holding the byte range of every value
+    and the qualities summary. Queries then read the index and parse only
+    the values they select, and `?qualities` never parses the file at all.
+    Files without a matching index (written by an older version, or changed
+    since) are parsed whole.
+
+    Entries are keyed by path, size and mtime, so a rewritten file is read
+    again. The bound on memory is taken from the size of the files on disk.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(ttl=float('inf'),
+                               max_entries=cache_config.INFO_FILE_MAX_ENTRIES,
+                               max_bytes=cache_config.INFO_FILE_MAX_BYTES,
+                               sizeof=lambda entry: entry[1])
+
+    @staticmethod
+    def _key(path: str, st: os.stat_result) -> Hashable:
+        return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def index_path(path: str) -> str:
+        return f'{path}.index'
+
+    def load(self, path: str) -> InfoDocument:
+        st = os.stat(path)
+        key = self._key(path, st)
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = (self._read(path, st), st.st_size)
+            self._cache.set(key, entry)
+        return entry[0]
+
+    def _read(self, path: str, st: os.stat_result) -> InfoDocument:
+        try:
+            with open(self.index_path(path), 'r') as f:
+                index = json.load(f)
+            if index['size'] == st.st_size and index['mtime_ns'] == st.st_mtime_ns:
+                return InfoDocument(path, index['qualities'], index=index['offsets'])
+        except (OSError, ValueError, KeyError):
+            pass
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return InfoDocument(path, self._qualities(path, data), data=data)
+
+    def store(self, path: str, data: Dict[str, Any], index: bool = True) -> None:
+        """Write `data` to `path`, with its index unless `index` is False."""
+        # Same bytes as json.dump(data, f), with the offset of every value noted on the way
+        offsets = {}
+        with open(path, 'wb') as f:
+            f.write(b'{')
+            for i, (key, value) in enumerate(data.items()):
+                f.write((', ' if i else '').encode() + json.dumps(key).encode() + b': ')
+                encoded = json.dumps(value).encode()
+                offsets[key] = [f.tell(), len(encoded)]
+                f.write(encoded)
+            f.write(b'}')
+        st = os.stat(path)
+        qualities = self._qualities(path, data)
+
+        if index:
+            index_path = self.index_path(path)
+            tmp_path = f'{index_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                           'qualities': qualities, 'offsets': offsets}, f)
+            os.replace(tmp_path, index_path)
+
+        self._cache.set(self._key(path, st), (InfoDocument(path, qualities, index=offsets), st.st_size))
+
+    @staticmethod
+    def _qualities(path: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            return extract_qualities(data)
+        except Exception as e:
+            logger.warning("Could not extract qualities from %s: %s", path, e)
+            return None
+
+info_file_cache = InfoFileCache()
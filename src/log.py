@@ -0,0 +1,178 @@
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, Tuple
+
+from config import log as log_config
+
+# Fields attached to every record logged while they are bound, e.g. task_id and key_name
+_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('log_context', default={})
+CONTEXT_FIELDS = ('task_id', 'key_name')
+
+_configure_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+
+@contextmanager
+def log_context(**fields):
+    """Attach `fields` to the records logged by this thread inside the block.
+
+    Thread pools do not inherit context variables, so work handed to
+    another thread binds its context again there.
+    """
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def current_context() -> Dict[str, Any]:
+    return dict(_context.get())
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, context.get(field))
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Pass at most LOG_SAMPLE_BURST records per message per window.
+
+    Records are grouped by logger and unformatted message, so repetitive
+    chatter is thinned while distinct messages still get through. Warnings
+    and errors are never dropped. The next record let through after a
+    suppression notes how many were dropped.
+    """
+
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._lock = threading.Lock()
+        self._counts: Dict[Tuple[str, str], Tuple[float, int, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            start, passed, dropped = self._counts.get(key, (now, 0, 0))
+            if now - start >= self.window:
+                start, passed = now, 0
+            if passed >= self.burst:
+                self._counts[key] = (start, passed, dropped + 1)
+                return False
+            self._counts[key] = (start, passed + 1, 0)
+            if len(self._counts) > 10000:
+                self._counts.clear()
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, but leave the layout to the output formatter
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.args, record.exc_info = None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ('suppressed',):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s%(context)s %(message)s%(suppressed_note)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = [str(getattr(record, field)) for field in CONTEXT_FIELDS if getattr(record, field, None)]
+        record.context = f" [{' '.join(context)}]" if context else ''
+        suppressed = getattr(record, 'suppressed', None)
+        record.suppressed_note = f' ({suppressed} similar messages suppressed)' if suppressed else ''
+        return super().format(record)
+
+def configure(stream=None) -> None:
+    """Route all logging through a bounded queue to one writer thread.
+
+    Records below LOG_LEVEL are discarded by the logger before any
+    formatting, so disabled debug logging costs one level check.
+    Idempotent; `get_logger` calls it.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if log_config.LOG_FORMAT == 'json' else TextFormatter())
+
+        handler = DroppingQueueHandler(queue.Queue(maxsize=log_config.LOG_QUEUE_SIZE))
+        handler.addFilter(ContextFilter())
+        handler.addFilter(SamplingFilter(log_config.LOG_SAMPLE_BURST, log_config.LOG_SAMPLE_WINDOW_SECONDS))
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(log_config.LOG_LEVEL.upper())
+
+        _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+def get_logger(name: str) -> logging.Logger:
+    configure()
+    return logging.getLogger(name)
+
+class YtDlpLogger:
+    """`logger` option for YoutubeDL, so its output goes through our logging."""
+
+    def __init__(self, logger: logging.Logger):
+        self._logger = logger
+
+    def debug(self, msg: str) -> None:
+        # yt-dlp sends both debug and regular screen messages here
+        self._logger.debug(msg)
+
+    def info(self, msg: str) -> None:
+        self._logger.info(msg)
+
+    def warning(self, msg: str) -> None:
+        self._logger.warning(msg)
+
+    def error(self, msg: str) -> None:
+        self._logger.error(msg)
@@ -0,0 +1,168 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.log import get_logger
+
+logger = get_logger(__name__)
+
+# Seconds, from a quick storage read to a long download
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Metric:
+    """A named family of samples, one per combination of label values.
+
+    With `collect`, the values are read from it on every scrape instead of
+    being recorded; it returns a dict of label values to numbers. A failing
+    collector only drops its own samples.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._collect = collect
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _labels(self, key: LabelValues, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> Iterator[str]:
+        if self._collect is not None:
+            try:
+                values = self._collect()
+            except Exception as e:
+                logger.warning("Error collecting metric %s: %s", self.name, e)
+                return
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{self._labels(key)} {_format_value(value)}'
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}', *self.samples()]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label values: count per bucket (not cumulative), sum
+        self._histograms: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            counts, total = self._histograms.get(key) or ([0] * len(self.buckets), 0.0)
+            counts[index] += 1
+            self._histograms[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block, including when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._histograms.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f'{self.name}_bucket{self._labels(key, le)} {cumulative}'
+            yield f'{self.name}_sum{self._labels(key)} {_format_value(total)}'
+            yield f'{self.name}_count{self._labels(key)} {cumulative}'
+
+class Registry:
+    """The metrics exposed on /metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            # Re-registering (e.g. a re-created singleton) replaces the old family
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = (),
+                collect: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Counter:
+        return self.register(Counter(name, help, labels, collect))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (),
+              collect: Optional[Callable[[], Dict[LabelValues, float]]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+task_phase_seconds = registry.histogram(
+    'ytdlp_task_phase_seconds', 'Time spent in each phase of a task.', ['phase', 'task_type'])
+tasks_finished = registry.counter(
+    'ytdlp_tasks_finished_total', 'Tasks that reached a final status.', ['task_type', 'status'])
+downloaded_bytes = registry.counter(
+    'ytdlp_downloaded_bytes_total', 'Bytes written by yt-dlp downloads, before post-processing.', ['task_type'])
+storage_seconds = registry.histogram(
+    'ytdlp_storage_operation_seconds', 'Latency of task storage operations.', ['operation'], FAST_BUCKETS)
+auth_seconds = registry.histogram(
+    'ytdlp_auth_seconds', 'Latency of API key authentication, rate limiting and permission checks.',
+    ['outcome'], FAST_BUCKETS)
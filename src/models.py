@@ -14,6 +14,7 @@ class TaskType(Enum):
     GET_INFO = "get_info"
     GET_LIVE_VIDEO = "get_live_video"
     GET_LIVE_AUDIO = "get_live_audio"
+    GET_PLAYLIST = "get_playlist"
 
 @dataclass
 class Task:
@@ -34,6 +35,12 @@ class Task:
     completed_time: Optional[str] = None
     error: Optional[str] = None
     file: Optional[str] = None
+    callback_url: Optional[str] = None
+    batch_id: Optional[str] = None
+    parent_id: Optional[str] = None
+    media_type: Optional[str] = None
+    zip: Optional[bool] = None
+    priority: Optional[int] = None
 
     def to_dict(self) -> Dict[str, Any]:
         data = {
@@ -45,7 +52,9 @@ class Task:
         
         optional_fields = ['video_format', 'audio_format', 'start_time',
                           'end_time', 'force_keyframes', 'start', 'duration',
-                          'output_format', 'output_filename', 'completed_time', 'error', 'file']
+                          'output_format', 'output_filename', 'completed_time', 'error', 'file',
+                          'callback_url', 'batch_id', 'parent_id', 'media_type', 'zip',
+                          'priority']
         
         for field_name in optional_fields:
             value = getattr(self, field_name, None)
@@ -62,12 +71,16 @@ class ApiKey:
     memory_quota: int = 5368709120
     memory_usage: List[Dict] = field(default_factory=list)
     last_access: Optional[str] = None
+    rate_limit: Optional[int] = None
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        data = {
             'key': self.key,
             'permissions': self.permissions,
             'memory_quota': self.memory_quota,
             'memory_usage': self.memory_usage,
             'last_access': self.last_access
         }
+        if self.rate_limit is not None:
+            data['rate_limit'] = self.rate_limit
+        return data
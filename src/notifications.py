@@ -0,0 +1,141 @@
+import json
+import heapq
+import time
+import socket
+import ipaddress
+import threading
+import http.client
+import urllib.request
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from src.log import get_logger
+from config import task as task_config
+
+logger = get_logger(__name__)
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    return ip.is_global and not ip.is_multicast
+
+def is_public_host(host: str) -> bool:
+    """True if every address `host` resolves to is publicly routable.
+
+    Loopback, private (RFC 1918), link-local (such as the cloud metadata
+    service at 169.254.169.254) and reserved addresses are rejected, so
+    callbacks cannot reach the server itself or its internal network.
+    """
+    try:
+        infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return False
+    return bool(infos) and all(is_public_address(info[4][0]) for info in infos)
+
+def is_valid_callback_url(url: Any) -> bool:
+    if not isinstance(url, str):
+        return False
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return False
+    return is_public_host(parts.hostname)
+
+class _PublicConnectionMixin:
+    """Refuses to talk to a non-public peer.
+
+    The host is checked when the task is submitted and again before each
+    delivery, but DNS may change in between (or between the check and the
+    connect), so the address actually connected to is checked as well.
+    """
+
+    def connect(self):
+        super().connect()
+        peer = self.sock.getpeername()[0]
+        if not is_public_address(peer):
+            self.sock.close()
+            raise ConnectionRefusedError(f'{self.host} resolves to non-public address {peer}')
+
+class _PublicHTTPConnection(_PublicConnectionMixin, http.client.HTTPConnection):
+    pass
+
+class _PublicHTTPSConnection(_PublicConnectionMixin, http.client.HTTPSConnection):
+    pass
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_PublicHTTPConnection, req)
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_PublicHTTPSConnection, req, context=self._context)
+
+# No proxies: the peer check needs a direct connection to the receiver
+_opener = urllib.request.build_opener(urllib.request.ProxyHandler({}), _PublicHTTPHandler, _PublicHTTPSHandler)
+
+class WebhookSender:
+    """Background POSTs of finished tasks to their `callback_url`.
+
+    Failed deliveries are retried with exponential backoff, up to
+    WEBHOOK_MAX_ATTEMPTS attempts in total.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[float, int, str, bytes, int]] = []
+        self._seq = 0
+        self._started = False
+
+    def send(self, url: str, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode()
+        self._schedule(url, body, attempt=0, delay=0)
+
+    def _schedule(self, url: str, body: bytes, attempt: int, delay: float) -> None:
+        with self._cond:
+            if not self._started:
+                self._start()
+            self._seq += 1
+            heapq.heappush(self._queue, (time.monotonic() + delay, self._seq, url, body, attempt))
+            self._cond.notify()
+
+    def _start(self) -> None:
+        self._started = True
+        for _ in range(self.workers):
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _next(self) -> Tuple[str, bytes, int]:
+        with self._cond:
+            while True:
+                if self._queue:
+                    delay = self._queue[0][0] - time.monotonic()
+                    if delay <= 0:
+                        _, _, url, body, attempt = heapq.heappop(self._queue)
+                        return url, body, attempt
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+
+    def _run(self) -> None:
+        while True:
+            url, body, attempt = self._next()
+            try:
+                self._post(url, body)
+            except Exception as e:
+                attempt += 1
+                if attempt >= task_config.WEBHOOK_MAX_ATTEMPTS:
+                    logger.warning("Giving up on webhook %s after %d attempts: %s", url, attempt, e)
+                    continue
+                delay = min(task_config.WEBHOOK_BACKOFF_SECONDS * 2 ** (attempt - 1),
+                            task_config.WEBHOOK_MAX_BACKOFF_SECONDS)
+                logger.info("Webhook %s failed (%s), retrying in %ss", url, e, delay)
+                self._schedule(url, body, attempt, delay)
+
+    @staticmethod
+    def _post(url: str, body: bytes) -> None:
+        if not is_valid_callback_url(url):
+            raise ValueError(f'{url} is not a public http(s) URL')
+        req = urllib.request.Request(url, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        with _opener.open(req, timeout=task_config.WEBHOOK_TIMEOUT_SECONDS) as response:
+            response.read()
+
+webhook_sender = WebhookSender(task_config.WEBHOOK_WORKERS)
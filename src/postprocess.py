@@ -0,0 +1,268 @@
+import os
+import time
+import atexit
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import yt_dlp
+from yt_dlp.postprocessor import FFmpegExtractAudioPP
+from mutagen.mp3 import MP3
+from mutagen.id3 import ID3, TIT2, TPE1, ID3NoHeaderError
+
+from src.metrics import registry
+from src.log import get_logger, log_context, current_context
+from config import task as task_config
+
+# The functions below run inside the worker processes; keep this module free
+# of imports from the rest of the server (src.metrics and src.log only need config).
+
+logger = get_logger(__name__)
+
+def update_mp3_id3_tags(file_path: str, title: str):
+    """Update MP3 ID3 tags based on title format 'artist - track'
+
+    Args:
+        file_path: Path to the MP3 file
+        title: Video/audio title from YouTube
+    """
+    try:
+        logger.debug("[ID3] Processing file %s, title %r", file_path, title)
+
+        # Check if file exists
+        if not os.path.exists(file_path):
+            logger.error("[ID3] File does not exist: %s", file_path)
+            return
+
+        # Check if file is MP3
+        if not file_path.lower().endswith('.mp3'):
+            logger.debug("[ID3] Skipping non-MP3 file: %s", file_path)
+            return
+
+        # Try to load existing ID3 tags or create new ones
+        try:
+            audio = MP3(file_path, ID3=ID3)
+            if audio.tags is None:
+                audio.add_tags()
+        except ID3NoHeaderError:
+            audio = MP3(file_path)
+            audio.add_tags()
+
+        # Parse title for "artist - track" format
+        if ' - ' in title:
+            parts = title.split(' - ', 1)  # Split only on first " - "
+            artist = parts[0].strip()
+            track = parts[1].strip()
+
+            logger.debug("[ID3] Setting artist %r, track %r", artist, track)
+
+            # Delete existing tags first to avoid duplicates
+            audio.tags.delall('TPE1')
+            audio.tags.delall('TIT2')
+
+            # Update artist and title tags
+            audio.tags.add(TPE1(encoding=3, text=artist))
+            audio.tags.add(TIT2(encoding=3, text=track))
+        else:
+            logger.debug("[ID3] Setting track only: %r", title)
+
+            # Delete existing tags first
+            audio.tags.delall('TIT2')
+
+            # No artist separator found, just update title
+            audio.tags.add(TIT2(encoding=3, text=title))
+
+        # Save the tags
+        audio.save()
+        logger.debug("[ID3] Updated ID3 tags for %s", file_path)
+    except Exception as e:
+        logger.error("[ID3] Error updating ID3 tags for %s: %s", file_path, e, exc_info=True)
+
+def extract_audio(file_path: str, codec: str) -> str:
+    """Convert `file_path` to `codec` with yt-dlp's FFmpegExtractAudio; returns the new path."""
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+        pp = FFmpegExtractAudioPP(ydl, preferredcodec=codec)
+        info = {'filepath': file_path, 'ext': os.path.splitext(file_path)[1].lstrip('.')}
+        files_to_delete, info = pp.run(info)
+    for path in files_to_delete:
+        if path != info['filepath'] and os.path.exists(path):
+            os.remove(path)
+    return info['filepath']
+
+def run_job(file_path: str, audio_codec: Optional[str], title: Optional[str],
+            context: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, float]]:
+    """Post-process one downloaded file in a worker process.
+
+    Returns the path of the final file and the seconds spent per phase
+    ('postprocess' for conversion, 'tagging' for ID3 tags). `context` is
+    the submitter's logging context.
+    """
+    with log_context(**(context or {})):
+        return _run_job(file_path, audio_codec, title)
+
+def _run_job(file_path: str, audio_codec: Optional[str], title: Optional[str]) -> Tuple[str, Dict[str, float]]:
+    timings = {}
+    if audio_codec:
+        started = time.perf_counter()
+        file_path = extract_audio(file_path, audio_codec)
+        timings['postprocess'] = time.perf_counter() - started
+    if title is not None and file_path.lower().endswith('.mp3'):
+        started = time.perf_counter()
+        update_mp3_id3_tags(file_path, title)
+        timings['tagging'] = time.perf_counter() - started
+    return file_path, timings
+
+def needs_postprocessing(file_path: str, audio_codec: Optional[str], title: Optional[str]) -> bool:
+    return bool(audio_codec) or (title is not None and file_path.lower().endswith('.mp3'))
+
+class PostProcessPool:
+    """CPU-bound work on finished downloads, run in separate processes.
+
+    Download workers hand their file over and return to the network right
+    away; `callback(path, error, timings)` runs in this process once the job
+    is done, on one of the pool's callback threads rather than on the
+    executor's own result thread, so slow completion work does not hold up
+    other jobs.
+    The pool is started on first use with the 'spawn' method, so the
+    workers do not inherit the server's threads or open connections. If a
+    worker dies (crash, OOM kill), the executor is replaced for later jobs.
+    Spawned workers re-import the parent's `__main__`, so code that runs
+    on import and starts threads (as src.server does) must check
+    `in_spawned_child` first.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._callbacks: Optional[ThreadPoolExecutor] = None
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'busy_seconds': 0.0}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._callbacks = self._callbacks or ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='postprocess-callback')
+            return self._executor
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        """Drop a broken executor so the next job starts a new one."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        logger.warning("[POSTPROCESS] Worker process died; restarting the pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, file_path: str, audio_codec: Optional[str], title: Optional[str],
+               callback: Callable[[Optional[str], Optional[BaseException], Dict[str, float]], None]) -> Future:
+        """Queue a job; the returned future resolves once `callback` has run."""
+        with self._lock:
+            self._stats['submitted'] += 1
+        try:
+            executor = self._pool()
+            try:
+                future = executor.submit(run_job, file_path, audio_codec, title, current_context())
+            except BrokenProcessPool:
+                self._discard(executor)
+                executor = self._pool()
+                future = executor.submit(run_job, file_path, audio_codec, title, current_context())
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            raise
+        finished = Future()
+
+        def complete(f: Future) -> None:
+            error = f.exception()
+            try:
+                if error is None:
+                    callback(f.result()[0], None, f.result()[1])
+                else:
+                    callback(None, error, {})
+            except Exception as e:
+                logger.error("[POSTPROCESS] Completion of %s failed: %s", file_path, e, exc_info=True)
+            finished.set_result(None)
+
+        def done(f: Future) -> None:
+            # Runs on the executor's result thread; keep it short
+            error = f.exception()
+            with self._lock:
+                if error is None:
+                    self._stats['completed'] += 1
+                    self._stats['busy_seconds'] += sum(f.result()[1].values())
+                else:
+                    self._stats['failed'] += 1
+                callbacks = self._callbacks
+            if isinstance(error, BrokenProcessPool):
+                self._discard(executor)
+            try:
+                if callbacks is None:
+                    raise RuntimeError('pool is shut down')
+                callbacks.submit(complete, f)
+            except RuntimeError:
+                finished.set_result(None)
+
+        future.add_done_callback(done)
+        return finished
+
+    def shutdown(self) -> None:
+        """Stop the worker processes, dropping queued jobs; called at exit."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            callbacks, self._callbacks = self._callbacks, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if callbacks is not None:
+            callbacks.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['pending'] = stats['submitted'] - stats['completed'] - stats['failed']
+        return stats
+
+postprocess_pool = PostProcessPool(task_config.POSTPROCESS_WORKERS)
+atexit.register(postprocess_pool.shutdown)
+
+def in_spawned_child() -> bool:
+    """Whether this process is a spawned child, such as a post-processing worker.
+
+    Also true while the child is still re-importing the parent's
+    `__main__`, before the job it was started for has begun.
+    """
+    return multiprocessing.current_process().name != 'MainProcess'
+
+def exit_on_sigterm() -> None:
+    """Exit cleanly on SIGTERM, so the pool's worker processes are stopped too.
+
+    Python's default is to die at once, leaving the spawned workers behind.
+    Only takes effect in the main thread, and only if nothing else (such as
+    gunicorn) has claimed the signal.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL:
+        return
+
+    def stop(signum, frame):
+        postprocess_pool.shutdown()
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, stop)
+
+registry.gauge('ytdlp_postprocess_workers', 'Post-processing worker processes.',
+               collect=lambda: {(): postprocess_pool.workers})
+registry.gauge('ytdlp_postprocess_pending', 'Post-processing jobs queued or running.',
+               collect=lambda: {(): postprocess_pool.stats()['pending']})
+registry.counter('ytdlp_postprocess_jobs_total', 'Finished post-processing jobs.', ['outcome'],
+                 collect=lambda: {('completed',): postprocess_pool.stats()['completed'],
+                                  ('failed',): postprocess_pool.stats()['failed']})
+registry.counter('ytdlp_postprocess_busy_seconds_total', 'Time post-processing workers spent on jobs.',
+                 collect=lambda: {(): postprocess_pool.stats()['busy_seconds']})
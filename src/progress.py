@@ -0,0 +1,100 @@
+import math
+import time
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+class ProgressTracker:
+    """In-memory download progress per task, fed by yt-dlp hooks.
+
+    Every update bumps a per-task version so readers can block until
+    something changes instead of polling. Waiters sleep on a condition
+    that exists only for their task, so a tick wakes that task's waiters
+    and no one else.
+    """
+
+    # Server-side paths, kept for internal use but not shown to clients
+    PRIVATE_FIELDS = ('filename', 'tmpfilename')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._conds: Dict[str, threading.Condition] = {}
+        self._waiters: Dict[str, int] = {}
+        self._progress: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, int] = {}
+
+    def get(self, task_id: str, private: bool = False) -> Optional[Dict[str, Any]]:
+        progress = self._progress.get(task_id)
+        if progress is None:
+            return None
+        return {k: v for k, v in progress.items() if private or k not in self.PRIVATE_FIELDS}
+
+    def version(self, task_id: str) -> int:
+        return self._versions.get(task_id, 0)
+
+    def update(self, task_id: str, **fields) -> None:
+        with self._lock:
+            self._progress.setdefault(task_id, {}).update(fields)
+            self.notify(task_id)
+
+    def notify(self, task_id: str) -> None:
+        """Wake readers of `task_id`, e.g. after its status changed."""
+        with self._lock:
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            cond = self._conds.get(task_id)
+            if cond is not None:
+                cond.notify_all()
+
+    def wait(self, task_id: str, since_version: int, timeout: float) -> int:
+        """Block until `task_id` moves past `since_version` or `timeout` expires."""
+        if not math.isfinite(timeout):
+            raise ValueError('timeout must be finite')
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            cond = self._conds.setdefault(task_id, threading.Condition(self._lock))
+            self._waiters[task_id] = self._waiters.get(task_id, 0) + 1
+            try:
+                while self._versions.get(task_id, 0) == since_version:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    cond.wait(remaining)
+                return self._versions.get(task_id, 0)
+            finally:
+                self._waiters[task_id] -= 1
+                if not self._waiters[task_id]:
+                    del self._waiters[task_id]
+                    del self._conds[task_id]
+
+    def discard(self, task_id: str) -> None:
+        with self._lock:
+            self._progress.pop(task_id, None)
+            self._versions.pop(task_id, None)
+            cond = self._conds.get(task_id)
+            if cond is not None:
+                cond.notify_all()
+
+    def hooks(self, task_id: str) -> Tuple[Callable, Callable]:
+        """yt-dlp `progress_hooks` and `postprocessor_hooks` entries for a task."""
+
+        def progress_hook(d: Dict[str, Any]) -> None:
+            self.update(
+                task_id,
+                stage='downloading' if d.get('status') == 'downloading' else 'downloaded',
+                downloaded_bytes=d.get('downloaded_bytes'),
+                total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                speed=d.get('speed'),
+                eta=d.get('eta'),
+                fragment_index=d.get('fragment_index'),
+                fragment_count=d.get('fragment_count'),
+                filename=d.get('filename'),
+                tmpfilename=d.get('tmpfilename'),
+            )
+
+        def postprocessor_hook(d: Dict[str, Any]) -> None:
+            self.update(task_id, stage='postprocessing',
+                        postprocessor=d.get('postprocessor'),
+                        postprocessor_status=d.get('status'))
+
+        return progress_hook, postprocessor_hook
+
+progress_tracker = ProgressTracker()
@@ -0,0 +1,115 @@
+import math
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, List
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: int
+    retry_after: int = 0
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(self.reset),
+        }
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+def sliding_window(state: List[float], now: float, limit: int, window: int, cost: int) -> RateLimitResult:
+    """Sliding-window counter over `state` = [window_start, current, previous].
+
+    The request rate is estimated as the current window's count plus the
+    previous window's count weighted by how much of it still overlaps the
+    sliding window. `state` is updated in place when the hit is allowed.
+    A `cost` above `limit` is charged as `limit`, so large batches use up
+    the whole window instead of being refused forever.
+    """
+    cost = min(cost, limit)
+    window_start = now - now % window
+    if state[0] != window_start:
+        state[2] = state[1] if state[0] == window_start - window else 0
+        state[1] = 0
+        state[0] = window_start
+
+    elapsed = now - window_start
+    reset = math.ceil(window - elapsed)
+    estimated = state[2] * (1 - elapsed / window) + state[1]
+
+    if estimated + cost > limit:
+        if state[1] + cost > limit:
+            # Only fits once this window has become the previous one and decayed enough
+            retry_after = reset + math.ceil(window * (1 - (limit - cost) / state[1]))
+        elif not state[2]:
+            retry_after = reset
+        else:
+            # Time until the previous window's weight has decayed enough
+            retry_after = math.ceil(window * (1 - (limit - state[1] - cost) / state[2]) - elapsed)
+        return RateLimitResult(False, limit, max(0, int(limit - estimated)), reset, max(1, retry_after))
+
+    state[1] += cost
+    return RateLimitResult(True, limit, max(0, int(limit - estimated - cost)), reset)
+
+class RateLimitBackend(ABC):
+    """Counter store for the rate limiter, keyed by API key name."""
+
+    @abstractmethod
+    def hit(self, key_name: str, limit: int, window: int, cost: int = 1) -> RateLimitResult: ...
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    """Per-process counters; O(1) per hit."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, List[float]] = {}
+
+    def hit(self, key_name: str, limit: int, window: int, cost: int = 1) -> RateLimitResult:
+        with self._lock:
+            state = self._counters.setdefault(key_name, [0, 0, 0])
+            return sliding_window(state, time.time(), limit, window, cost)
+
+class SqliteRateLimitBackend(RateLimitBackend):
+    """Counters shared by every process using the same database file."""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._conn().execute('''
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key_name TEXT PRIMARY KEY,
+                window_start REAL NOT NULL,
+                current INTEGER NOT NULL,
+                previous INTEGER NOT NULL
+            )
+        ''')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key_name: str, limit: int, window: int, cost: int = 1) -> RateLimitResult:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT window_start, current, previous FROM rate_limits WHERE key_name = ?',
+                               (key_name,)).fetchone()
+            state = list(row) if row else [0, 0, 0]
+            result = sliding_window(state, time.time(), limit, window, cost)
+            conn.execute('INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?)', (key_name, *state))
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
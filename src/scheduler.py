@@ -0,0 +1,189 @@
+import os
+import time
+import socket
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Any, Optional, Set
+
+from src.storage import Storage
+from src.models import TaskStatus, TaskType
+from src.task_queue import TaskQueue, create_queue
+from src.metrics import registry
+from src.log import get_logger
+from config import task as task_config
+
+logger = get_logger(__name__)
+
+# Which worker pool runs each task type
+POOL_BY_TYPE = {
+    TaskType.GET_INFO.value: 'info',
+    TaskType.GET_PLAYLIST.value: 'info',
+    TaskType.GET_VIDEO.value: 'media',
+    TaskType.GET_AUDIO.value: 'media',
+    TaskType.GET_LIVE_VIDEO.value: 'live',
+    TaskType.GET_LIVE_AUDIO.value: 'live',
+}
+
+# Result of a handler's Future asking for the task to be queued again
+REQUEUE = object()
+
+class WorkerPool:
+    """A fixed-size ThreadPoolExecutor plus the slots that gate claiming.
+
+    A task is only claimed from the queue once a worker is free, so
+    priorities and fairness apply at the moment a worker picks up work.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-worker')
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self.busy = 0
+
+    def acquire(self) -> None:
+        self.slots.acquire()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Run `fn` in a slot taken with `acquire`."""
+        with self._lock:
+            self.busy += 1
+        return self.executor.submit(fn, *args)
+
+    def release(self, ran: bool = True) -> None:
+        """Free a slot; `ran` is False if nothing was submitted in it."""
+        if ran:
+            with self._lock:
+                self.busy -= 1
+        self.slots.release()
+
+class TaskScheduler:
+    """Feeds tasks from a TaskQueue into one worker pool per task category.
+
+    Each claimed task is moved waiting -> processing in storage before it
+    runs, so an id that is enqueued twice still runs only once. While a task
+    runs its lease is renewed every third of QUEUE_LEASE_SECONDS; if this
+    process dies, another worker picks the task up once the lease expires.
+
+    The handler may return a Future for work that continues elsewhere (such
+    as post-processing); the worker slot is freed straight away but the
+    lease is held until that future is done.
+
+    If that future resolves to REQUEUE, the task goes back to waiting and is
+    queued again, e.g. to run once another task has produced its file.
+    Exceptions that escape the handler are logged and passed to `on_failed`.
+    """
+
+    def __init__(self, handler: Callable[[str, Dict[str, Any]], Optional[Future]],
+                 on_dropped: Optional[Callable[[str], None]] = None,
+                 queue: Optional[TaskQueue] = None,
+                 on_failed: Optional[Callable[[str, BaseException], None]] = None):
+        self.handler = handler
+        self.on_dropped = on_dropped
+        self.on_failed = on_failed
+        self.queue = queue or create_queue()
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}'
+        self._leases: Set[str] = set()
+        self._leases_lock = threading.Lock()
+        self.pools = {
+            'info': WorkerPool('info', task_config.INFO_WORKERS),
+            'media': WorkerPool('media', task_config.MAX_WORKERS),
+            'live': WorkerPool('live', task_config.LIVE_WORKERS),
+        }
+        registry.gauge('ytdlp_pool_workers', 'Worker threads per pool.', ['pool'],
+                       collect=lambda: {(name,): pool.max_workers for name, pool in self.pools.items()})
+        registry.gauge('ytdlp_pool_busy', 'Busy worker threads per pool.', ['pool'],
+                       collect=lambda: {(name,): pool.busy for name, pool in self.pools.items()})
+        registry.gauge('ytdlp_queue_pending', 'Tasks waiting in the queue for a worker.',
+                       collect=lambda: {(): self.pending()})
+
+    def enqueue(self, task_id: str, task: Dict[str, Any]) -> None:
+        pool = POOL_BY_TYPE.get(task['task_type'], 'media')
+        self.queue.put(task_id, pool, task.get('key_name') or '', task.get('priority') or 0)
+
+    def pending(self) -> int:
+        return self.queue.pending()
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def run(self) -> None:
+        threads = [threading.Thread(target=self._dispatch, args=(pool,), daemon=True)
+                   for pool in self.pools.values()]
+        threads.append(threading.Thread(target=self._maintain, daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _dispatch(self, pool: WorkerPool) -> None:
+        while True:
+            pool.acquire()
+            try:
+                task_id, attempt = self.queue.claim(pool.name, self.worker_id)
+                task = Storage.transition_task(task_id, TaskStatus.WAITING.value,
+                                               status=TaskStatus.PROCESSING.value)
+                if task is None and attempt > 1:
+                    # A retry after an expired lease; the task was left as processing
+                    task = Storage.get_task(task_id)
+                    if task and task.get('status') != TaskStatus.PROCESSING.value:
+                        task = None
+                if task is None:
+                    self.queue.complete(task_id)
+                    pool.release(ran=False)
+                    continue
+            except Exception as e:
+                # E.g. 'database is locked'; a task claimed here is retried once its lease expires
+                logger.error("Error dispatching %s tasks: %s", pool.name, e)
+                pool.release(ran=False)
+                time.sleep(task_config.QUEUE_POLL_SECONDS)
+                continue
+            with self._leases_lock:
+                self._leases.add(task_id)
+            future = pool.submit(self.handler, task_id, task)
+            future.add_done_callback(lambda f, task_id=task_id: self._finished(pool, task_id, f))
+
+    def _finished(self, pool: WorkerPool, task_id: str, future: Future) -> None:
+        pool.release()
+        error = future.exception()
+        if error is not None:
+            logger.error("Task %s failed: %s", task_id, error, exc_info=error)
+            if self.on_failed:
+                try:
+                    self.on_failed(task_id, error)
+                except Exception as e:
+                    logger.error("Error failing task %s: %s", task_id, e)
+        pending = future.result() if error is None else None
+        if isinstance(pending, Future):
+            pending.add_done_callback(
+                lambda f: self._complete(task_id, requeue=f.exception() is None and f.result() is REQUEUE))
+        else:
+            self._complete(task_id)
+
+    def _complete(self, task_id: str, requeue: bool = False) -> None:
+        with self._leases_lock:
+            self._leases.discard(task_id)
+        self.queue.complete(task_id)
+        if requeue:
+            task = Storage.transition_task(task_id, TaskStatus.PROCESSING.value, status=TaskStatus.WAITING.value)
+            if task is not None:
+                self.enqueue(task_id, task)
+
+    def _maintain(self) -> None:
+        """Renew our leases and hand back the ones other workers let expire."""
+        while True:
+            time.sleep(task_config.QUEUE_LEASE_SECONDS / 3)
+            try:
+                with self._leases_lock:
+                    leases = list(self._leases)
+                for task_id in leases:
+                    if not self.queue.heartbeat(task_id, self.worker_id):
+                        logger.warning("Lost the lease on task %s", task_id)
+                for task_id in self.queue.requeue_expired():
+                    if self.on_dropped:
+                        self.on_dropped(task_id)
+            except Exception as e:
+                logger.error("Error maintaining task leases: %s", e)
@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Hashable, List, Tuple
+
+import yt_dlp
+
+from src.cache import TTLCache
+from config import task as task_config
+from config import cache as cache_config
+
+# Results are fetched in multiples of this, so nearby pages share one search
+FETCH_STEP = 10
+
+class SearchService:
+    """YouTube searches on a small thread pool, cached per normalized query.
+
+    A cached result list answers any `offset`/`limit` window it covers;
+    wider windows fetch again. Identical searches in progress share one
+    yt-dlp run, and callers give up after SEARCH_TIMEOUT_SECONDS, so slow
+    searches tie up pool threads rather than web server threads. Each pool
+    thread keeps its own YoutubeDL instance, built with `params`.
+    """
+
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+        self._cache = TTLCache(ttl=cache_config.SEARCH_TTL_SECONDS,
+                               max_entries=cache_config.SEARCH_MAX_ENTRIES)
+        self._executor = ThreadPoolExecutor(max_workers=task_config.SEARCH_WORKERS,
+                                            thread_name_prefix='search')
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._local = threading.local()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return ' '.join(query.split()).casefold()
+
+    def search(self, query: str, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """Entries `offset` to `offset + limit` of the results for `query`.
+
+        Raises TimeoutError when the search takes too long or too many
+        searches are already waiting.
+        """
+        query = self.normalize(query)
+        wanted = offset + limit
+        cached = self._cache.get(query)
+        if cached is not None and (len(cached[0]) >= wanted or cached[1]):
+            return cached[0][offset:wanted]
+
+        fetch = -(-wanted // FETCH_STEP) * FETCH_STEP
+        key = (query, fetch)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                if len(self._in_flight) >= task_config.SEARCH_MAX_PENDING:
+                    raise TimeoutError('Too many searches in progress')
+                future = self._in_flight[key] = self._executor.submit(self._run, query, fetch)
+                future.add_done_callback(lambda _: self._done(key))
+
+        entries, _ = future.result(timeout=task_config.SEARCH_TIMEOUT_SECONDS)
+        return entries[offset:wanted]
+
+    def _done(self, key: Hashable) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _ydl(self) -> yt_dlp.YoutubeDL:
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            ydl = self._local.ydl = yt_dlp.YoutubeDL({
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': True,
+                'skip_download': True,
+                **self.params,
+            })
+        return ydl
+
+    def _run(self, query: str, count: int) -> Tuple[List[Dict[str, Any]], bool]:
+        result = self._ydl().extract_info(f"ytsearch{count}:{query}", download=False)
+        entries = [self._compact(entry) for entry in (result or {}).get('entries') or [] if entry]
+        # Fewer results than asked for: there are no more to fetch
+        value = (entries, len(entries) < count)
+        cached = self._cache.get(query)
+        if cached is None or len(entries) >= len(cached[0]):
+            self._cache.set(query, value)
+        return value
+
+    @staticmethod
+    def _compact(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'url': f"https://www.youtube.com/watch?v={entry['id']}",
+            'title': entry.get('title', 'Unknown'),
+            'duration': entry.get('duration', 0),
+            'id': entry.get('id'),
+            'channel': entry.get('channel') or entry.get('uploader'),
+        }
@@ -1,32 +1,66 @@
 import os
 import json
+import math
+import mimetypes
+import time
 import random
 import string
-from flask import Flask, request, jsonify, send_from_directory
+from typing import Callable, Optional
+from flask import Flask, request, jsonify, Response, stream_with_context
 
 from src.storage import Storage
-from src.auth import auth_manager, memory_manager, require_permission, AuthManager
+from src.auth import (auth_manager, memory_manager, require_permission, charge_rate_limit, AuthManager,
+                      key_registry)
 from src.models import Task, TaskStatus, TaskType
+from src.progress import progress_tracker
+from src.notifications import is_valid_callback_url
+from src import delivery
+from src.metrics import registry
+from src.tracing import profiler
+from src.info_files import info_file_cache, parse_fields, MISSING
 from config import storage
+from config import task as task_config
 
 from src import yt_handler
+from src.postprocess import exit_on_sigterm, in_spawned_child
 
 app = Flask(__name__)
 app.json.sort_keys = False
 
+def start() -> None:
+    """Start the task workers and SIGTERM handling for this server process.
+
+    Runs on import, since `flask run` and WSGI servers only import the app.
+    Skipped in the post-processing workers: they are spawned and re-import
+    the parent's `__main__`, which is this module under `python -m src.server`.
+    """
+    yt_handler.downloader.initialize(run_workers=task_config.NODE_ROLE != 'api')
+    exit_on_sigterm()
+
+if not in_spawned_child():
+    start()
+
+BATCH_TASK_TYPES = {t.value: t for t in (TaskType.GET_VIDEO, TaskType.GET_AUDIO, TaskType.GET_INFO,
+                                         TaskType.GET_LIVE_VIDEO, TaskType.GET_LIVE_AUDIO)}
+
 def generate_task_id(length: int = 16) -> str:
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
-def create_task(task_type: TaskType, data: dict) -> dict:
-    if not data.get('url'):
-        return {'status': 'error', 'message': 'URL is required'}, 400
-    
-    task_id = generate_task_id()
-    api_key = request.headers.get('X-API-Key')
+def build_task(task_type: TaskType, data: dict, key_name: str, **extra) -> Task:
+    """Validate a task payload; raises ValueError with a client-facing message."""
+    if not isinstance(data, dict) or not data.get('url'):
+        raise ValueError('URL is required')
+    if data.get('callback_url') is not None and not is_valid_callback_url(data['callback_url']):
+        raise ValueError('callback_url must be an http(s) URL on a public address')
+    priority = data.get('priority')
+    if priority is not None and (not isinstance(priority, int) or isinstance(priority, bool)
+                                 or abs(priority) > task_config.MAX_PRIORITY):
+        raise ValueError(f'priority must be an integer between -{task_config.MAX_PRIORITY} '
+                         f'and {task_config.MAX_PRIORITY}')
     
-    task = Task(
-        task_id=task_id,
-        key_name=AuthManager.get_key_name(api_key),
+    return Task(
+        task_id=generate_task_id(),
+        key_name=key_name,
         status=TaskStatus.WAITING,
         task_type=task_type,
         url=data['url'],
@@ -38,14 +72,26 @@ def create_task(task_type: TaskType, data: dict) -> dict:
         start=data.get('start', 0),
         duration=data.get('duration'),
         output_format=data.get('output_format'),
-        output_filename=data.get('output_filename')
+        output_filename=data.get('output_filename'),
+        callback_url=data.get('callback_url'),
+        priority=priority,
+        **extra
     )
+
+def create_task(task_type: TaskType, data: dict, **extra) -> dict:
+    api_key = request.headers.get('X-API-Key')
+    try:
+        task = build_task(task_type, data, AuthManager.get_key_name(api_key), **extra)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+    limited = charge_rate_limit()
+    if limited is not None:
+        return limited
     
-    tasks = Storage.load_tasks()
-    tasks[task_id] = task.to_dict()
-    Storage.save_tasks(tasks)
+    Storage.add_task(task.task_id, task.to_dict())
+    yt_handler.downloader.enqueue(task.task_id, task.to_dict())
     
-    return jsonify({'status': 'waiting', 'task_id': task_id})
+    return jsonify({'status': 'waiting', 'task_id': task.task_id})
 
 @app.route('/get_video', methods=['POST'])
 @require_permission('get_video')
@@ -62,6 +108,15 @@ def get_audio():
 def get_info():
     return create_task(TaskType.GET_INFO, request.json)
 
+@app.route('/get_playlist', methods=['POST'])
+@require_permission('get_playlist')
+def get_playlist():
+    data = request.json
+    media_type = data.get('media_type', 'audio') if isinstance(data, dict) else None
+    if media_type not in ('audio', 'video'):
+        return {'status': 'error', 'message': 'media_type must be "audio" or "video"'}, 400
+    return create_task(TaskType.GET_PLAYLIST, data, media_type=media_type, zip=bool(data.get('zip', False)))
+
 @app.route('/get_live_video', methods=['POST'])
 @require_permission('get_live_video')
 def get_live_video():
@@ -72,6 +127,84 @@ def get_live_video():
 def get_live_audio():
     return create_task(TaskType.GET_LIVE_AUDIO, request.json)
 
+def batch_specs() -> list:
+    data = request.get_json(silent=True)
+    specs = data.get('tasks') if isinstance(data, dict) else None
+    return specs if isinstance(specs, list) else []
+
+def batch_spec_type(spec) -> Optional[TaskType]:
+    task_type = spec.get('type') if isinstance(spec, dict) else None
+    return BATCH_TASK_TYPES.get(task_type) if isinstance(task_type, str) else None
+
+def batch_permissions() -> set:
+    return {t.value for t in map(batch_spec_type, batch_specs()) if t}
+
+@app.route('/batch', methods=['POST'])
+@require_permission(batch_permissions)
+def create_batch():
+    specs = batch_specs()
+    if not specs:
+        return jsonify({'status': 'error', 'message': 'tasks must be a non-empty list'}), 400
+    if len(specs) > task_config.MAX_BATCH_SIZE:
+        return jsonify({'status': 'error', 'message': f'At most {task_config.MAX_BATCH_SIZE} tasks per batch'}), 400
+    
+    batch_id = generate_task_id()
+    key_name = AuthManager.get_key_name(request.headers.get('X-API-Key'))
+    tasks, errors = {}, []
+    for index, spec in enumerate(specs):
+        try:
+            task_type = batch_spec_type(spec)
+            if task_type is None:
+                raise ValueError(f"type must be one of {', '.join(BATCH_TASK_TYPES)}")
+            task = build_task(task_type, spec, key_name, batch_id=batch_id)
+            tasks[task.task_id] = task.to_dict()
+        except ValueError as e:
+            errors.append({'index': index, 'message': str(e)})
+    
+    if errors:
+        return jsonify({'status': 'error', 'message': 'Invalid tasks', 'errors': errors}), 400
+    limited = charge_rate_limit(len(tasks))
+    if limited is not None:
+        return limited
+    
+    Storage.add_tasks(tasks)
+    for task_id, task in tasks.items():
+        yt_handler.downloader.enqueue(task_id, task)
+    
+    return jsonify({'status': 'waiting', 'batch_id': batch_id, 'task_ids': list(tasks)})
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id: str):
+    tasks = Storage.find_tasks(batch_id=batch_id)
+    if not tasks:
+        return jsonify({'status': 'error', 'message': 'Batch not found'}), 404
+    
+    counts = {status.value: 0 for status in TaskStatus}
+    for task in tasks.values():
+        counts[task['status']] += 1
+    
+    if counts[TaskStatus.WAITING.value] == len(tasks):
+        status = TaskStatus.WAITING.value
+    elif counts[TaskStatus.WAITING.value] or counts[TaskStatus.PROCESSING.value]:
+        status = TaskStatus.PROCESSING.value
+    elif counts[TaskStatus.ERROR.value] == len(tasks):
+        status = TaskStatus.ERROR.value
+    elif counts[TaskStatus.ERROR.value]:
+        status = 'partial'
+    else:
+        status = TaskStatus.COMPLETED.value
+    
+    return jsonify({
+        'batch_id': batch_id,
+        'status': status,
+        'total': len(tasks),
+        'counts': counts,
+        'tasks': {
+            task_id: {k: task[k] for k in ('task_type', 'url', 'status', 'file', 'error') if k in task}
+            for task_id, task in tasks.items()
+        }
+    })
+
 @app.route('/search', methods=['POST'])
 @require_permission('search')
 def search():
@@ -81,15 +214,167 @@ def search():
     if not query:
         return jsonify({'success': False, 'message': 'Query is required'}), 400
 
-    result = yt_handler.downloader.search(query)
+    limit, offset = data.get('limit', 1), data.get('offset', 0)
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= task_config.SEARCH_MAX_LIMIT:
+        return jsonify({'success': False,
+                        'message': f'limit must be an integer between 1 and {task_config.SEARCH_MAX_LIMIT}'}), 400
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        return jsonify({'success': False, 'message': 'offset must be a non-negative integer'}), 400
+
+    try:
+        result = yt_handler.downloader.search(query, limit, offset)
+    except TimeoutError as e:
+        return jsonify({'success': False, 'message': str(e) or 'Search timed out'}), 503
     return jsonify(result)
 
+@app.route('/metrics', methods=['GET'])
+@require_permission('get_metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profile/<task_id>', methods=['GET'])
+@require_permission('get_profile')
+def get_profile(task_id: str):
+    profile = profiler.load(task_id)
+    if profile is None:
+        return jsonify({'error': 'No profile for this task'}), 404
+    return Response(profile, mimetype='text/plain')
+
 @app.route('/status/<task_id>', methods=['GET'])
 def status(task_id: str):
-    tasks = Storage.load_tasks()
-    if task_id not in tasks:
+    version = progress_tracker.version(task_id)
+    task = Storage.get_task(task_id)
+    if task is None:
+        return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    if not math.isfinite(wait):
+        return jsonify({'status': 'error', 'message': 'wait must be a number of seconds'}), 400
+    wait = min(max(wait, 0.0), task_config.MAX_STATUS_WAIT_SECONDS)
+    
+    # Long-poll: hold the request until the status changes or `wait` runs out
+    deadline = time.monotonic() + wait
+    initial_status = task['status']
+    while task['status'] == initial_status and initial_status in ACTIVE_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        version = wait_for_change(task_id, version, remaining,
+                                  lambda: (Storage.get_task(task_id) or {}).get('status') != initial_status)
+        task = Storage.get_task(task_id)
+        if task is None:
+            return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    
+    return jsonify(status_view(task_id, task))
+
+@app.route('/status/<task_id>/events', methods=['GET'])
+def status_events(task_id: str):
+    if Storage.get_task(task_id) is None:
         return jsonify({'status': 'error', 'message': 'Task not found'}), 404
-    return jsonify(tasks[task_id])
+    
+    def current_view() -> Optional[dict]:
+        task = Storage.get_task(task_id)
+        return status_view(task_id, task) if task else None
+    
+    def events():
+        version = progress_tracker.version(task_id)
+        while True:
+            view = current_view()
+            if view is None:
+                yield f"event: error\ndata: {json.dumps({'message': 'Task not found'})}\n\n"
+                return
+            yield f"data: {json.dumps(view)}\n\n"
+            if view['status'] not in ACTIVE_STATUSES:
+                return
+            
+            # Coalesce bursts of hook updates into one event per interval;
+            # without updates the current state is re-sent as a keep-alive
+            time.sleep(task_config.PROGRESS_EVENT_INTERVAL)
+            version = wait_for_change(task_id, version, task_config.SSE_KEEPALIVE_SECONDS,
+                                      lambda: current_view() != view)
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+ACTIVE_STATUSES = (TaskStatus.WAITING.value, TaskStatus.PROCESSING.value)
+
+def wait_for_change(task_id: str, version: int, timeout: float, changed: Callable[[], bool]) -> int:
+    """`progress_tracker.wait` that also notices updates made on other nodes.
+
+    With a shared queue the task may run on another node, whose updates
+    never reach this process's tracker. The wait is then cut into
+    STREAM_POLL_SECONDS steps, and it ends early once `changed()` (which
+    re-reads storage) is true.
+    """
+    if not yt_handler.downloader.scheduler.queue.shared:
+        return progress_tracker.wait(task_id, version, timeout)
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        new_version = progress_tracker.wait(task_id, version, min(remaining, task_config.STREAM_POLL_SECONDS))
+        if new_version != version or remaining <= task_config.STREAM_POLL_SECONDS or changed():
+            return new_version
+
+def status_view(task_id: str, task: dict) -> dict:
+    """Task dict as returned by /status, with live progress attached."""
+    progress = progress_tracker.get(task_id)
+    if progress and task['status'] == TaskStatus.PROCESSING.value:
+        task['progress'] = progress
+    if task['task_type'] == TaskType.GET_PLAYLIST.value and task['status'] == TaskStatus.PROCESSING.value:
+        counts = {status.value: 0 for status in TaskStatus}
+        for child in Storage.find_tasks(parent_id=task_id).values():
+            counts[child['status']] += 1
+        task['progress'] = {'total': sum(counts.values()), 'counts': counts}
+    task.pop('entries', None)
+    return task
+
+@app.route('/files/<task_id>/stream', methods=['GET'])
+def stream_file(task_id: str):
+    task = Storage.get_task(task_id)
+    if task is None:
+        return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    if not yt_handler.downloader.is_streamable(task):
+        return jsonify({'status': 'error',
+                        'message': 'This task is merged, cut or converted after download and cannot be '
+                                   'streamed; fetch its file once the task is completed'}), 409
+    
+    # Wait for the download to start writing
+    deadline = time.monotonic() + task_config.STREAM_START_TIMEOUT_SECONDS
+    version = progress_tracker.version(task_id)
+    while True:
+        if task['status'] == TaskStatus.COMPLETED.value:
+            return handle_regular_file(os.path.join(storage.DOWNLOAD_DIR, task['file'][len('/files/'):]))
+        if task['status'] == TaskStatus.ERROR.value:
+            return jsonify({'status': 'error', 'message': task.get('error')}), 500
+        partial = yt_handler.downloader.partial_file(task_id, task)
+        if partial:
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return jsonify({'status': 'error', 'message': 'Download has not started yet'}), 504
+        version = progress_tracker.wait(task_id, version, min(remaining, task_config.STREAM_POLL_SECONDS))
+        task = Storage.get_task(task_id)
+        if task is None:
+            return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    
+    def is_finished() -> bool:
+        current = Storage.get_task(task_id)
+        if current is None or current['status'] == TaskStatus.ERROR.value:
+            raise Exception(f"Task {task_id} failed while streaming: "
+                            f"{current.get('error') if current else 'task removed'}")
+        progress = progress_tracker.get(task_id)
+        return current['status'] == TaskStatus.COMPLETED.value or \
+            (progress is not None and progress.get('stage') not in (None, 'downloading'))
+    
+    def wait():
+        progress_tracker.wait(task_id, progress_tracker.version(task_id), task_config.STREAM_POLL_SECONDS)
+    
+    mimetype = mimetypes.guess_type(partial[:-len('.part')])[0] or 'application/octet-stream'
+    return Response(stream_with_context(delivery.tail_file(partial, is_finished, wait)), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/files/<path:filename>', methods=['GET'])
 def get_file(filename: str):
@@ -101,74 +386,43 @@ def get_file(filename: str):
     if not file_path.startswith(os.path.abspath(storage.DOWNLOAD_DIR)):
         return jsonify({"error": "Access denied"}), 403
     
+    if '/' in filename:
+        yt_handler.downloader.disk.touch(filename.split('/', 1)[0])
+    
     if filename.endswith('info.json'):
         return handle_info_file(file_path)
     
-    return handle_regular_file(filename)
+    return handle_regular_file(file_path)
 
 def handle_info_file(file_path: str):
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    
     params = request.args
     if not params: 
-        return jsonify(data)
+        return handle_regular_file(file_path)
     
+    document = info_file_cache.load(file_path)
     result = {}
     if 'qualities' in params:
-        result['qualities'] = extract_qualities(data)
+        if document.qualities is None:
+            return jsonify({"error": "Could not extract qualities"}), 500
+        result['qualities'] = document.qualities
+    if 'fields' in params:
+        selected = document.project(parse_fields(params['fields']))
+        if selected is not MISSING:
+            result.update(selected)
     for key in params:
-        if key != 'qualities' and key in data:
-            result[key] = data[key]
+        if key not in ('qualities', 'fields') and key in document:
+            result[key] = document[key]
     
     if result:
         return jsonify(result)
     return jsonify({"error": "No matching parameters"}), 404
 
-def extract_qualities(data: dict) -> dict:
-    qualities = {"audio": {}, "video": {}}
-    
-    for fmt in data.get('formats', []):
-        if fmt.get('format_note') in ['unknown', 'storyboard']:
-            continue
-        
-        # Audio format
-        if fmt.get('acodec') != 'none' and fmt.get('vcodec') == 'none' and fmt.get('abr'):
-            qualities["audio"][fmt['format_id']] = {
-                "abr": int(fmt['abr']),
-                "acodec": fmt['acodec'],
-                "audio_channels": int(fmt.get('audio_channels', 0)),
-                "language": fmt['language'],
-                "filesize": int(fmt.get('filesize') or fmt.get('filesize_approx') or 0)
-            }
-        
-        # Video format
-        elif fmt.get('vcodec') != 'none' and fmt.get('height') and fmt.get('fps'):
-            qualities["video"][fmt['format_id']] = {
-                "height": int(fmt['height']),
-                "width": int(fmt['width']),
-                "fps": int(fmt['fps']),
-                "vcodec": fmt['vcodec'],
-                "format_note": fmt.get('format_note', 'unknown'),
-                "dynamic_range": fmt.get('dynamic_range', 'unknown'),
-                "filesize": int(fmt.get('filesize') or fmt.get('filesize_approx') or 0)
-            }
-    
-    qualities["video"] = dict(sorted(qualities["video"].items(), 
-                                   key=lambda x: (x[1]['height'], x[1]['fps'])))
-    qualities["audio"] = dict(sorted(qualities["audio"].items(), 
-                                   key=lambda x: x[1]['abr']))
-    
-    return qualities
-
-def handle_regular_file(filename: str):
+def handle_regular_file(file_path: str):
     raw = request.args.get('raw', 'false').lower() == 'true'
-    response = send_from_directory(storage.DOWNLOAD_DIR, filename, as_attachment=raw)
-    response.headers['Accept-Ranges'] = 'bytes'
-    response.headers['Cache-Control'] = 'public, max-age=3600'
+    headers = {'Cache-Control': 'public, max-age=3600'}
     if raw:
-        response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
-    return response
+        headers['Content-Disposition'] = f'inline; filename="{os.path.basename(file_path)}"'
+    return delivery.send_file(file_path, headers)
 
 @app.route('/create_key', methods=['POST'])
 @require_permission('create_key')
@@ -180,7 +434,11 @@ def create_key():
     if not name or not permissions:
         return jsonify({'error': 'Name and permissions required'}), 400
     
-    key = auth_manager.create_key(name, permissions)
+    rate_limit = data.get('rate_limit')
+    if rate_limit is not None and (not isinstance(rate_limit, int) or rate_limit <= 0):
+        return jsonify({'error': 'rate_limit must be a positive integer'}), 400
+    
+    key = auth_manager.create_key(name, permissions, rate_limit=rate_limit)
     return jsonify({'message': 'API key created', 'name': name, 'key': key}), 201
 
 @app.route('/delete_key/<name>', methods=['DELETE'])
@@ -193,15 +451,15 @@ def delete_key(name: str):
 @app.route('/get_key/<name>', methods=['GET'])
 @require_permission('get_key')
 def get_key(name: str):
-    keys = Storage.load_keys()
-    if name in keys:
-        return jsonify({'name': name, 'key': keys[name]['key']}), 200
+    key_info = key_registry.get(name)
+    if key_info:
+        return jsonify({'name': name, 'key': key_info['key']}), 200
     return jsonify({'error': 'Key not found'}), 404
 
 @app.route('/get_keys', methods=['GET'])
 @require_permission('get_keys')
 def get_keys():
-    return jsonify(Storage.load_keys()), 200
+    return jsonify(key_registry.all()), 200
 
 @app.route('/check_permissions', methods=['POST'])
 def check_permissions():
@@ -209,14 +467,14 @@ def check_permissions():
     if not api_key:
         return jsonify({'error': 'No API key provided'}), 401
     
-    keys = Storage.load_keys()
     key_name = AuthManager.get_key_name(api_key)
+    key_info = key_registry.get(key_name) if key_name else None
     
-    if not key_name or key_name not in keys:
+    if not key_info:
         return jsonify({'error': 'Invalid API key'}), 401
     
     required = request.json.get('permissions', [])
-    current = keys[key_name]['permissions']
+    current = key_info['permissions']
     
     if set(required).issubset(current):
         return jsonify({'message': 'Permissions granted'}), 200
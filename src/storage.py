@@ -1,33 +1,430 @@
 import json
 import os
-from typing import Dict, Any
+import fcntl
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Any, Iterable, List, Optional
+from src.metrics import storage_seconds
 from config import storage
 
-class Storage:
+def _load_json(file_path: str) -> Dict[str, Any]:
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+def _save_json(file_path: str, data: Dict[str, Any]) -> None:
+    # Write then rename, so other processes never read a half-written file
+    tmp_path = f'{file_path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, file_path)
+
+class StorageEngine(ABC):
+    """Backend for task records. Tasks are plain dicts keyed by task_id."""
+
+    @abstractmethod
+    def load_tasks(self) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    def save_tasks(self, tasks: Dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def add_tasks(self, tasks: Dict[str, Dict[str, Any]]) -> None: ...
+
+    @abstractmethod
+    def update_task(self, task_id: str, **fields) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def transition_task(self, task_id: str, from_status: str, **fields) -> Optional[Dict[str, Any]]:
+        """Apply `fields` only if the task is currently in `from_status`."""
+
+    @abstractmethod
+    def delete_task(self, task_id: str) -> bool: ...
+
+    @abstractmethod
+    def find_tasks(self, status: Optional[Iterable[str]] = None, key_name: Optional[str] = None,
+                   completed_before: Optional[str] = None, batch_id: Optional[str] = None,
+                   parent_id: Optional[str] = None) -> Dict[str, Any]: ...
+
+    @abstractmethod
+    def count_tasks(self, status: Optional[Iterable[str]] = None, key_name: Optional[str] = None,
+                    parent_id: Optional[str] = None) -> int: ...
+
+    @abstractmethod
+    def task_ids(self) -> List[str]: ...
+
+class JsonStorageEngine(StorageEngine):
+    """Original single-file backend; every operation rewrites TASKS_FILE."""
+
+    def __init__(self, tasks_file: str):
+        self.tasks_file = tasks_file
+        self._lock = threading.RLock()
+
     @staticmethod
-    def _load_json(file_path: str) -> Dict[str, Any]:
-        if not os.path.exists(file_path):
-            return {}
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    
+    def _matches(task: Dict[str, Any], status, key_name, completed_before, batch_id, parent_id) -> bool:
+        if status is not None and task.get('status') not in status:
+            return False
+        if key_name is not None and task.get('key_name') != key_name:
+            return False
+        if batch_id is not None and task.get('batch_id') != batch_id:
+            return False
+        if parent_id is not None and task.get('parent_id') != parent_id:
+            return False
+        if completed_before is not None:
+            completed = task.get('completed_time')
+            if not completed or completed >= completed_before:
+                return False
+        return True
+
+    def load_tasks(self) -> Dict[str, Any]:
+        with self._lock:
+            return _load_json(self.tasks_file)
+
+    def save_tasks(self, tasks: Dict[str, Any]) -> None:
+        with self._lock:
+            _save_json(self.tasks_file, tasks)
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return self.load_tasks().get(task_id)
+
+    def add_tasks(self, tasks: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            data = self.load_tasks()
+            data.update(tasks)
+            self.save_tasks(data)
+
+    def update_task(self, task_id: str, **fields) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            tasks = self.load_tasks()
+            if task_id not in tasks:
+                return None
+            tasks[task_id].update(fields)
+            self.save_tasks(tasks)
+            return tasks[task_id]
+
+    def transition_task(self, task_id: str, from_status: str, **fields) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            tasks = self.load_tasks()
+            if task_id not in tasks or tasks[task_id].get('status') != from_status:
+                return None
+            tasks[task_id].update(fields)
+            self.save_tasks(tasks)
+            return tasks[task_id]
+
+    def delete_task(self, task_id: str) -> bool:
+        with self._lock:
+            tasks = self.load_tasks()
+            if task_id not in tasks:
+                return False
+            del tasks[task_id]
+            self.save_tasks(tasks)
+            return True
+
+    def find_tasks(self, status=None, key_name=None, completed_before=None, batch_id=None,
+                   parent_id=None) -> Dict[str, Any]:
+        status = set(status) if status is not None else None
+        return {
+            task_id: task for task_id, task in self.load_tasks().items()
+            if self._matches(task, status, key_name, completed_before, batch_id, parent_id)
+        }
+
+    def count_tasks(self, status=None, key_name=None, parent_id=None) -> int:
+        return len(self.find_tasks(status=status, key_name=key_name, parent_id=parent_id))
+
+    def task_ids(self) -> List[str]:
+        return list(self.load_tasks().keys())
+
+class SqliteStorageEngine(StorageEngine):
+    """SQLite (WAL) backend with one row per task.
+
+    The full task dict is stored as JSON in `data`; the columns used for
+    lookups are mirrored next to it so they can be indexed.
+    """
+
+    INDEXED_FIELDS = ('key_name', 'status', 'task_type', 'completed_time', 'batch_id', 'parent_id')
+    COLUMNS = ('task_id',) + INDEXED_FIELDS + ('data',)
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_file: str, legacy_tasks_file: Optional[str] = None):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._create_schema()
+        if legacy_tasks_file:
+            self._migrate_json(legacy_tasks_file)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    def _create_schema(self) -> None:
+        directory = os.path.dirname(self.db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    key_name TEXT,
+                    status TEXT,
+                    task_type TEXT,
+                    completed_time TEXT,
+                    data TEXT NOT NULL,
+                    batch_id TEXT,
+                    parent_id TEXT
+                )
+            ''')
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}
+            if version < 2 and 'batch_id' not in columns:
+                conn.execute('ALTER TABLE tasks ADD COLUMN batch_id TEXT')
+            if version < 3 and 'parent_id' not in columns:
+                conn.execute('ALTER TABLE tasks ADD COLUMN parent_id TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_key_name ON tasks(key_name)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_completed_time ON tasks(completed_time)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_batch_id ON tasks(batch_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_parent_id ON tasks(parent_id)')
+            conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def _migrate_json(self, tasks_file: str) -> None:
+        """Import a pre-existing tasks.json once, then move it out of the way.
+
+        Several processes sharing the database may start at once. The check,
+        the import and the rename all happen under the write lock, so only
+        the first of them imports the file and the others find it gone.
+        """
+        if not os.path.exists(tasks_file):
+            return
+        with self._transaction() as conn:
+            tasks = _load_json(tasks_file)
+            if not tasks:
+                return
+            conn.executemany(
+                self._insert('INSERT OR IGNORE'),
+                [self._row(task_id, task) for task_id, task in tasks.items()]
+            )
+            # Renamed before the commit: if that fails, the import is rolled back too
+            os.replace(tasks_file, f'{tasks_file}.migrated')
+
+    @classmethod
+    def _insert(cls, verb: str = 'INSERT') -> str:
+        return f"{verb} INTO tasks ({', '.join(cls.COLUMNS)}) VALUES ({', '.join('?' * len(cls.COLUMNS))})"
+
+    @classmethod
+    def _row(cls, task_id: str, task: Dict[str, Any]) -> tuple:
+        return (task_id, *(task.get(f) for f in cls.INDEXED_FIELDS), json.dumps(task))
+
     @staticmethod
-    def _save_json(file_path: str, data: Dict[str, Any]) -> None:
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=4)
-    
+    def _where(status=None, key_name=None, completed_before=None, batch_id=None, parent_id=None) -> tuple:
+        clauses, params = [], []
+        if status is not None:
+            status = list(status)
+            clauses.append(f"status IN ({', '.join('?' * len(status))})")
+            params.extend(status)
+        if key_name is not None:
+            clauses.append('key_name = ?')
+            params.append(key_name)
+        if completed_before is not None:
+            clauses.append('completed_time < ?')
+            params.append(completed_before)
+        if batch_id is not None:
+            clauses.append('batch_id = ?')
+            params.append(batch_id)
+        if parent_id is not None:
+            clauses.append('parent_id = ?')
+            params.append(parent_id)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        return where, params
+
+    def load_tasks(self) -> Dict[str, Any]:
+        return self.find_tasks()
+
+    def save_tasks(self, tasks: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM tasks')
+            conn.executemany(self._insert(),
+                             [self._row(task_id, task) for task_id, task in tasks.items()])
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_tasks(self, tasks: Dict[str, Dict[str, Any]]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(self._insert('INSERT OR REPLACE'),
+                             [self._row(task_id, task) for task_id, task in tasks.items()])
+
+    def update_task(self, task_id: str, **fields) -> Optional[Dict[str, Any]]:
+        return self._update(task_id, None, fields)
+
+    def transition_task(self, task_id: str, from_status: str, **fields) -> Optional[Dict[str, Any]]:
+        return self._update(task_id, from_status, fields)
+
+    def _update(self, task_id: str, from_status: Optional[str], fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._transaction() as conn:
+            row = conn.execute('SELECT status, data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            if not row or (from_status is not None and row[0] != from_status):
+                return None
+            task = json.loads(row[1])
+            task.update(fields)
+            conn.execute(
+                f"UPDATE tasks SET {', '.join(f'{c} = ?' for c in self.COLUMNS[1:])} WHERE task_id = ?",
+                (*self._row(task_id, task)[1:], task_id)
+            )
+            return task
+
+    def delete_task(self, task_id: str) -> bool:
+        with self._transaction() as conn:
+            return conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,)).rowcount > 0
+
+    def find_tasks(self, status=None, key_name=None, completed_before=None, batch_id=None,
+                   parent_id=None) -> Dict[str, Any]:
+        where, params = self._where(status, key_name, completed_before, batch_id, parent_id)
+        rows = self.conn.execute(f'SELECT task_id, data FROM tasks{where} ORDER BY rowid', params)
+        return {task_id: json.loads(data) for task_id, data in rows}
+
+    def count_tasks(self, status=None, key_name=None, parent_id=None) -> int:
+        where, params = self._where(status, key_name, parent_id=parent_id)
+        return self.conn.execute(f'SELECT COUNT(*) FROM tasks{where}', params).fetchone()[0]
+
+    def task_ids(self) -> List[str]:
+        return [row[0] for row in self.conn.execute('SELECT task_id FROM tasks')]
+
+class _Transaction:
+    """`BEGIN IMMEDIATE` ... `COMMIT`/`ROLLBACK` around an autocommit connection."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+def create_engine() -> StorageEngine:
+    if storage.TASKS_BACKEND == 'sqlite':
+        return SqliteStorageEngine(storage.DATABASE_FILE, legacy_tasks_file=storage.TASKS_FILE)
+    if storage.TASKS_BACKEND == 'json':
+        return JsonStorageEngine(storage.TASKS_FILE)
+    raise ValueError(f"Unknown storage backend: {storage.TASKS_BACKEND}")
+
+def _timed(f):
+    """Record the latency of a Storage operation under its name."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        with storage_seconds.time(operation=f.__name__):
+            return f(*args, **kwargs)
+    return wrapper
+
+class Storage:
+    _engine: Optional[StorageEngine] = None
+    _engine_lock = threading.Lock()
+
+    @classmethod
+    def engine(cls) -> StorageEngine:
+        if cls._engine is None:
+            with cls._engine_lock:
+                if cls._engine is None:
+                    cls._engine = create_engine()
+        return cls._engine
+
     @classmethod
+    @_timed
     def load_tasks(cls) -> Dict[str, Any]:
-        return cls._load_json(storage.TASKS_FILE)
-    
+        return cls.engine().load_tasks()
+
     @classmethod
+    @_timed
     def save_tasks(cls, tasks: Dict[str, Any]) -> None:
-        cls._save_json(storage.TASKS_FILE, tasks)
-    
+        cls.engine().save_tasks(tasks)
+
     @classmethod
+    @_timed
+    def get_task(cls, task_id: str) -> Optional[Dict[str, Any]]:
+        return cls.engine().get_task(task_id)
+
+    @classmethod
+    @_timed
+    def add_task(cls, task_id: str, task: Dict[str, Any]) -> None:
+        cls.engine().add_tasks({task_id: task})
+
+    @classmethod
+    @_timed
+    def add_tasks(cls, tasks: Dict[str, Dict[str, Any]]) -> None:
+        cls.engine().add_tasks(tasks)
+
+    @classmethod
+    @_timed
+    def update_task(cls, task_id: str, **fields) -> Optional[Dict[str, Any]]:
+        return cls.engine().update_task(task_id, **fields)
+
+    @classmethod
+    @_timed
+    def transition_task(cls, task_id: str, from_status: str, **fields) -> Optional[Dict[str, Any]]:
+        return cls.engine().transition_task(task_id, from_status, **fields)
+
+    @classmethod
+    @_timed
+    def delete_task(cls, task_id: str) -> bool:
+        return cls.engine().delete_task(task_id)
+
+    @classmethod
+    @_timed
+    def find_tasks(cls, status: Optional[Iterable[str]] = None, key_name: Optional[str] = None,
+                   completed_before: Optional[str] = None, batch_id: Optional[str] = None,
+                   parent_id: Optional[str] = None) -> Dict[str, Any]:
+        return cls.engine().find_tasks(status=status, key_name=key_name,
+                                       completed_before=completed_before, batch_id=batch_id,
+                                       parent_id=parent_id)
+
+    @classmethod
+    @_timed
+    def count_tasks(cls, status: Optional[Iterable[str]] = None, key_name: Optional[str] = None,
+                    parent_id: Optional[str] = None) -> int:
+        return cls.engine().count_tasks(status=status, key_name=key_name, parent_id=parent_id)
+
+    @classmethod
+    @_timed
+    def task_ids(cls) -> List[str]:
+        return cls.engine().task_ids()
+
+    @classmethod
+    @_timed
     def load_keys(cls) -> Dict[str, Any]:
-        return cls._load_json(storage.KEYS_FILE)
-    
+        return _load_json(storage.KEYS_FILE)
+
     @classmethod
+    @_timed
     def save_keys(cls, keys: Dict[str, Any]) -> None:
-        cls._save_json(storage.KEYS_FILE, keys)
+        _save_json(storage.KEYS_FILE, keys)
+
+    @classmethod
+    @contextmanager
+    def keys_lock(cls):
+        """Exclusive lock on KEYS_FILE across processes, for read-modify-write."""
+        with open(f'{storage.KEYS_FILE}.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,264 @@
+import os
+import time
+import heapq
+import sqlite3
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from config import storage
+from config import task as task_config
+
+class FairQueue:
+    """Blocking queue that is a priority queue per API key, served round-robin.
+
+    Within one key, higher `priority` runs first and equal priorities run in
+    FIFO order. Across keys, each `get` takes from the next key in turn, so a
+    key with hundreds of queued tasks cannot starve the others.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heaps: Dict[str, List[Tuple[int, int, str]]] = {}
+        self._turns: Deque[str] = deque()
+        self._seq = itertools.count()
+        self._size = 0
+
+    def put(self, task_id: str, key_name: str, priority: int = 0) -> None:
+        with self._cond:
+            heap = self._heaps.get(key_name)
+            if heap is None:
+                heap = self._heaps[key_name] = []
+                self._turns.append(key_name)
+            heapq.heappush(heap, (-priority, next(self._seq), task_id))
+            self._size += 1
+            self._cond.notify()
+
+    def get(self) -> str:
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            key_name = self._turns.popleft()
+            heap = self._heaps[key_name]
+            _, _, task_id = heapq.heappop(heap)
+            if heap:
+                self._turns.append(key_name)
+            else:
+                del self._heaps[key_name]
+            self._size -= 1
+            return task_id
+
+    def __len__(self) -> int:
+        return self._size
+
+class TaskQueue(ABC):
+    """Hand-off of task ids from API nodes to worker nodes.
+
+    Workers `claim` a task for `QUEUE_LEASE_SECONDS`, keep the lease alive
+    with `heartbeat` while it runs and `complete` it when done. Leases that
+    run out, because the worker died or hung, are handed back to the queue
+    by `requeue_expired`. An external broker can be plugged in by
+    implementing this interface.
+    """
+
+    # Whether other processes see the same queue
+    shared = False
+
+    @abstractmethod
+    def put(self, task_id: str, pool: str, key_name: str, priority: int = 0) -> None: ...
+
+    @abstractmethod
+    def claim(self, pool: str, worker_id: str) -> Tuple[str, int]:
+        """Block until a task in `pool` is available; returns `(task_id, attempt)`."""
+
+    @abstractmethod
+    def heartbeat(self, task_id: str, worker_id: str) -> bool:
+        """Extend the lease; False if `worker_id` no longer holds it."""
+
+    @abstractmethod
+    def complete(self, task_id: str) -> None: ...
+
+    @abstractmethod
+    def requeue_expired(self) -> List[str]:
+        """Release expired leases; returns ids that ran out of attempts and were dropped."""
+
+    @abstractmethod
+    def contains(self, task_id: str) -> bool: ...
+
+    @abstractmethod
+    def pending(self) -> int: ...
+
+class LocalTaskQueue(TaskQueue):
+    """In-memory queue for a single process running both API and workers.
+
+    Nothing outlives the process, so leases need no bookkeeping.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, FairQueue] = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, pool: str) -> FairQueue:
+        with self._lock:
+            return self._queues.setdefault(pool, FairQueue())
+
+    def put(self, task_id: str, pool: str, key_name: str, priority: int = 0) -> None:
+        self._queue(pool).put(task_id, key_name, priority)
+
+    def claim(self, pool: str, worker_id: str) -> Tuple[str, int]:
+        return self._queue(pool).get(), 1
+
+    def heartbeat(self, task_id: str, worker_id: str) -> bool:
+        return True
+
+    def complete(self, task_id: str) -> None:
+        pass
+
+    def requeue_expired(self) -> List[str]:
+        return []
+
+    def contains(self, task_id: str) -> bool:
+        return False
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+class SqliteTaskQueue(TaskQueue):
+    """Queue table in a SQLite file shared by every node on the host or volume.
+
+    Claims run in `BEGIN IMMEDIATE` transactions, so a task is handed to
+    exactly one worker at a time. Keys take turns the same way as in
+    `FairQueue`: the key served longest ago goes next. Idle workers poll
+    every QUEUE_POLL_SECONDS; puts from the same process wake them at once.
+    """
+
+    shared = True
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        directory = os.path.dirname(db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS task_queue (
+                task_id TEXT PRIMARY KEY,
+                pool TEXT NOT NULL,
+                key_name TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL,
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_task_queue_pool ON task_queue(pool, worker_id)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS task_queue_turns (
+                pool TEXT NOT NULL,
+                key_name TEXT NOT NULL,
+                turn INTEGER NOT NULL,
+                PRIMARY KEY (pool, key_name)
+            )
+        ''')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def put(self, task_id: str, pool: str, key_name: str, priority: int = 0) -> None:
+        self._conn().execute(
+            'INSERT OR IGNORE INTO task_queue (task_id, pool, key_name, priority, enqueued_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (task_id, pool, key_name, priority, time.time())
+        )
+        with self._cond:
+            self._cond.notify()
+
+    def claim(self, pool: str, worker_id: str) -> Tuple[str, int]:
+        while True:
+            claimed = self._try_claim(pool, worker_id)
+            if claimed:
+                return claimed
+            with self._cond:
+                self._cond.wait(task_config.QUEUE_POLL_SECONDS)
+
+    def _try_claim(self, pool: str, worker_id: str):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''
+                SELECT q.task_id, q.key_name, q.attempts FROM task_queue q
+                LEFT JOIN task_queue_turns t ON t.pool = q.pool AND t.key_name = q.key_name
+                WHERE q.pool = ? AND q.worker_id IS NULL
+                ORDER BY COALESCE(t.turn, 0), q.priority DESC, q.enqueued_at
+                LIMIT 1
+            ''', (pool,)).fetchone()
+            if row:
+                task_id, key_name, attempts = row
+                conn.execute(
+                    'UPDATE task_queue SET worker_id = ?, lease_expires = ?, attempts = ? WHERE task_id = ?',
+                    (worker_id, time.time() + task_config.QUEUE_LEASE_SECONDS, attempts + 1, task_id)
+                )
+                conn.execute(
+                    'INSERT OR REPLACE INTO task_queue_turns VALUES (?, ?, '
+                    '(SELECT COALESCE(MAX(turn), 0) + 1 FROM task_queue_turns WHERE pool = ?))',
+                    (pool, key_name, pool)
+                )
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return (row[0], row[2] + 1) if row else None
+
+    def heartbeat(self, task_id: str, worker_id: str) -> bool:
+        cursor = self._conn().execute(
+            'UPDATE task_queue SET lease_expires = ? WHERE task_id = ? AND worker_id = ?',
+            (time.time() + task_config.QUEUE_LEASE_SECONDS, task_id, worker_id)
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, task_id: str) -> None:
+        self._conn().execute('DELETE FROM task_queue WHERE task_id = ?', (task_id,))
+
+    def requeue_expired(self) -> List[str]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            dropped = [row[0] for row in conn.execute(
+                'SELECT task_id FROM task_queue WHERE worker_id IS NOT NULL AND lease_expires < ? '
+                'AND attempts >= ?', (now, task_config.QUEUE_MAX_ATTEMPTS))]
+            conn.executemany('DELETE FROM task_queue WHERE task_id = ?', [(t,) for t in dropped])
+            requeued = conn.execute(
+                'UPDATE task_queue SET worker_id = NULL, lease_expires = NULL '
+                'WHERE worker_id IS NOT NULL AND lease_expires < ?', (now,)).rowcount
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        if requeued:
+            with self._cond:
+                self._cond.notify_all()
+        return dropped
+
+    def contains(self, task_id: str) -> bool:
+        return self._conn().execute('SELECT 1 FROM task_queue WHERE task_id = ?', (task_id,)).fetchone() is not None
+
+    def pending(self) -> int:
+        return self._conn().execute('SELECT COUNT(*) FROM task_queue WHERE worker_id IS NULL').fetchone()[0]
+
+def create_queue() -> TaskQueue:
+    if task_config.QUEUE_BACKEND == 'sqlite':
+        return SqliteTaskQueue(storage.DATABASE_FILE)
+    if task_config.QUEUE_BACKEND == 'local':
+        return LocalTaskQueue()
+    raise ValueError(f"Unknown queue backend: {task_config.QUEUE_BACKEND}")
@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from src.log import get_logger
+from src.metrics import task_phase_seconds
+from config import log as log_config
+
+logger = get_logger(__name__)
+
+class Trace:
+    """Wall-clock time spent in each phase of one task.
+
+    Every span is also observed in `ytdlp_task_phase_seconds`. A phase
+    entered more than once accumulates. `on_span` is called with the
+    timings so far after each span, e.g. to show them while the task runs.
+    """
+
+    def __init__(self, task_type: str, on_span=None):
+        self.task_type = task_type
+        self.on_span = on_span
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, phase: str):
+        """Time the `with` block as `phase`, including when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+    def add(self, phase: str, seconds: float) -> None:
+        """Record a phase measured elsewhere, e.g. in the post-processing pool."""
+        task_phase_seconds.observe(seconds, phase=phase, task_type=self.task_type)
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+        if self.on_span is not None:
+            self.on_span(self.timings())
+
+    def timings(self) -> Dict[str, float]:
+        """Seconds per phase, plus `total` since the trace started."""
+        with self._lock:
+            timings = {phase: round(seconds, 3) for phase, seconds in self._phases.items()}
+        timings['total'] = round(time.perf_counter() - self.started, 3)
+        return timings
+
+class SamplingProfiler:
+    """Statistical profiles of tasks that run longer than PROFILE_THRESHOLD_SECONDS.
+
+    While a task is tracked, one background thread samples the stack of
+    the task's worker thread every PROFILE_INTERVAL_SECONDS. Profiles of
+    tasks that finish under the threshold are thrown away; the others are
+    written to PROFILE_DIR in the collapsed format read by flame graph
+    tools ('frame;frame;frame count' per line, root first). Only the
+    worker thread is sampled, so work in the post-processing processes
+    shows up in the task's timings but not in its profile.
+    """
+
+    def __init__(self, threshold: Optional[float], interval: float, directory: str, max_files: int):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        # Thread ident -> stack counts of the task running on it
+        self._samples: Dict[int, Counter] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None
+
+    @contextmanager
+    def track(self, task_id: str):
+        """Profile the calling thread for the duration of the block."""
+        if not self.enabled:
+            yield
+            return
+        ident = threading.get_ident()
+        started = time.perf_counter()
+        with self._lock:
+            self._samples[ident] = Counter()
+            self._start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                samples = self._samples.pop(ident)
+            elapsed = time.perf_counter() - started
+            if elapsed >= self.threshold and samples:
+                try:
+                    self._save(task_id, samples)
+                    logger.info("Task took %.1fs; saved a profile of %d samples", elapsed, sum(samples.values()))
+                except OSError as e:
+                    logger.warning("Could not save profile of task %s: %s", task_id, e)
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                idents = list(self._samples)
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = self._collapse(frame)
+                with self._lock:
+                    samples = self._samples.get(ident)
+                    if samples is not None:
+                        samples[stack] += 1
+            del frames
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _path(self, task_id: str) -> str:
+        return os.path.join(self.directory, f'{task_id}.txt')
+
+    def _save(self, task_id: str, samples: Counter) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(task_id) + '.tmp'
+        with open(tmp, 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in samples.most_common())
+        os.replace(tmp, self._path(task_id))
+        self._prune()
+
+    def _prune(self) -> None:
+        """Keep the PROFILE_MAX_FILES most recent profiles."""
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.txt')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_files:]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def load(self, task_id: str) -> Optional[str]:
+        """The saved profile of `task_id`, or None if there is none."""
+        try:
+            with open(self._path(task_id)) as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+profiler = SamplingProfiler(log_config.PROFILE_THRESHOLD_SECONDS, log_config.PROFILE_INTERVAL_SECONDS,
+                            log_config.PROFILE_DIR, log_config.PROFILE_MAX_FILES)
@@ -0,0 +1,25 @@
+"""Worker node entry point: `python -m src.worker`.
+
+Runs the download pools against the shared task queue without serving the
+API. API nodes (NODE_ROLE = 'api') and worker nodes must share
+DATABASE_FILE, KEYS_FILE and DOWNLOAD_DIR, and use QUEUE_BACKEND = 'sqlite'.
+"""
+import threading
+
+from src import yt_handler
+from src.postprocess import exit_on_sigterm
+from src.log import get_logger
+
+logger = get_logger(__name__)
+
+def main():
+    downloader = yt_handler.downloader
+    if not downloader.scheduler.queue.shared:
+        raise SystemExit("Worker nodes need a shared QUEUE_BACKEND such as 'sqlite'")
+    downloader.initialize()
+    exit_on_sigterm()
+    logger.info("[STARTUP] Worker %s is processing tasks", downloader.scheduler.worker_id)
+    threading.Event().wait()
+
+if __name__ == '__main__':
+    main()
@@ -1,230 +1,170 @@
 import os
+import copy
 import json
 import time
+import glob
 import shutil
+import zipfile
 import threading
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
 from typing import Optional, Dict, Any
 
 import yt_dlp
 from yt_dlp.utils import download_range_func
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, ID3NoHeaderError
 import mutagen
 
 from src.storage import Storage
-from src.auth import memory_manager
-from src.models import TaskStatus, TaskType
+from src.auth import memory_manager, key_registry
+from src.models import Task, TaskStatus, TaskType
+from src.scheduler import TaskScheduler, REQUEUE
+from src.cache import info_cache
+from src.estimate import size_estimator
+from src.disk import DiskManager
+from src.content_cache import content_cache, link_or_copy, CACHE_DIR_NAME
+from src.progress import progress_tracker
+from src.notifications import webhook_sender
+from src.postprocess import postprocess_pool, needs_postprocessing
+from src.info_files import info_file_cache
+from src.search import SearchService
+from src.metrics import registry, tasks_finished, downloaded_bytes
+from src.tracing import Trace, profiler
+from src.log import get_logger, log_context, YtDlpLogger
 from config import storage, memory
 from config import task as task_config
 
+logger = get_logger(__name__)
+ytdlp_logger = get_logger('yt_dlp')
+
 # Log mutagen version on startup
-print(f"[STARTUP] Mutagen version: {mutagen.version_string}")
-print(f"[STARTUP] ID3 tagging is available and ready")
+logger.info("[STARTUP] Mutagen version: %s", mutagen.version_string)
+
+EXTRACTOR_ARGS = { 'youtube': { 'player_client': ['default', '-tv_simply'], }, }
+# Options that change what the extractor returns; part of the info cache key
+EXTRACT_PARAMS = { 'extractor_args': EXTRACTOR_ARGS }
 
 class YTDownloader:
     def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=task_config.MAX_WORKERS)
+        self.scheduler = TaskScheduler(self._run_task, on_dropped=self._drop_task, on_failed=self._fail_task)
+        self.disk = DiskManager(storage.DOWNLOAD_DIR, self._eviction_candidates, self._evict_task)
+        self.searcher = SearchService(EXTRACT_PARAMS)
+        registry.gauge('ytdlp_tasks', 'Stored tasks by status.', ['status'],
+                       collect=lambda: {(status.value,): Storage.count_tasks(status=[status.value])
+                                        for status in TaskStatus})
+        registry.gauge('ytdlp_disk_used_bytes', 'Used space on the download filesystem.',
+                       collect=lambda: {(): self.disk.usage()[0]})
+        registry.gauge('ytdlp_disk_total_bytes', 'Size of the download filesystem.',
+                       collect=lambda: {(): self.disk.usage()[1]})
+        registry.gauge('ytdlp_disk_reserved_bytes', 'Space reserved for downloads in progress.',
+                       collect=lambda: {(): self.disk.reserved()})
         self._ensure_download_dir()
-        print(f"[STARTUP] YTDownloader initialized with ID3 tagging support")
+        logger.debug("[STARTUP] YTDownloader initialized with ID3 tagging support")
     
     def _ensure_download_dir(self):
         os.makedirs(storage.DOWNLOAD_DIR, exist_ok=True)
 
-    def _update_mp3_id3_tags(self, file_path: str, title: str):
-        """Update MP3 ID3 tags based on title format 'artist - track'
-
-        Args:
-            file_path: Path to the MP3 file
-            title: Video/audio title from YouTube
-        """
-        try:
-            print(f"[ID3] Processing file: {file_path}")
-            print(f"[ID3] Title: {title}")
-
-            # Check if file exists
-            if not os.path.exists(file_path):
-                print(f"[ID3] ERROR: File does not exist: {file_path}")
-                return
-
-            # Check if file is MP3
-            if not file_path.lower().endswith('.mp3'):
-                print(f"[ID3] Skipping non-MP3 file: {file_path}")
-                return
-
-            # Try to load existing ID3 tags or create new ones
-            try:
-                audio = MP3(file_path, ID3=ID3)
-                if audio.tags is None:
-                    audio.add_tags()
-            except ID3NoHeaderError:
-                audio = MP3(file_path)
-                audio.add_tags()
-
-            # Parse title for "artist - track" format
-            if ' - ' in title:
-                parts = title.split(' - ', 1)  # Split only on first " - "
-                artist = parts[0].strip()
-                track = parts[1].strip()
-
-                print(f"[ID3] Setting Artist: {artist}")
-                print(f"[ID3] Setting Track: {track}")
-
-                # Delete existing tags first to avoid duplicates
-                audio.tags.delall('TPE1')
-                audio.tags.delall('TIT2')
-
-                # Update artist and title tags
-                audio.tags.add(TPE1(encoding=3, text=artist))
-                audio.tags.add(TIT2(encoding=3, text=track))
-            else:
-                print(f"[ID3] Setting Track only: {title}")
-
-                # Delete existing tags first
-                audio.tags.delall('TIT2')
-
-                # No artist separator found, just update title
-                audio.tags.add(TIT2(encoding=3, text=title))
-
-            # Save the tags
-            audio.save()
-            print(f"[ID3] ✓ Successfully updated ID3 tags for: {file_path}")
-        except Exception as e:
-            import traceback
-            print(f"[ID3] ERROR updating ID3 tags for {file_path}: {str(e)}")
-            print(f"[ID3] Traceback: {traceback.format_exc()}")
-
     def _get_task_dir(self, task_id: str) -> str:
         return os.path.join(storage.DOWNLOAD_DIR, task_id)
     
-    def _update_task(self, task_id: str, **kwargs):
-        tasks = Storage.load_tasks()
-        if task_id in tasks:
-            tasks[task_id].update(kwargs)
-            Storage.save_tasks(tasks)
+    def _update_task(self, task_id: str, from_status: Optional[str] = None, **kwargs):
+        """Update a task and act on its new status; returns whether it was applied.
+
+        With `from_status`, the update is an atomic transition that only
+        applies if the task is still in that status.
+        """
+        if from_status is None:
+            task = Storage.update_task(task_id, **kwargs)
+        else:
+            task = Storage.transition_task(task_id, from_status, **kwargs)
+            if task is None:
+                return False
+        if 'status' in kwargs:
+            progress_tracker.notify(task_id)
+        if kwargs.get('status') in (TaskStatus.COMPLETED.value, TaskStatus.ERROR.value):
+            self.disk.release(task_id)
+            if task:
+                tasks_finished.inc(task_type=task['task_type'], status=kwargs['status'])
+        if task and kwargs.get('status') == TaskStatus.ERROR.value:
+            memory_manager.release(task['key_name'], task_id)
+        if task and task.get('callback_url') and kwargs.get('status') in (
+                TaskStatus.COMPLETED.value, TaskStatus.ERROR.value):
+            webhook_sender.send(task['callback_url'], {'task_id': task_id, **task})
+        if task and task.get('parent_id') and kwargs.get('status') in (
+                TaskStatus.COMPLETED.value, TaskStatus.ERROR.value):
+            self._finish_playlist(task['parent_id'])
+        return True
     
-    def _handle_error(self, task_id: str, error: Exception):
+    def _handle_error(self, task_id: str, error: Exception, trace: Optional[Trace] = None):
+        timings = {'timings': trace.timings()} if trace else {}
         self._update_task(
             task_id,
             status=TaskStatus.ERROR.value,
             error=str(error),
-            completed_time=datetime.now().isoformat()
+            completed_time=datetime.now().isoformat(),
+            **timings
         )
-        print(f"Error in task {task_id}: {error}")
+        logger.error("Error in task %s: %s", task_id, error)
     
-    def estimate_size(self, url: str, video_format: Optional[str] = None, 
-                      audio_format: Optional[str] = None) -> int:
+    def estimate_size(self, task: dict) -> int:
+        """Expected download size of a media task in bytes; -1 if unknown."""
         try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-                'skip_download': True,
-                'extractor_args': { 'youtube': { 'player_client': ['default', '-tv_simply'], }, },
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                total_size = 0
-                formats = info.get('formats', [])
-                
-                if video_format:
-                    video_size = self._get_format_size(formats, video_format, is_video=True)
-                    if not video_size:
-                        video_size = self._get_format_size(formats, 'bestvideo', is_video=True)
-                    total_size += video_size
-                
-                if audio_format and str(audio_format).lower() not in ['none', 'null']:
-                    audio_size = self._get_format_size(formats, audio_format, is_video=False)
-                    if not audio_size:
-                        audio_size = self._get_format_size(formats, 'bestaudio', is_video=False)
-                    total_size += audio_size
-                
-                return int(total_size * memory.SIZE_BUFFER) if total_size > 0 else -1
+            return size_estimator.estimate(task['url'], self._format_spec(task), EXTRACT_PARAMS,
+                                           self._clip_seconds(task))
         except Exception as e:
-            print(f"Error in estimate_size: {str(e)}")
+            logger.warning("Error in estimate_size: %s", e)
             return -1
-    
-    def _get_format_size(self, formats: list, format_spec: str, is_video: bool) -> int:
-        if format_spec == 'bestvideo':
-            filtered = [f for f in formats if f.get('vcodec') and f.get('vcodec') != 'none']
-        elif format_spec == 'bestaudio':
-            filtered = [f for f in formats if f.get('acodec') and f.get('acodec') != 'none']
-        else:
-            filtered = [f for f in formats if f.get('format_id') == format_spec]
-        
-        if not filtered:
-            if is_video:
-                filtered = [f for f in formats if f.get('vcodec') != 'none']
-            else:
-                filtered = [f for f in formats if f.get('acodec') != 'none']
-        
-        if not filtered:
-            return 0
-        
-        best = max(filtered, key=lambda f: (f.get('filesize') or f.get('filesize_approx') or 0, f.get('tbr') or 0, f.get('height') or 0 if is_video else f.get('abr') or 0))
-        
-        size = best.get('filesize') or best.get('filesize_approx', 0)
-        
-        if size == 0:
-            duration = best.get('duration', 0)
-            if is_video:
-                bitrate = best.get('tbr') or best.get('vbr') or 0
-            else:
-                bitrate = best.get('abr') or best.get('tbr') or 0
-            
-            if duration > 0 and bitrate > 0:
-                size = int(bitrate * duration * 128)
-        
-        return size
 
-    def search(self, query: str) -> Dict[str, Any]:
+    def _clip_seconds(self, task: dict) -> Optional[float]:
+        """Length of the requested part of the media, or None for all of it."""
+        if 'live' in task['task_type']:
+            return float(task['duration']) if task.get('duration') else None
+        if task.get('start_time') or task.get('end_time'):
+            start = self._time_to_seconds(task.get('start_time', '00:00:00'))
+            end = self._time_to_seconds(task.get('end_time', '10:00:00'))
+            return max(0.0, end - start)
+        return None
+
+    def search(self, query: str, limit: int = 1, offset: int = 0) -> Dict[str, Any]:
         """Search YouTube for videos matching a query
 
         Args:
             query: Search query string (e.g., "artist - song name")
+            limit: Number of results to return
+            offset: Number of results to skip
 
         Returns:
-            Dictionary with search results including url, title, duration
+            Dictionary with the first result's url, title, duration and id,
+            and all returned entries under 'results'
+
+        Raises:
+            TimeoutError: The search did not finish in time or too many are waiting
         """
         try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': True,
-                'skip_download': True,
-                'extractor_args': { 'youtube': { 'player_client': ['default', '-tv_simply'], }, },
-            }
-
-            search_query = f"ytsearch1:{query}"
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                result = ydl.extract_info(search_query, download=False)
-
-            if result and 'entries' in result and len(result['entries']) > 0:
-                video = result['entries'][0]
-                video_url = f"https://www.youtube.com/watch?v={video['id']}"
+            results = self.searcher.search(query, limit, offset)
 
+            if results:
                 return {
                     'success': True,
-                    'url': video_url,
-                    'title': video.get('title', 'Unknown'),
-                    'duration': video.get('duration', 0),
-                    'id': video.get('id')
+                    **{k: v for k, v in results[0].items() if k != 'channel'},
+                    'results': results,
                 }
             else:
                 return {'success': False, 'message': 'No videos found'}
+        except TimeoutError:
+            raise
         except Exception as e:
-            print(f"Error in search: {str(e)}")
+            logger.warning("Error in search: %s", e)
             return {'success': False, 'message': str(e)}
 
-    def download_info(self, task_id: str):
+    def _trace(self, task_id: str, task: dict) -> Trace:
+        """Phase timings of a task, shown in its progress until it finishes."""
+        return Trace(task['task_type'], on_span=lambda timings: progress_tracker.update(task_id, timings=timings))
+
+    def download_info(self, task_id: str, task: Optional[dict] = None):
+        trace = None
         try:
-            tasks = Storage.load_tasks()
-            task = tasks[task_id]
-            self._update_task(task_id, status=TaskStatus.PROCESSING.value)
+            task = task or Storage.get_task(task_id)
+            trace = self._trace(task_id, task)
 
             has_custom_filename = task.get('output_filename')
             if has_custom_filename:
@@ -245,53 +185,181 @@ class YTDownloader:
                 'skip_download': True
             }
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(task['url'], download=False)
+            with trace.span('extract'):
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    info = ydl.process_ie_result(info_cache.extract(task['url'], EXTRACT_PARAMS), download=False)
 
-            info_file = os.path.join(download_path, info_filename)
-            with open(info_file, 'w') as f:
-                json.dump(info, f)
+            with trace.span('write'):
+                # Also saves the qualities and the offset of every top-level field beside the file,
+                # so queries on it never parse the whole document. Custom-named files get no index.
+                info_file_cache.store(os.path.join(download_path, info_filename), info,
+                                      index=not has_custom_filename)
 
             if has_custom_filename:
                 self._update_task(
                     task_id,
                     status=TaskStatus.COMPLETED.value,
                     completed_time=datetime.now().isoformat(),
-                    file=f'/files/{info_filename}'
+                    file=f'/files/{info_filename}',
+                    timings=trace.timings()
                 )
             else:
                 self._update_task(
                     task_id,
                     status=TaskStatus.COMPLETED.value,
                     completed_time=datetime.now().isoformat(),
-                    file=f'/files/{task_id}/info.json'
+                    file=f'/files/{task_id}/info.json',
+                    timings=trace.timings()
                 )
         except Exception as e:
-            self._handle_error(task_id, e)
+            self._handle_error(task_id, e, trace)
     
-    def download_media(self, task_id: str):
+    def download_playlist(self, task_id: str, task: Optional[dict] = None):
+        """Expand a playlist/channel into child media tasks.
+
+        The parent stays `processing` until every child has finished; see
+        `_finish_playlist`.
+        """
+        trace = None
+        try:
+            task = task or Storage.get_task(task_id)
+            trace = self._trace(task_id, task)
+
+            ydl_opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': 'in_playlist',
+                'skip_download': True,
+                'playlistend': task_config.MAX_PLAYLIST_ENTRIES,
+                'extractor_args': EXTRACTOR_ARGS,
+            }
+            with trace.span('extract'):
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    info = ydl.extract_info(task['url'], download=False)
+
+            if info.get('_type') in ('playlist', 'multi_video'):
+                entries = [e for e in info.get('entries') or [] if e]
+            else:
+                entries = [info]
+            entries = entries[:task_config.MAX_PLAYLIST_ENTRIES]
+            if not entries:
+                raise Exception("Playlist has no entries")
+
+            child_type = TaskType.GET_VIDEO if task.get('media_type') == 'video' else TaskType.GET_AUDIO
+            children, manifest = {}, []
+            for index, entry in enumerate(entries):
+                child_id = f"{task_id}-{index:04d}"
+                children[child_id] = Task(
+                    task_id=child_id,
+                    key_name=task['key_name'],
+                    status=TaskStatus.WAITING,
+                    task_type=child_type,
+                    url=entry.get('webpage_url') or entry.get('url'),
+                    video_format=task.get('video_format'),
+                    audio_format=task.get('audio_format'),
+                    output_format=task.get('output_format'),
+                    parent_id=task_id,
+                    priority=task.get('priority')
+                ).to_dict()
+                manifest.append({'task_id': child_id, 'url': children[child_id]['url'],
+                                 'title': entry.get('title')})
+
+            with trace.span('enqueue'):
+                self._update_task(task_id, title=info.get('title'), entries=manifest)
+                Storage.add_tasks(children)
+                for child_id, child in children.items():
+                    self.enqueue(child_id, child)
+            # The children's own timings are on the children
+            self._update_task(task_id, timings=trace.timings())
+        except Exception as e:
+            self._handle_error(task_id, e, trace)
+
+    def _finish_playlist(self, parent_id: str):
+        """Complete the parent once none of its children are still active.
+
+        Several workers, possibly on different nodes, may get here for the
+        same playlist. Files are written under temporary names and renamed
+        into place, and only the first to move the parent out of
+        'processing' records the result and sends notifications.
+        """
+        active = Storage.count_tasks(
+            status=[TaskStatus.WAITING.value, TaskStatus.PROCESSING.value], parent_id=parent_id)
+        parent = Storage.get_task(parent_id)
+        if active or not parent or parent['status'] != TaskStatus.PROCESSING.value:
+            return
+
+        try:
+            children = Storage.find_tasks(parent_id=parent_id)
+            parent_dir = self._get_task_dir(parent_id)
+            os.makedirs(parent_dir, exist_ok=True)
+
+            manifest = []
+            for entry in parent.get('entries', []):
+                child = children.get(entry['task_id'], {})
+                manifest.append({
+                    **entry,
+                    'status': child.get('status', TaskStatus.ERROR.value),
+                    'file': child.get('file'),
+                    'error': child.get('error'),
+                })
+            manifest_path = os.path.join(parent_dir, 'manifest.json')
+            tmp_path = f'{manifest_path}.tmp.{self.scheduler.worker_id}'
+            with open(tmp_path, 'w') as f:
+                json.dump({'title': parent.get('title'), 'url': parent['url'], 'entries': manifest}, f)
+            os.replace(tmp_path, manifest_path)
+
+            completed = [e for e in manifest if e['status'] == TaskStatus.COMPLETED.value]
+            file = f'/files/{parent_id}/manifest.json'
+            if parent.get('zip') and completed:
+                self._zip_playlist(parent_dir, completed)
+                file = f'/files/{parent_id}/playlist.zip'
+
+            result = {'status': TaskStatus.COMPLETED.value} if completed else {
+                'status': TaskStatus.ERROR.value, 'error': 'All playlist entries failed'}
+            self._update_task(
+                parent_id,
+                from_status=TaskStatus.PROCESSING.value,
+                completed_time=datetime.now().isoformat(),
+                manifest=f'/files/{parent_id}/manifest.json',
+                file=file,
+                **result
+            )
+        except Exception as e:
+            if self._update_task(parent_id, from_status=TaskStatus.PROCESSING.value,
+                                 status=TaskStatus.ERROR.value, error=str(e),
+                                 completed_time=datetime.now().isoformat()):
+                logger.error("Error in task %s: %s", parent_id, e)
+
+    def _zip_playlist(self, parent_dir: str, entries: list):
+        # Media is already compressed, so entries are stored as-is
+        zip_path = os.path.join(parent_dir, 'playlist.zip')
+        tmp_path = f'{zip_path}.tmp.{self.scheduler.worker_id}'
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as archive:
+            for index, entry in enumerate(entries):
+                path = os.path.join(storage.DOWNLOAD_DIR, entry['file'][len('/files/'):])
+                if os.path.isfile(path):
+                    title = entry.get('title') or entry['task_id']
+                    safe_title = ''.join(c if c.isalnum() or c in ' -_.' else '_' for c in title)
+                    archive.write(path, f"{index + 1:04d} - {safe_title}{os.path.splitext(path)[1]}")
+        os.replace(tmp_path, zip_path)
+
+    def download_media(self, task_id: str, task: Optional[dict] = None):
+        trace = None
         try:
-            tasks = Storage.load_tasks()
-            task = tasks[task_id]
-            print(f"[DOWNLOAD] Starting download_media for task: {task_id}")
-            print(f"[DOWNLOAD] Task type: {task.get('task_type')}")
-            print(f"[DOWNLOAD] URL: {task.get('url')}")
-            self._update_task(task_id, status=TaskStatus.PROCESSING.value)
+            task = task or Storage.get_task(task_id)
+            trace = self._trace(task_id, task)
+            logger.info("[DOWNLOAD] Starting %s of %s", task.get('task_type'), task.get('url'))
 
             # Check memory quota
             is_video = task['task_type'] in ['get_video', 'get_live_video']
-            print(f"[DOWNLOAD] is_video={is_video}")
-            total_size = self.estimate_size(
-                task['url'],
-                task.get('video_format') if is_video else None,
-                task.get('audio_format')
-            )
+            with trace.span('estimate'):
+                total_size = self.estimate_size(task)
 
             if total_size <= 0:
                 raise Exception("Could not estimate file size")
 
-            keys = Storage.load_keys()
-            api_key = keys[task['key_name']]['key']
+            self.disk.admit(task_id, total_size)
+            api_key = key_registry.get(task['key_name'])['key']
             memory_manager.check_and_update_quota(api_key, total_size, task_id)
 
             # Prepare download
@@ -306,111 +374,219 @@ class YTDownloader:
             os.makedirs(download_path, exist_ok=True)
 
             # Configure yt-dlp
-            ydl_opts = self._build_ydl_options(task, download_path)
+            ydl_opts = self._build_ydl_options(task, download_path, task_id)
+            is_live = 'live' in task['task_type']
 
-            # Download and get video info
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(task['url'], download=True)
-                video_title = info.get('title', '')
-
-            print(f"[DEBUG] Download completed! Video title: {video_title}")
-            print(f"[DEBUG] Now processing ID3 tags...")
-
-            # Find downloaded file and update ID3 tags for audio files
-            downloaded_file = None
-            print(f"[DEBUG] Searching for downloaded file in: {download_path}")
-            print(f"[DEBUG] has_custom_filename: {has_custom_filename}")
-            print(f"[DEBUG] is_video: {is_video}")
-
-            if has_custom_filename:
-                custom_name = task.get('output_filename')
-                print(f"[DEBUG] custom_name: {custom_name}")
-                all_files = os.listdir(download_path)
-                print(f"[DEBUG] Files in directory: {all_files}")
-                matching_files = [f for f in all_files if f.startswith(custom_name)]
-                print(f"[DEBUG] Matching files: {matching_files}")
-                if matching_files:
-                    downloaded_file = os.path.join(download_path, matching_files[0])
-                    print(f"[DEBUG] Selected file: {downloaded_file}")
-            else:
-                files = os.listdir(download_path)
-                print(f"[DEBUG] Files in directory: {files}")
-                if files:
-                    downloaded_file = os.path.join(download_path, files[0])
-                    print(f"[DEBUG] Selected file: {downloaded_file}")
-
-            # Update ID3 tags for audio downloads (MP3 format)
-            print(f"[DEBUG] About to check ID3 conditions: downloaded_file={downloaded_file}, is_video={is_video}")
-            if downloaded_file and not is_video:
-                print(f"[DEBUG] Calling _update_mp3_id3_tags with title: {video_title}")
-                self._update_mp3_id3_tags(downloaded_file, video_title)
-            else:
-                print(f"[DEBUG] Skipping ID3 update - downloaded_file={downloaded_file}, is_video={is_video}")
-
-            # Update task
-            if has_custom_filename:
-                # For custom filename, find the actual downloaded file
-                custom_name = task.get('output_filename')
-                matching_files = [f for f in os.listdir(download_path) if f.startswith(custom_name)]
-                if matching_files:
-                    self._update_task(
-                        task_id,
-                        status=TaskStatus.COMPLETED.value,
-                        completed_time=datetime.now().isoformat(),
-                        file=f'/files/{matching_files[0]}'
-                    )
-            else:
-                # Original behavior for task directory
-                files = os.listdir(download_path)
-                if files:
-                    self._update_task(
-                        task_id,
-                        status=TaskStatus.COMPLETED.value,
-                        completed_time=datetime.now().isoformat(),
-                        file=f'/files/{task_id}/{files[0]}'
+                with trace.span('extract'):
+                    # Reuse the extraction from estimate_size
+                    info = info_cache.extract(task['url'], EXTRACT_PARAMS)
+
+                    # Resolve the formats first so identical requests can share one file
+                    content_key = None
+                    if not is_live and info.get('_type', 'video') == 'video':
+                        resolved = ydl.process_ie_result(copy.deepcopy(info), download=False)
+                        content_key = content_cache.content_key(resolved, task)
+                if content_key:
+                    while True:
+                        cached_file, leader = content_cache.acquire(content_key, task_id)
+                        if cached_file or leader:
+                            break
+                        # Another task is downloading the same file; free this worker
+                        # and run again once it is done
+                        deferred = Future()
+                        if content_cache.when_ready(content_key, lambda: deferred.set_result(REQUEUE)):
+                            logger.info("[DOWNLOAD] Waiting for another task downloading the same file")
+                            self.disk.release(task_id)
+                            return deferred
+                    if cached_file:
+                        logger.info("[DOWNLOAD] Reusing cached file %s", cached_file)
+                        name = has_custom_filename or ('video' if is_video else 'audio')
+                        dest = os.path.join(download_path, name + os.path.splitext(cached_file)[1])
+                        link_or_copy(cached_file, dest)
+                        self._complete_media_task(task_id, task, download_path, trace)
+                        return
+
+                try:
+                    with trace.span('download'):
+                        info = ydl.process_ie_result(info, download=True)
+                    video_title = info.get('title', '')
+                    downloaded_file = self._find_downloaded_file(task, download_path, is_video, video_title)
+                    if downloaded_file:
+                        downloaded_bytes.inc(os.path.getsize(downloaded_file), task_type=task['task_type'])
+                except Exception:
+                    if content_key:
+                        content_cache.abandon(content_key)
+                    raise
+
+            # Transcoding and tagging run on the post-processing pool, freeing this worker
+            audio_codec = None if is_video else task.get('output_format')
+            title = None if is_video else video_title
+            if downloaded_file and needs_postprocessing(downloaded_file, audio_codec, title):
+                progress_tracker.update(task_id, stage='postprocessing', postprocessor_status='queued')
+                try:
+                    return postprocess_pool.submit(
+                        downloaded_file, audio_codec, title,
+                        lambda path, error, timings: self._finish_media_task(task_id, task, download_path, trace,
+                                                                             content_key, path, error, timings)
                     )
+                except Exception:
+                    if content_key:
+                        content_cache.abandon(content_key)
+                    raise
+
+            self._finish_media_task(task_id, task, download_path, trace, content_key, downloaded_file)
         except Exception as e:
-            self._handle_error(task_id, e)
+            self._handle_error(task_id, e, trace)
+    
+    def _find_downloaded_file(self, task: dict, download_path: str, is_video: bool,
+                              video_title: str) -> Optional[str]:
+        """Locate the file yt-dlp wrote for a task; returns its path."""
+        has_custom_filename = task.get('output_filename')
+
+        downloaded_file = None
+        if has_custom_filename:
+            custom_name = task.get('output_filename')
+            matching_files = [f for f in os.listdir(download_path) if f.startswith(custom_name)]
+            if matching_files:
+                downloaded_file = os.path.join(download_path, matching_files[0])
+        else:
+            files = os.listdir(download_path)
+            if files:
+                downloaded_file = os.path.join(download_path, files[0])
+
+        logger.debug("[DOWNLOAD] Downloaded %r (video=%s) to %s", video_title, is_video, downloaded_file)
+        return downloaded_file
+
+    def _finish_media_task(self, task_id: str, task: dict, download_path: str, trace: Trace,
+                           content_key: Optional[str], file_path: Optional[str],
+                           error: Optional[BaseException] = None,
+                           timings: Optional[Dict[str, float]] = None):
+        """Share the final file through the content cache and complete the task."""
+        for phase, seconds in (timings or {}).items():
+            trace.add(phase, seconds)
+        # Runs on the post-processing pool's callback thread, outside the task's context
+        with log_context(task_id=task_id, key_name=task.get('key_name')):
+            try:
+                if error is not None:
+                    raise error
+                if content_key:
+                    if file_path:
+                        content_cache.publish(content_key, task_id, file_path)
+                    else:
+                        content_cache.abandon(content_key)
+                    content_key = None
+                self._complete_media_task(task_id, task, download_path, trace)
+            except Exception as e:
+                if content_key:
+                    content_cache.abandon(content_key)
+                self._handle_error(task_id, e, trace)
+
+    def _complete_media_task(self, task_id: str, task: dict, download_path: str, trace: Trace):
+        has_custom_filename = task.get('output_filename')
+        if has_custom_filename:
+            # For custom filename, find the actual downloaded file
+            custom_name = task.get('output_filename')
+            matching_files = [f for f in os.listdir(download_path) if f.startswith(custom_name)]
+            if matching_files:
+                self._commit_quota(task, task_id, os.path.join(download_path, matching_files[0]))
+                self._update_task(
+                    task_id,
+                    status=TaskStatus.COMPLETED.value,
+                    completed_time=datetime.now().isoformat(),
+                    file=f'/files/{matching_files[0]}',
+                    timings=trace.timings()
+                )
+        else:
+            # Original behavior for task directory
+            files = os.listdir(download_path)
+            if files:
+                self._commit_quota(task, task_id, os.path.join(download_path, files[0]))
+                self._update_task(
+                    task_id,
+                    status=TaskStatus.COMPLETED.value,
+                    completed_time=datetime.now().isoformat(),
+                    file=f'/files/{task_id}/{files[0]}',
+                    timings=trace.timings()
+                )
+    
+    def _commit_quota(self, task: dict, task_id: str, file_path: str):
+        """Charge the key for the file's real size instead of the estimate."""
+        try:
+            memory_manager.commit(task['key_name'], task_id, os.path.getsize(file_path))
+        except OSError as e:
+            logger.warning("Could not size %s: %s", file_path, e)
     
-    def _build_ydl_options(self, task: dict, download_path: str) -> dict:
+    def _format_spec(self, task: dict) -> str:
+        """yt-dlp format string for a media task."""
+        audio_format = task.get('audio_format')
+        if task['task_type'] in ['get_video', 'get_live_video']:
+            video_format = task.get('video_format', 'bestvideo')
+            if audio_format is None or str(audio_format).lower() in ['none', 'null']:
+                return f"{video_format}/bestvideo"
+            return f"{video_format}+{audio_format}/best"
+        return f"{task.get('audio_format', 'bestaudio')}/bestaudio"
+
+    def is_streamable(self, task: dict) -> bool:
+        """Whether the file of a task is written as downloaded, with no merge, cut or conversion."""
+        if task['task_type'] not in (TaskType.GET_VIDEO.value, TaskType.GET_AUDIO.value):
+            return False
+        if task.get('start_time') or task.get('end_time'):
+            return False
+        if task['task_type'] == TaskType.GET_AUDIO.value and task.get('output_format'):
+            return False
+        return '+' not in self._format_spec(task)
+
+    def partial_file(self, task_id: str, task: dict) -> Optional[str]:
+        """Path of the `.part` file yt-dlp is writing for a task, if any.
+
+        Taken from the progress hooks when the download runs in this process,
+        otherwise looked up in the download directory.
+        """
+        progress = progress_tracker.get(task_id, private=True) or {}
+        if progress.get('tmpfilename') and os.path.exists(progress['tmpfilename']):
+            return progress['tmpfilename']
+        if task.get('output_filename'):
+            pattern = os.path.join(storage.DOWNLOAD_DIR, glob.escape(task['output_filename']) + '.*.part')
+        else:
+            pattern = os.path.join(self._get_task_dir(task_id), '*.part')
+        matches = glob.glob(pattern)
+        return matches[0] if matches else None
+
+    def _build_ydl_options(self, task: dict, download_path: str, task_id: Optional[str] = None) -> dict:
         is_video = task['task_type'] in ['get_video', 'get_live_video']
         is_live = 'live' in task['task_type']
         output_format = task.get('output_format')
-        audio_format = task.get('audio_format')
         filename = task.get('output_filename')
 
         if is_video:
-            video_format = task.get('video_format', 'bestvideo')
-            if audio_format is None or str(audio_format).lower() in ['none', 'null']:
-                format_option = f"{video_format}/bestvideo"
-            else:
-                format_option = f"{video_format}+{audio_format}/best"
             if filename:
                 output_name = f"{filename}.%(ext)s"
             else:
                 output_name = 'live_video.%(ext)s' if is_live else 'video.%(ext)s'
         else:
-            format_option = f"{task.get('audio_format', 'bestaudio')}/bestaudio"
             if filename:
                 output_name = f"{filename}.%(ext)s"
             else:
                 output_name = 'live_audio.%(ext)s' if is_live else 'audio.%(ext)s'
         
         opts = {
-            'format': format_option,
+            'format': self._format_spec(task),
             'outtmpl': os.path.join(download_path, output_name),
-            'extractor_args': { 'youtube': { 'player_client': ['default', '-tv_simply'], }, },
+            'extractor_args': EXTRACTOR_ARGS,
+            'logger': YtDlpLogger(ytdlp_logger),
+            # Progress is reported through the hooks below
+            'noprogress': True,
         }
         
-        if output_format:
-            if not is_video:
-                opts['extract_audio'] = True 
-                opts['postprocessors'] = [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': output_format,
-                }]
-            else:
-                opts['merge_output_format'] = output_format
+        if task_id:
+            progress_hook, postprocessor_hook = progress_tracker.hooks(task_id)
+            opts['progress_hooks'] = [progress_hook]
+            opts['postprocessor_hooks'] = [postprocessor_hook]
+        
+        # Audio conversion to `output_format` happens on the post-processing pool
+        if output_format and is_video:
+            opts['merge_output_format'] = output_format
         
         # Handle time ranges
         if is_live and task.get('duration'):
@@ -461,67 +637,156 @@ class YTDownloader:
             return 0.0
     
     def cleanup_task(self, task_id: str):
+        task = Storage.get_task(task_id)
+        if task:
+            memory_manager.release(task['key_name'], task_id)
+        
         task_dir = self._get_task_dir(task_id)
         if os.path.exists(task_dir):
             shutil.rmtree(task_dir, ignore_errors=True)
         
-        tasks = Storage.load_tasks()
-        if task_id in tasks:
-            del tasks[task_id]
-            Storage.save_tasks(tasks)
+        content_cache.release(task_id)
+        self.disk.forget(task_id)
+        Storage.delete_task(task_id)
+    
+    def _eviction_candidates(self) -> Dict[str, float]:
+        """Finished tasks whose files may be removed early, with when they finished."""
+        finished = [TaskStatus.COMPLETED.value, TaskStatus.ERROR.value]
+        min_age = datetime.now() - timedelta(seconds=memory.DISK_EVICT_MIN_AGE_SECONDS)
+        candidates = {}
+        for task_id, task in Storage.find_tasks(status=finished, completed_before=min_age.isoformat()).items():
+            if self._awaits_playlist(task):
+                continue
+            candidates[task_id] = datetime.fromisoformat(task['completed_time']).timestamp()
+        return candidates
+    
+    @staticmethod
+    def _awaits_playlist(task: dict) -> bool:
+        """Whether `task` is an entry of a playlist that has not been packaged yet.
+
+        Entries are needed until then; once the playlist itself has been
+        cleaned up, they are not.
+        """
+        parent_id = task.get('parent_id')
+        if not parent_id:
+            return False
+        parent = Storage.get_task(parent_id)
+        return parent is not None and parent['status'] not in (TaskStatus.COMPLETED.value, TaskStatus.ERROR.value)
+    
+    def _evict_task(self, task_id: str):
+        self.cleanup_task(task_id)
+        # Unreferenced cached copies would keep the space in use
+        content_cache.prune(idle_minutes=0)
+    
+    def enqueue(self, task_id: str, task_data: dict):
+        self.scheduler.enqueue(task_id, task_data)
     
     def process_tasks(self):
+        self.scheduler.run()
+    
+    def _run_task(self, task_id: str, task_data: dict) -> Optional[Future]:
+        with log_context(task_id=task_id, key_name=task_data.get('key_name')), profiler.track(task_id):
+            progress_tracker.notify(task_id)
+            pending = None
+            try:
+                if task_data['task_type'] == TaskType.GET_INFO.value:
+                    self.download_info(task_id, task_data)
+                elif task_data['task_type'] == TaskType.GET_PLAYLIST.value:
+                    self.download_playlist(task_id, task_data)
+                else:
+                    pending = self.download_media(task_id, task_data)
+            finally:
+                # Media handed to the post-processing pool is still in progress
+                if pending is not None:
+                    pending.add_done_callback(lambda _: progress_tracker.discard(task_id))
+                else:
+                    progress_tracker.discard(task_id)
+            return pending
+    
+    def _drop_task(self, task_id: str):
+        """A task whose worker kept dying or hanging; give up on it."""
+        task = Storage.get_task(task_id)
+        if task and task.get('status') == TaskStatus.PROCESSING.value:
+            self._handle_error(task_id, Exception('Task was interrupted'))
+    
+    def _fail_task(self, task_id: str, error: BaseException):
+        """An exception escaped the task's own error handling."""
+        self._update_task(
+            task_id,
+            from_status=TaskStatus.PROCESSING.value,
+            status=TaskStatus.ERROR.value,
+            error=str(error),
+            completed_time=datetime.now().isoformat()
+        )
+    
+    def cleanup_expired(self):
+        """Remove tasks finished more than CLEANUP_TIME_MINUTES ago.
+
+        Entries of a playlist still in progress are kept until the playlist
+        is packaged, however long ago they finished.
+        """
+        cutoff = datetime.now() - timedelta(minutes=task_config.CLEANUP_TIME_MINUTES)
+        expired = Storage.find_tasks(
+            status=[TaskStatus.COMPLETED.value, TaskStatus.ERROR.value],
+            completed_before=cutoff.isoformat()
+        )
+        for task_id, task in expired.items():
+            if not self._awaits_playlist(task):
+                self.cleanup_task(task_id)
+    
+    def cleanup_tasks(self):
+        last_orphan_cleanup = time.monotonic()
         while True:
-            tasks = Storage.load_tasks()
-            current_time = datetime.now()
-            
-            for task_id, task_data in list(tasks.items()):
-                if task_data['status'] == TaskStatus.WAITING.value:
-                    self._submit_task(task_id, task_data)
-                
-                elif task_data['status'] in [TaskStatus.COMPLETED.value, TaskStatus.ERROR.value]:
-                    if 'completed_time' in task_data:
-                        completed = datetime.fromisoformat(task_data['completed_time'])
-                        if current_time - completed > timedelta(minutes=task_config.CLEANUP_TIME_MINUTES):
-                            self.cleanup_task(task_id)
+            self.cleanup_expired()
+            content_cache.prune()
+            self.disk.relieve()
             
             # Cleanup orphaned folders every 5 minutes
-            if current_time.minute % 5 == 0 and current_time.second == 0:
+            if time.monotonic() - last_orphan_cleanup >= 300:
                 self._cleanup_orphaned_folders()
+                last_orphan_cleanup = time.monotonic()
             
-            time.sleep(1)
-    
-    def _submit_task(self, task_id: str, task_data: dict):
-        task_type = task_data['task_type']
-        
-        if task_type == TaskType.GET_INFO.value:
-            self.executor.submit(self.download_info, task_id)
-        else:
-            self.executor.submit(self.download_media, task_id)
+            time.sleep(task_config.CLEANUP_INTERVAL_SECONDS)
     
     def _cleanup_orphaned_folders(self):
-        tasks = Storage.load_tasks()
-        task_ids = set(tasks.keys())
+        task_ids = set(Storage.task_ids())
         
         for folder in os.listdir(storage.DOWNLOAD_DIR):
             folder_path = os.path.join(storage.DOWNLOAD_DIR, folder)
-            if os.path.isdir(folder_path) and folder not in task_ids:
+            if os.path.isdir(folder_path) and folder not in task_ids and folder != CACHE_DIR_NAME:
                 shutil.rmtree(folder_path, ignore_errors=True)
     
-    def initialize(self):
-        # Fix interrupted tasks
-        tasks = Storage.load_tasks()
-        for task_id, task_data in tasks.items():
-            if task_data['status'] == TaskStatus.PROCESSING.value:
-                task_data['status'] = TaskStatus.ERROR.value
-                task_data['error'] = 'Task was interrupted'
-                task_data['completed_time'] = datetime.now().isoformat()
-        Storage.save_tasks(tasks)
+    def initialize(self, run_workers: bool = True):
+        """Start this node; API-only nodes pass `run_workers=False`."""
+        if not run_workers and not self.scheduler.queue.shared:
+            raise ValueError("API-only nodes need a shared QUEUE_BACKEND such as 'sqlite'")
+        
+        # Fix interrupted tasks. Ones still in a shared queue are retried by their
+        # lease holder, or by the next worker once the lease expires.
+        for task_id, task_data in Storage.find_tasks(status=[TaskStatus.PROCESSING.value]).items():
+            if self.scheduler.queue.contains(task_id):
+                continue
+            if task_data['task_type'] == TaskType.GET_PLAYLIST.value and 'entries' in task_data:
+                # Expanded playlists wait for their entries, which may still be running elsewhere
+                self._finish_playlist(task_id)
+                continue
+            Storage.transition_task(
+                task_id,
+                TaskStatus.PROCESSING.value,
+                status=TaskStatus.ERROR.value,
+                error='Task was interrupted',
+                completed_time=datetime.now().isoformat()
+            )
+        
+        # Requeue tasks that were waiting when the server stopped
+        for task_id, task_data in Storage.find_tasks(status=[TaskStatus.WAITING.value]).items():
+            self.enqueue(task_id, task_data)
         
-        # Start processing thread
-        thread = threading.Thread(target=self.process_tasks, daemon=True)
-        thread.start()
+        # Start dispatch and cleanup threads; API-only nodes leave the shared
+        # DOWNLOAD_DIR to the workers
+        if run_workers:
+            self.scheduler.start()
+            threading.Thread(target=self.cleanup_tasks, daemon=True).start()
 
 # Initialize downloader
 downloader = YTDownloader()
-downloader.initialize()
@@ -0,0 +1,57 @@
+"""Timed cleanup must not remove entries of a playlist that is still running."""
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import setup
+
+setup()
+
+from config import task as task_config
+from src.models import TaskStatus, TaskType
+from src.storage import Storage
+from src.yt_handler import downloader
+
+def finished_at(minutes_ago: float) -> str:
+    return (datetime.now() - timedelta(minutes=minutes_ago)).isoformat()
+
+class PlaylistCleanupTest(unittest.TestCase):
+    def setUp(self):
+        old = finished_at(task_config.CLEANUP_TIME_MINUTES * 3)
+        Storage.add_tasks({
+            'list': {'task_id': 'list', 'key_name': 'admin', 'task_type': TaskType.GET_PLAYLIST.value,
+                     'status': TaskStatus.PROCESSING.value, 'url': 'http://example.com/list',
+                     'entries': [{'task_id': 'list-0000'}, {'task_id': 'list-0001'}]},
+            'list-0000': {'task_id': 'list-0000', 'key_name': 'admin', 'task_type': TaskType.GET_AUDIO.value,
+                          'status': TaskStatus.COMPLETED.value, 'url': 'http://example.com/0',
+                          'parent_id': 'list', 'completed_time': old},
+            'list-0001': {'task_id': 'list-0001', 'key_name': 'admin', 'task_type': TaskType.GET_AUDIO.value,
+                          'status': TaskStatus.PROCESSING.value, 'url': 'http://example.com/1',
+                          'parent_id': 'list'},
+            'single': {'task_id': 'single', 'key_name': 'admin', 'task_type': TaskType.GET_AUDIO.value,
+                       'status': TaskStatus.COMPLETED.value, 'url': 'http://example.com/2',
+                       'completed_time': old},
+        })
+
+    def tearDown(self):
+        for task_id in ('list', 'list-0000', 'list-0001', 'single'):
+            Storage.delete_task(task_id)
+
+    def test_entries_outlive_cleanup_time_while_playlist_runs(self):
+        downloader.cleanup_expired()
+        self.assertIsNone(Storage.get_task('single'))
+        self.assertIsNotNone(Storage.get_task('list-0000'))
+
+    def test_entries_go_once_the_playlist_is_finished(self):
+        Storage.update_task('list-0001', status=TaskStatus.COMPLETED.value, completed_time=finished_at(0))
+        Storage.update_task('list', status=TaskStatus.COMPLETED.value, completed_time=finished_at(0))
+        downloader.cleanup_expired()
+        self.assertIsNone(Storage.get_task('list-0000'))
+        self.assertIsNotNone(Storage.get_task('list-0001'))
+        self.assertIsNotNone(Storage.get_task('list'))
+
+if __name__ == '__main__':
+    unittest.main()
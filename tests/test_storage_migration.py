@@ -0,0 +1,37 @@
+"""Processes starting at once must import a legacy tasks.json exactly once."""
+import os
+import sys
+import json
+import tempfile
+import unittest
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import setup
+
+setup()
+
+from src.storage import SqliteStorageEngine
+
+def open_engine(directory: str) -> int:
+    engine = SqliteStorageEngine(os.path.join(directory, 'tasks.db'), os.path.join(directory, 'tasks.json'))
+    return len(engine.task_ids())
+
+class ConcurrentMigrationTest(unittest.TestCase):
+    def test_every_process_starts_and_sees_all_tasks(self):
+        directory = tempfile.mkdtemp(prefix='ytdlp-migrate-')
+        tasks = {f'task{i:05d}': {'task_id': f'task{i:05d}', 'key_name': 'admin', 'status': 'completed'}
+                 for i in range(5000)}
+        with open(os.path.join(directory, 'tasks.json'), 'w') as f:
+            json.dump(tasks, f)
+
+        with multiprocessing.get_context('fork').Pool(4) as pool:
+            counts = pool.map(open_engine, [directory] * 4)
+
+        self.assertEqual(counts, [len(tasks)] * 4)
+        self.assertFalse(os.path.exists(os.path.join(directory, 'tasks.json')))
+        self.assertTrue(os.path.exists(os.path.join(directory, 'tasks.json.migrated')))
+
+if __name__ == '__main__':
+    unittest.main()